@@ -1,9 +1,5 @@
 import streamlit as st
 import pandas as pd
-from langchain.agents.agent_types import AgentType
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-import openai
 from dotenv import load_dotenv
 import os
 from utils import get_customers, load_and_process_data, get_customer_invoices
@@ -109,6 +105,11 @@ with tab2:
         st.write(df.head())
 
         # Step 2: Initialize LangChain with OpenAI
+        # Imported here so the other tabs (and cold starts) don't pay for langchain/openai
+        from langchain.agents.agent_types import AgentType
+        from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+        from langchain_openai import ChatOpenAI
+
         agent = create_pandas_dataframe_agent(
         ChatOpenAI(temperature=0, model=MODEL,api_key=OPENAI_API_KEY),
         df,
@@ -1,12 +1,13 @@
 import streamlit as st
 import pandas as pd
-from langchain.agents.agent_types import AgentType
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-import openai
 from dotenv import load_dotenv
+from pydantic import ValidationError
 import os
-from utils import get_customers, load_and_process_data, get_customer_invoices
+from utils import Customer, get_customer_invoices, load_and_process_data, validate_records
+from utils.customer_directory import PAGE_SIZE, get_directory
+from utils.results import read_csv, to_pandas
+from utils.approx import EXACT_RUNNER, SAMPLE_ROWS, open_dataset, save_upload, source_columns
+from utils.storage import SNAPSHOT_DIR, current_snapshot, get_broker
 import json
 from pathlib import Path
 
@@ -34,27 +35,67 @@ st.write("Upload a CSV file, and ask questions about your data!")
 
 st.sidebar.title("Settings")
 MODEL = st.sidebar.selectbox("Select a model", ["gpt-4o", "gpt-4o-mini"])
+# Approximate mode: tabs 2 and 3 query a sample built at load time (utils/approx.py) and show error bounds
+APPROXIMATE = st.sidebar.toggle("Approximate mode (large files)", value=False)
+APPROX_SAMPLE_ROWS = st.sidebar.number_input("Sample rows", min_value=10_000, max_value=2_000_000,
+                                             value=SAMPLE_ROWS, step=10_000, disabled=not APPROXIMATE)
+
+
+# Estimates from the sample, then (when toggled) the exact result from a background thread
+def show_approximate(dataset, by, value, key, label=None):
+    estimate = to_pandas(dataset.group_by(by, value))
+    if label is not None:
+        estimate.insert(0, *label)
+    st.write(estimate)
+    st.caption(f"Estimated from {dataset.sample_rows:,} of {dataset.population:,} rows"
+               f"{' stratified by ' + dataset.strata if dataset.strata else ''}; *_ci columns are 95% error bounds.")
+    if st.toggle("Exact", key=f"{key}_exact", help="Run the full query in the background"):
+        future = EXACT_RUNNER.submit(dataset, "exact_group_by", list(by), value)
+
+        # Polls the background query without rerunning the rest of the page
+        @st.fragment(run_every=1)
+        def show_exact():
+            if not future.done():
+                st.info(f"Running the exact query over {dataset.population:,} rows...")
+                return
+            exact = to_pandas(future.result())
+            if label is not None:
+                exact.insert(0, *label)
+            st.write("Exact:")
+            st.write(exact)
+
+        show_exact()
 
 # Set up tabs to define workflow
 # Tab 1 raw data loader, 
 # Tab 2, EDA
 # Tab 3. summary reporter
 
-# Preload customer data for selection tab
-customer_list = get_customers()
+# Customer directory for the selection tab (data/customers.db): searched locally on every rerun and
+# refreshed from the API in the background once it is older than INVOICER_DIRECTORY_MAX_AGE
+directory = get_directory()
+if not len(directory):
+    with st.spinner("Loading customers from the API..."):
+        directory.refresh()
+else:
+    directory.refresh_in_background()
 # Save and reload the customer data data
-json_file_raw = RAW_DATA_DIR / "customers_raw.json"
-json_file_flat = RAW_DATA_DIR / "customers_flat.json"
+# Raw records go to the content-addressed archive (data/archive) instead of raw/flat JSON copies
 csv_file = PROCESSED_DATA_DIR / "customers.csv"
 if not csv_file.exists():
-    customer_df = load_and_process_data(customer_list, json_file_raw, json_file_flat, csv_file)
+    try:
+        customer_list = validate_records(Customer, directory.records())
+    except ValidationError as e:
+        # Not written, so the export is retried on the next rerun
+        st.error(f"Customer records failed validation: {e}")
+        customer_df = pd.DataFrame()
+    else:
+        customer_df = load_and_process_data(customer_list, None, None, csv_file, archive_key="app_customers")
 else:
     customer_df = pd.read_csv(csv_file)
 
 
 # Invoices data
-json_file_raw_invoices = RAW_DATA_DIR / "invoices_raw.json"
-json_file_flat_invoices = RAW_DATA_DIR / "invoices_flat.json"
 csv_file_invoices = PROCESSED_DATA_DIR / "invoices.csv"
 
 
@@ -67,17 +108,27 @@ with tab1:
     # Get a list of customers and their corresponding ids from the Metronome API
     st.write("Loading data from API...")
     # Show customer dataframe in table
-    # Create a lookup dicionary for the customer ids. The customer can then select a customer name and set the corresponding id
-    customer_lookup = {customer.name: customer.id for customer in customer_list}
-
-    selected_customer_name = st.selectbox("Select a customer", list(customer_lookup.keys())) 
-    selected_customer_id = customer_lookup[selected_customer_name] # Look up corresponding ID for summary reporting downstream
+    # Search the directory by name, id, external id or ingest alias; a page of matches goes in the selectbox.
+    # Entries carry the id, so customers with the same name stay distinct
+    customer_query = st.text_input("Search customers", placeholder="Name, id, external id or alias",
+                                   on_change=lambda: st.session_state.update(customer_page=1))
+    results = directory.search(customer_query, page=st.session_state.get("customer_page", 1) - 1, page_size=PAGE_SIZE)
+    st.session_state.customer_page = results.page + 1
+    st.number_input(f"Page (of {results.pages})", min_value=1, max_value=results.pages, key="customer_page")
+    st.caption(f"{results.total:,} matching customers"
+               + (" (refreshing from the API...)" if directory.refreshing else "")
+               + (f" Last refresh failed: {directory.last_error}" if directory.last_error else ""))
+    selected_customer = st.selectbox("Select a customer", results.items, format_func=lambda entry: entry.label)
+    if selected_customer is None:
+        st.warning("No customers match that search.")
+    selected_customer_name = selected_customer.name if selected_customer else None
+    selected_customer_id = selected_customer.id if selected_customer else None # Look up corresponding ID for summary reporting downstream
 
     st.write("Selected customer name:", selected_customer_name)
     st.write("Customer Unique ID:", selected_customer_id)
 
     # Create a button to get raw data for invoices, balances, and transactions
-    if st.button("Get raw data for summary reporting suite."):
+    if st.button("Get raw data for summary reporting suite.", disabled=selected_customer is None):
         # Retrieving customer data
         st.write("Getting invoices for selected customer...")
         invoices = get_customer_invoices(selected_customer_id)
@@ -85,7 +136,7 @@ with tab1:
         # Load and process data
 
         # Save and reload the customer data data
-        invoices_df = load_and_process_data(invoices, json_file_raw_invoices, json_file_flat_invoices, csv_file_invoices)
+        invoices_df = load_and_process_data(invoices, None, None, csv_file_invoices, archive_key="app_invoices")
 
         # Summary of data fetches
         st.write("Data fetches complete!")
@@ -103,37 +154,89 @@ with tab1:
 
 with tab2:
     # Summary report
-    # reload invoices data
-    invoices_df = pd.read_csv(csv_file_invoices)
-    # Add customer name column
-    invoices_df["customer_name"] = selected_customer_name
     st.write("Summary report")
     st.write("Customer name:", selected_customer_name)
     st.write("Customer id:", selected_customer_id)
-    # Only preserve finalized invoices with a total greater than 0
-    filtered_invoices = invoices_df[(invoices_df["total"] > 0) & (invoices_df["status"] == "FINALIZED")]
-    # Deduct adjustments from the total
-    filtered_invoices["adjusted_totals"] = filtered_invoices["total"] - filtered_invoices["invoice_adjustments_0_total"]
-
-    # OPTIONAL: Group by cols for data slicing and dicing
-    groupby_cols = st.multiselect("Select columns to group by", filtered_invoices.columns)
-    # Calculate total amount due - subtotal - adjustments = total
-    #invoice_totals_df = filtered_invoices.agg({"adjusted_totals": "sum", "total": "sum", "invoice_adjustments_0_total": "sum", "subtotal": "sum"})
-    invoice_totals_df = filtered_invoices.groupby(["customer_name"]+groupby_cols).agg({"total": "sum"}).reset_index()
-    st.write("Invoice Totals:")
-    st.write(invoice_totals_df)
+    if APPROXIMATE:
+        # Only finalized invoices with a total greater than 0, filtered once when the sample is built
+        strata = st.selectbox("Stratify sample by", [None] + source_columns(csv_file_invoices))
+        with st.spinner("Building sample and sketches..."):
+            dataset = open_dataset(csv_file_invoices, strata=strata, sample_rows=APPROX_SAMPLE_ROWS,
+                                   where="total > 0 AND status = 'FINALIZED'")
+        groupby_cols = st.multiselect("Select columns to group by", dataset.columns)
+        st.write("Invoice Totals:")
+        show_approximate(dataset, groupby_cols, "total", "summary", label=("customer_name", selected_customer_name))
+    else:
+        # The latest invoicer.py snapshot is read through the shared broker, so the summary matches
+        # the invoicer report; without one (or by choice) it falls back to the CSV fetched in tab 1
+        sources = ["Fetched invoices CSV"]
+        if current_snapshot(SNAPSHOT_DIR) is not None:
+            sources.insert(0, "Latest invoicer snapshot")
+        source = st.radio("Invoice source", sources, horizontal=True)
+        if source == "Latest invoicer snapshot":
+            # Only preserve finalized invoices with a total greater than 0
+            with get_broker().cursor() as cur:
+                table = cur.execute("SELECT * FROM invoices WHERE customer_id = ? AND status = 'FINALIZED' AND total > 0",
+                                    [selected_customer_id]).fetch_arrow_table()
+            filtered_invoices = to_pandas(table)
+            filtered_invoices["customer_name"] = selected_customer_name
+        else:
+            # reload invoices data (pyarrow-backed, so Streamlit gets the Arrow buffers without another copy)
+            invoices_df = read_csv(csv_file_invoices)
+            # Add customer name column
+            invoices_df["customer_name"] = selected_customer_name
+            # Only preserve finalized invoices with a total greater than 0
+            filtered_invoices = invoices_df[(invoices_df["total"] > 0) & (invoices_df["status"] == "FINALIZED")]
+            # Deduct adjustments from the total (the snapshot keeps adjustments nested, so CSV only)
+            filtered_invoices["adjusted_totals"] = filtered_invoices["total"] - filtered_invoices["invoice_adjustments_0_total"]
+
+        # OPTIONAL: Group by cols for data slicing and dicing
+        groupby_cols = st.multiselect("Select columns to group by", filtered_invoices.columns)
+        # Calculate total amount due - subtotal - adjustments = total
+        #invoice_totals_df = filtered_invoices.agg({"adjusted_totals": "sum", "total": "sum", "invoice_adjustments_0_total": "sum", "subtotal": "sum"})
+        invoice_totals_df = filtered_invoices.groupby(["customer_name"]+groupby_cols).agg({"total": "sum"}).reset_index()
+        st.write("Invoice Totals:")
+        st.write(invoice_totals_df)
 
 with tab3:
 
     # Step 1: File Upload
     uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
-    if uploaded_file:
-        # Load CSV to DataFrame
-        df = pd.read_csv(uploaded_file)
-        st.write("Preview of uploaded data:")
-        st.write(df.head())
+    # Exports too big for the uploader can be opened from disk in approximate mode
+    local_path = st.text_input("...or the path of a CSV/Parquet file on this machine") if APPROXIMATE else ""
+    if uploaded_file or local_path:
+        if APPROXIMATE:
+            if local_path:
+                source_file = Path(local_path)
+            else:
+                # DuckDB reads from disk; one copy per distinct upload content
+                uploaded_file.seek(0)
+                source_file = save_upload(uploaded_file, uploaded_file.name)
+            strata = st.selectbox("Stratify sample by", [None] + source_columns(source_file), key="explore_strata")
+            with st.spinner("Building sample and sketches..."):
+                dataset = open_dataset(source_file, strata=strata, sample_rows=APPROX_SAMPLE_ROWS)
+            st.write("Preview of uploaded data:")
+            st.write(to_pandas(dataset.head()))
+            st.write("Columns (distinct counts from HyperLogLog, quantiles from t-digest, over all rows):")
+            st.write(to_pandas(dataset.profile()))
+            explore_by = st.multiselect("Group by", dataset.columns, key="explore_by")
+            explore_value = st.selectbox("Aggregate column", [None] + dataset.numeric_columns, key="explore_value")
+            show_approximate(dataset, explore_by, explore_value, "explore")
+            # The assistant works on the sample
+            df = to_pandas(dataset.sample_table())
+            st.caption(f"The assistant below sees the {len(df):,}-row sample, not the full file.")
+        else:
+            # Load CSV to DataFrame
+            df = pd.read_csv(uploaded_file)
+            st.write("Preview of uploaded data:")
+            st.write(df.head())
 
         # Step 2: Initialize LangChain with OpenAI
+        # Imported here so the other tabs (and cold starts) don't pay for langchain/openai
+        from langchain.agents.agent_types import AgentType
+        from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+        from langchain_openai import ChatOpenAI
+
         agent = create_pandas_dataframe_agent(
         ChatOpenAI(temperature=0, model=MODEL,api_key=OPENAI_API_KEY),
         df,
@@ -0,0 +1,97 @@
+# Benchmark for approximate exploration (utils/approx.py)
+# Writes a synthetic invoices CSV (skewed customers, a rare status), opens it as an ApproxDataset
+# and compares each group-by on the sample against the exact query on the full table: latency,
+# and how often the exact value falls inside the reported 95% interval.
+#
+# Usage (from the task1 folder):
+#   python -m bench.approx_explore --rows 5000000 --sample-rows 100000
+#   python -m bench.approx_explore --rows 5000000 --strata status
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from bench.run_benchmarks import percentile
+
+GROUPINGS = [[], ["status"], ["customer_id"], ["status", "currency"]]
+
+
+def write_csv(path: Path, rows: int, customers: int, seed: int) -> None:
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute(f"SELECT setseed({seed / 100})")
+    # Customer sizes follow a power law; 0.5% of invoices are VOID
+    con.execute(f"""COPY (
+        SELECT i AS id,
+               'cus_' || CAST(floor(pow(random(), 3) * {customers}) AS INTEGER) AS customer_id,
+               CASE WHEN random() < 0.005 THEN 'VOID' WHEN random() < 0.3 THEN 'DRAFT' ELSE 'FINALIZED' END AS status,
+               CASE WHEN random() < 0.8 THEN 'USD' ELSE 'EUR' END AS currency,
+               round(exp(random() * 8), 2) AS total
+        FROM range({rows}) t(i)
+    ) TO '{path}' (HEADER)""")
+    con.close()
+
+
+def _key(row: Dict[str, Any], by: List[str]) -> tuple:
+    return tuple(row[c] for c in by)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from utils.approx import open_dataset
+
+    with tempfile.TemporaryDirectory(prefix="approx_explore_") as tmp:
+        path = Path(tmp) / "invoices.csv"
+        write_csv(path, args.rows, args.customers, args.seed)
+        start = time.perf_counter()
+        dataset = open_dataset(path, strata=args.strata, sample_rows=args.sample_rows, explore_dir=Path(tmp) / "explore")
+        load_seconds = time.perf_counter() - start
+
+        report: Dict[str, Any] = {"rows": dataset.population, "sample_rows": dataset.sample_rows,
+                                  "strata": args.strata, "load_seconds": round(load_seconds, 2), "groupings": []}
+        for by in GROUPINGS:
+            approx_times, exact_times = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                estimate = dataset.group_by(by, "total").to_pylist()
+                approx_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                exact = dataset.exact_group_by(by, "total").to_pylist()
+                exact_times.append(time.perf_counter() - start)
+            exact_by_key = {_key(row, by): row for row in exact}
+            covered = {"row_count": 0, "value_sum": 0, "value_mean": 0}
+            for row in estimate:
+                truth = exact_by_key[_key(row, by)]
+                for measure in covered:
+                    if abs(row[measure] - truth[measure]) <= row[f"{measure}_ci"] + 1e-9:
+                        covered[measure] += 1
+            report["groupings"].append({
+                "by": by,
+                "groups_exact": len(exact),
+                "groups_estimated": len(estimate),
+                "approx_p50_ms": round(percentile(approx_times, 50) * 1000, 1),
+                "exact_p50_ms": round(percentile(exact_times, 50) * 1000, 1),
+                "ci_coverage": {m: round(n / max(len(estimate), 1), 3) for m, n in covered.items()},
+            })
+        dataset.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Approximate vs exact group-bys on a synthetic export")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--sample-rows", type=int, default=100_000)
+    parser.add_argument("--strata", help="Column to stratify the sample on, e.g. status")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="Write the report as JSON here")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,103 @@
+# Memory benchmark: fetchdf() vs the Arrow result path (utils/results.py)
+# Loads a synthetic, wide invoices table (line items and adjustments stored as text, as invoicer.py
+# does) into DuckDB, then runs each variant in its own process so every one starts cold and gets
+# its own peak RSS:
+#   fetchdf        con.execute(...).fetchdf()                      (object-dtype strings)
+#   fetchdf_csv    fetchdf() then DataFrame.to_csv()               (the old report path)
+#   arrow_pandas   fetch_arrow_table() -> pd.ArrowDtype frame
+#   arrow_csv      record batches streamed to CSV                  (the new report path)
+#
+# Usage (from the task1 folder):
+#   python -m bench.arrow_memory --customers 2000 --invoices-per-customer 24
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from bench.generate_data import generate
+from bench.run_benchmarks import RssSampler, TASK1_DIR, current_rss
+
+VARIANTS = ["fetchdf", "fetchdf_csv", "arrow_pandas", "arrow_csv"]
+QUERY = "SELECT * FROM invoices ORDER BY customer_id, start_timestamp"
+
+
+def build_db(db_path: Path, customers: int, invoices_per_customer: int, line_items: int) -> int:
+    import duckdb
+    from utils.warehouse import append_rows, create_tables, to_row
+
+    dataset = generate(customers=customers, invoices_per_customer=invoices_per_customer,
+                       grants_per_customer=0, events=0, line_items=line_items)
+    con = duckdb.connect(str(db_path))
+    create_tables(con)
+    rows = [to_row(invoice) for invoices in dataset["invoices"].values() for invoice in invoices]
+    for start in range(0, len(rows), 10_000):
+        append_rows(con, "invoices", rows[start:start + 10_000])
+    con.close()
+    return len(rows)
+
+
+# Runs in the child process
+def run_variant(variant: str, db_path: Path, out_dir: Path) -> Dict[str, Any]:
+    import duckdb
+    from utils.results import fetch_arrow, stream_batches, to_pandas, write_csv
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    baseline = current_rss()
+    start = time.perf_counter()
+    with RssSampler() as rss:
+        result = con.execute(QUERY)
+        if variant == "fetchdf":
+            df = result.fetchdf()
+            rows, frame_bytes = len(df), int(df.memory_usage(deep=True).sum())
+        elif variant == "fetchdf_csv":
+            df = result.fetchdf()
+            df.to_csv(out_dir / "fetchdf.csv", index=False)
+            rows, frame_bytes = len(df), int(df.memory_usage(deep=True).sum())
+        elif variant == "arrow_pandas":
+            df = to_pandas(fetch_arrow(result))
+            rows, frame_bytes = len(df), int(df.memory_usage(deep=True).sum())
+        elif variant == "arrow_csv":
+            rows, frame_bytes = write_csv(stream_batches(result), out_dir / "arrow.csv"), 0
+        else:
+            raise ValueError(f"Unknown variant {variant}")
+    return {
+        "variant": variant,
+        "rows": rows,
+        "seconds": round(time.perf_counter() - start, 3),
+        "peak_rss_delta_mb": round((rss.peak - baseline) / 1e6, 1),
+        "frame_mb": round(frame_bytes / 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fetchdf and Arrow result memory")
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--invoices-per-customer", type=int, default=24)
+    parser.add_argument("--line-items", type=int, default=6)
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help="Write the results as JSON here")
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, Path(args.db), Path(args.db).parent)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory(prefix="arrow_bench_") as tmp:
+        db_path = Path(tmp) / "bench.db"
+        total = build_db(db_path, args.customers, args.invoices_per_customer, args.line_items)
+        print(f"Loaded {total} invoices")
+        results = []
+        for variant in VARIANTS:
+            proc = subprocess.run([sys.executable, "-m", "bench.arrow_memory", "--variant", variant, "--db", str(db_path)],
+                                  cwd=TASK1_DIR, capture_output=True, text=True, check=True)
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            r = results[-1]
+            print(f"{variant:<14} {r['seconds']:>7.3f}s  peak +{r['peak_rss_delta_mb']:>8.1f} MB  frame {r['frame_mb']:>8.1f} MB")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
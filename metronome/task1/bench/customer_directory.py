@@ -0,0 +1,94 @@
+# Benchmark for the local customer directory (utils/customer_directory.py)
+# Fills a directory from generated customer pages (some with duplicate names), then measures the
+# first and a no-change refresh, reopening the store, exact resolves by id / external id / alias,
+# and prefix, fuzzy and empty searches.
+#
+# Usage (from the task1 folder):
+#   python -m bench.customer_directory --customers 50000
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from bench.generate_data import generate
+from bench.run_benchmarks import percentile
+
+
+def _pages(customers: List[Dict[str, Any]], page_size: int) -> List[Dict[str, Any]]:
+    return [{"data": customers[i:i + page_size],
+             "next_page": str(i + page_size) if i + page_size < len(customers) else None}
+            for i in range(0, len(customers), page_size)]
+
+
+def _latency(fn: Callable[[Any], Any], args: List[Any]) -> Dict[str, float]:
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    return {"p50_us": round(percentile(times, 50) * 1e6, 1), "p99_us": round(percentile(times, 99) * 1e6, 1)}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from utils.customer_directory import CustomerDirectory
+
+    customers = generate(customers=args.customers, invoices_per_customer=0, grants_per_customer=0,
+                         events=0, seed=args.seed)["customers"]
+    # Every 50th customer shares its name with the one before
+    for i in range(1, len(customers), 50):
+        customers[i]["name"] = customers[i - 1]["name"]
+    pages = _pages(customers, args.page_size)
+    sample = customers[::max(1, len(customers) // args.lookups)][:args.lookups]
+
+    with tempfile.TemporaryDirectory(prefix="customer_directory_") as tmp:
+        path = Path(tmp) / "customers.db"
+        directory = CustomerDirectory(path)
+        start = time.perf_counter()
+        first = directory.refresh(pages)
+        first_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        again = directory.refresh(pages)
+        again_seconds = time.perf_counter() - start
+        directory.close()
+        start = time.perf_counter()
+        directory = CustomerDirectory(path)
+        open_seconds = time.perf_counter() - start
+
+        names = [c["name"] for c in sample]
+        report = {
+            "customers": len(directory),
+            "first_refresh_seconds": round(first_seconds, 2),
+            "first_refresh": first,
+            "unchanged_refresh_seconds": round(again_seconds, 2),
+            "unchanged_refresh": again,
+            "open_seconds": round(open_seconds, 2),
+            "resolve_id": _latency(directory.resolve, [c["id"] for c in sample]),
+            "resolve_external_id": _latency(directory.resolve, [c["external_id"] or c["id"] for c in sample]),
+            "resolve_alias": _latency(directory.resolve, [c["ingest_aliases"][0] for c in sample]),
+            "search_prefix": _latency(directory.search, [n[:3] for n in names]),
+            "search_fuzzy": _latency(lambda q: directory.search(q, fuzzy=True),
+                                     [n[:-2] + n[-1] + n[-2] for n in names[:50]]),
+            "search_empty": _latency(directory.search, [""] * 50),
+            "duplicate_names_distinct": all(len(directory.lookup(customers[i]["name"])) >= 2
+                                            for i in range(1, len(customers), 50)),
+        }
+        directory.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Customer directory refresh and lookup latency")
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="Write the report as JSON here")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
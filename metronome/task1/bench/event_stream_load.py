@@ -0,0 +1,153 @@
+# Load test for streaming event ingestion (utils/events.py, stream_events.py)
+# A generator process emits egress-shaped events at a fixed rate (default 100k/sec) into an NDJSON
+# file or the ingestor's socket, resending a share of earlier events to exercise dedup. Each
+# event's timestamp is its emit time, so lag = commit time - event timestamp. Reports the emit
+# and ingest rates, lag percentiles, and checks that event_counters match what was sent.
+#
+# Usage (from the task1 folder):
+#   python -m bench.event_stream_load --rate 40000 --seconds 10 --source file
+#   python -m bench.event_stream_load --rate 100000 --seconds 10 --source socket --batch-rows 20000
+import argparse
+import json
+import multiprocessing
+import random
+import socket
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+from bench.generate_data import IMAGE_SIZES, generate
+from bench.run_benchmarks import percentile
+
+TICK = 0.01
+
+
+def _aliases(customers: int) -> List[str]:
+    dataset = generate(customers=customers, invoices_per_customer=0, grants_per_customer=0, events=0)
+    return [c["ingest_aliases"][0] for c in dataset["customers"]]
+
+
+# Runs in the generator process; sends counts back on `results`
+def emit(target: Dict[str, Any], rate: int, seconds: float, customers: int, dup_rate: float, seed: int,
+         results) -> None:
+    rng = random.Random(seed)
+    aliases = _aliases(customers)
+    recent: "deque[str]" = deque(maxlen=10_000)
+    sent, unique, num_images = 0, 0, 0
+    if target["kind"] == "socket":
+        sock = socket.create_connection((target["host"], target["port"]))
+        write = sock.sendall
+    else:
+        out = open(target["path"], "ab", buffering=0)
+        write = out.write
+    per_tick = max(1, int(rate * TICK))
+    start = time.perf_counter()
+    ticks = int(seconds / TICK)
+    for tick in range(ticks):
+        ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+        lines = []
+        for _ in range(per_tick):
+            if recent and rng.random() < dup_rate:
+                lines.append(rng.choice(recent))
+                continue
+            images = rng.randint(1, 8)
+            line = ('{"transaction_id":"%032x","customer_id":"%s","timestamp":"%s","event_type":"image_modeler",'
+                    '"properties":"{num_images=%d, image_size=%s}","environment_type":"PRODUCTION"}\n'
+                    % (rng.getrandbits(128), rng.choice(aliases), ts, images, rng.choice(IMAGE_SIZES)))
+            recent.append(line)
+            lines.append(line)
+            unique += 1
+            num_images += images
+        write("".join(lines).encode())
+        sent += len(lines)
+        # Pace to the target rate; if we fall behind, keep sending flat out
+        delay = start + (tick + 1) * TICK - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    if target["kind"] == "socket":
+        sock.close()
+    else:
+        out.close()
+    results.put({"sent": sent, "unique": unique, "num_images": num_images, "emit_seconds": elapsed})
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import duckdb
+    from utils.events import EventIngestor, FileTailer, SocketSource
+
+    with tempfile.TemporaryDirectory(prefix="event_stream_") as tmp:
+        con = duckdb.connect(str(Path(tmp) / "events.db"))
+        ingestor = EventIngestor(con, max_rows=args.batch_rows, max_latency=args.batch_ms / 1000)
+        if args.source == "socket":
+            source = SocketSource("127.0.0.1", 0, ingestor.inbox)
+            target = {"kind": "socket", "host": source.address[0], "port": source.address[1]}
+        else:
+            path = Path(tmp) / "events.ndjson"
+            source = FileTailer(path, ingestor.inbox, poll=0.005)
+            target = {"kind": "file", "path": str(path)}
+        ingestor.start()
+        source.start()
+
+        results = multiprocessing.Queue()
+        generator = multiprocessing.Process(target=emit, args=(target, args.rate, args.seconds, args.customers,
+                                                               args.dup_rate, args.seed, results))
+        start = time.perf_counter()
+        generator.start()
+        sent = results.get()
+        generator.join()
+        # Wait for the ingestor to catch up with everything sent
+        deadline = time.perf_counter() + args.drain_timeout
+        while ingestor.stats["received"] < sent["sent"] and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        caught_up = time.perf_counter() - start
+        source.stop()
+        if isinstance(source, FileTailer):
+            source.join()
+        ingestor.stop()
+
+        events, num_images = con.execute("SELECT SUM(events), SUM(num_images) FROM event_counters").fetchone()
+        rows = con.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        con.close()
+
+    lags = list(ingestor.lags)
+    report = {
+        "source": args.source,
+        "target_rate": args.rate,
+        "sent": sent["sent"],
+        "emit_rate": round(sent["sent"] / sent["emit_seconds"]),
+        "ingest_rate": round(ingestor.stats["received"] / caught_up),
+        "batches": ingestor.stats["batches"],
+        "inserted": ingestor.stats["inserted"],
+        "duplicates": ingestor.stats["duplicates"],
+        "rejected": ingestor.stats["rejected"],
+        "lag_p50_ms": round(percentile(lags, 50) * 1000, 1) if lags else None,
+        "lag_p99_ms": round(percentile(lags, 99) * 1000, 1) if lags else None,
+        "lag_max_ms": round(max(lags) * 1000, 1) if lags else None,
+        "counters_match": rows == sent["unique"] and events == sent["unique"] and num_images == sent["num_images"],
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming event ingestion load test")
+    parser.add_argument("--source", choices=["file", "socket"], default="file")
+    parser.add_argument("--rate", type=int, default=100_000, help="Events per second to emit")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--dup-rate", type=float, default=0.01, help="Share of events that are resends")
+    parser.add_argument("--batch-rows", type=int, default=10_000)
+    parser.add_argument("--batch-ms", type=float, default=250)
+    parser.add_argument("--drain-timeout", type=float, default=60, help="Max seconds to wait for the ingestor to catch up")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="Write the report as JSON here")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,233 @@
+# Synthetic Metronome data for benchmarking
+# Produces customers, invoices (with nested line items), credit grants and egress
+# events shaped like the real API responses so they validate against the models in utils.
+#
+# Usage (from the task1 folder):
+#   python -m bench.generate_data --customers 1000 --invoices-per-customer 12 --out bench_data
+import argparse
+import csv
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+USD = {"id": "2714e483-4ff1-48e4-9e25-ac732e8f24f2", "name": "USD (cents)"}
+PLANS = [
+    ("Infra SaaS Paygo", "d1c1a1f0-6b1c-4a52-9d52-7a4f3b1b0a01"),
+    ("Infra SaaS Committed", "d1c1a1f0-6b1c-4a52-9d52-7a4f3b1b0a02"),
+    ("Image Modeler Pro", "d1c1a1f0-6b1c-4a52-9d52-7a4f3b1b0a03"),
+]
+PRODUCTS = [
+    ("CPU Hours", ["c5.4xlarge", "m5.12xlarge", "r5.2xlarge"]),
+    ("Storage", ["us-east-1", "us-east-2", "ca-central-1"]),
+    ("Image Modeler", ["256x256", "512x512", "1024x1024"]),
+]
+IMAGE_SIZES = ["256x256", "512x512", "1024x1024"]
+START_DATE = datetime(2024, 1, 1)
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _ts(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def make_customer(rng: random.Random, i: int) -> Dict[str, Any]:
+    name = f"{chr(65 + i % 26)}{i} Company"
+    return {
+        "id": _uuid(rng),
+        "name": name,
+        "external_id": f"ext_{i}" if rng.random() < 0.8 else None,
+        "ingest_aliases": [f"{name.lower().replace(' ', '_')}"],
+        "custom_fields": {"x_account_id": str(i)},
+        "customer_config": {"salesforce_account_id": None},
+    }
+
+
+def make_line_item(rng: random.Random, sub_lines: int) -> Dict[str, Any]:
+    product_name, variants = rng.choice(PRODUCTS)
+    sub_line_items = []
+    for _ in range(sub_lines):
+        quantity = rng.randint(1, 500)
+        price = round(rng.uniform(0.5, 25), 2)
+        sub_line_items.append({
+            "charge_id": _uuid(rng),
+            "name": f"{product_name} ({rng.choice(variants)})",
+            "subtotal": round(quantity * price, 2),
+            "price": price,
+            "quantity": quantity,
+            "custom_fields": {},
+        })
+    return {
+        "total": round(sum(s["subtotal"] for s in sub_line_items), 2),
+        "credit_type": USD,
+        "name": product_name,
+        "product_id": _uuid(rng),
+        "quantity": sum(s["quantity"] for s in sub_line_items),
+        "custom_fields": {},
+        "sub_line_items": sub_line_items,
+    }
+
+
+def make_invoices(rng: random.Random, customer: Dict[str, Any], n: int,
+                  line_items: int = 3, sub_lines: int = 3) -> List[Dict[str, Any]]:
+    invoices = []
+    plan_name, plan_id = rng.choice(PLANS)
+    for month in range(n):
+        start = START_DATE + timedelta(days=30 * month)
+        items = [make_line_item(rng, sub_lines) for _ in range(line_items)]
+        subtotal = round(sum(li["total"] for li in items), 2)
+        adjustment = round(-subtotal * rng.choice([0, 0, 0.1]), 2)
+        invoices.append({
+            "id": _uuid(rng),
+            "start_timestamp": _ts(start),
+            "end_timestamp": _ts(start + timedelta(days=30)),
+            "customer_id": customer["id"],
+            "customer_custom_fields": {},
+            "type": "USAGE",
+            "credit_type": USD,
+            "plan_id": plan_id,
+            "plan_name": plan_name,
+            "plan_custom_fields": {},
+            "status": "FINALIZED" if month < n - 1 else "DRAFT",
+            "total": round(subtotal + adjustment, 2),
+            "external_invoice": None,
+            "subtotal": subtotal,
+            "line_items": items,
+            "invoice_adjustments": [{"total": adjustment, "credit_type": USD}],
+            "custom_fields": {},
+            "billable_status": "billable",
+        })
+    return invoices
+
+
+def make_credit_grants(rng: random.Random, customer: Dict[str, Any], n: int,
+                       deductions: int = 5) -> List[Dict[str, Any]]:
+    grants = []
+    for g in range(n):
+        grant_id = _uuid(rng)
+        effective_at = START_DATE + timedelta(days=rng.randint(0, 60))
+        amount = float(rng.choice([5000, 10000, 50000]))
+        running = amount
+        entries = []
+        for d in range(deductions):
+            spend = round(min(running, rng.uniform(0, amount / deductions)), 2)
+            running = round(running - spend, 2)
+            entries.append({
+                "amount": -spend,
+                "reason": "invoice",
+                "running_balance": running,
+                "effective_at": _ts(effective_at + timedelta(days=7 * (d + 1))),
+                "created_by": "Metronome",
+                "credit_grant_id": grant_id,
+                "invoice_id": _uuid(rng),
+            })
+        pending = round(min(running, rng.uniform(0, amount / deductions)), 2)
+        grants.append({
+            "id": grant_id,
+            "name": f"Prepaid credits {g}",
+            "customer_id": customer["id"],
+            "uniqueness_key": None,
+            "reason": "prepaid",
+            "effective_at": _ts(effective_at),
+            "expires_at": _ts(effective_at + timedelta(days=365)),
+            "priority": float(rng.randint(1, 3)),
+            "grant_amount": {"amount": amount, "credit_type": USD},
+            "paid_amount": {"amount": amount, "credit_type": USD},
+            "balance": {
+                "including_pending": int(running - pending),
+                "excluding_pending": int(running),
+                "effective_at": entries[-1]["effective_at"] if entries else _ts(effective_at),
+            },
+            "deductions": entries,
+            "pending_deductions": [{
+                "amount": -pending,
+                "reason": "pending invoice",
+                "running_balance": round(running - pending, 2),
+                "effective_at": _ts(effective_at + timedelta(days=7 * (deductions + 1))),
+                "created_by": "Metronome",
+                "credit_grant_id": grant_id,
+                "invoice_id": None,
+            }],
+            "custom_fields": None,
+            "credit_grant_type": "PREPAID",
+        })
+    return grants
+
+
+def make_event(rng: random.Random, customer: Dict[str, Any], when: datetime) -> Dict[str, Any]:
+    # Matches the egress `events` table; properties use the PG key=value encoding
+    return {
+        "transaction_id": _uuid(rng),
+        "customer_id": customer["ingest_aliases"][0],
+        "timestamp": when.strftime("%Y-%m-%d %H:%M:%S"),
+        "event_type": "image_modeler",
+        "properties": f"{{num_images={rng.randint(1, 8)}, image_size={rng.choice(IMAGE_SIZES)}}}",
+        "environment_type": "PRODUCTION",
+    }
+
+
+def generate(customers: int = 100, invoices_per_customer: int = 12, grants_per_customer: int = 2,
+             events: int = 10000, line_items: int = 3, sub_lines: int = 3, seed: int = 42) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    customer_list = [make_customer(rng, i) for i in range(customers)]
+    invoices = {c["id"]: make_invoices(rng, c, invoices_per_customer, line_items, sub_lines) for c in customer_list}
+    grants = [g for c in customer_list for g in make_credit_grants(rng, c, grants_per_customer)]
+    event_list = []
+    if customer_list:
+        span = int(timedelta(days=90).total_seconds())
+        event_list = [make_event(rng, rng.choice(customer_list), START_DATE + timedelta(seconds=rng.randint(0, span)))
+                      for _ in range(events)]
+    return {"customers": customer_list, "invoices": invoices, "credit_grants": grants, "events": event_list}
+
+
+# Write a generated dataset to disk so the mock API (and the Task 2 loaders) can serve it
+def write_dataset(dataset: Dict[str, Any], out_dir: Path) -> None:
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / "customers.json", "w") as f:
+        json.dump(dataset["customers"], f)
+    with open(out_dir / "invoices.json", "w") as f:
+        json.dump(dataset["invoices"], f)
+    with open(out_dir / "credit_grants.json", "w") as f:
+        json.dump(dataset["credit_grants"], f)
+    with open(out_dir / "events.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["transaction_id", "customer_id", "timestamp",
+                                               "event_type", "properties", "environment_type"])
+        writer.writeheader()
+        writer.writerows(dataset["events"])
+
+
+def load_dataset(data_dir: Path) -> Dict[str, Any]:
+    data_dir = Path(data_dir)
+    with open(data_dir / "customers.json") as f:
+        customers = json.load(f)
+    with open(data_dir / "invoices.json") as f:
+        invoices = json.load(f)
+    with open(data_dir / "credit_grants.json") as f:
+        grants = json.load(f)
+    return {"customers": customers, "invoices": invoices, "credit_grants": grants, "events": []}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Metronome dataset")
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--invoices-per-customer", type=int, default=12)
+    parser.add_argument("--grants-per-customer", type=int, default=2)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--line-items", type=int, default=3)
+    parser.add_argument("--sub-lines", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_data")
+    args = parser.parse_args()
+
+    dataset = generate(args.customers, args.invoices_per_customer, args.grants_per_customer,
+                       args.events, args.line_items, args.sub_lines, args.seed)
+    write_dataset(dataset, Path(args.out))
+    print(f"Wrote {len(dataset['customers'])} customers, "
+          f"{sum(len(v) for v in dataset['invoices'].values())} invoices, "
+          f"{len(dataset['credit_grants'])} credit grants and {len(dataset['events'])} events to {args.out}")
@@ -0,0 +1,124 @@
+# Import-time budget check
+# Measures cold import time of the API client, invoicer.py and the query service with
+# `python -X importtime`, and fails when a target exceeds its budget or pulls in a module it
+# should load lazily (e.g. pandas for the API client). The Streamlit apps can't be imported
+# outside `streamlit run`, so their top-level imports are checked statically instead.
+#
+# Budgets come from bench/import_baseline.json (committed); refresh it after an intended change.
+#
+# Usage (from the task1 folder):
+#   python -m bench.import_time
+#   python -m bench.import_time --save-baseline bench/import_baseline.json
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+TASK1_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = TASK1_DIR / "bench" / "import_baseline.json"
+
+# Module to import -> modules it must not load at import time
+IMPORT_TARGETS: Dict[str, List[str]] = {
+    "utils": ["pandas", "duckdb", "langchain", "openai", "streamlit"],
+    "invoicer": ["duckdb", "langchain", "openai", "streamlit"],
+    "query_service": ["langchain", "openai", "streamlit"],
+}
+
+# App file -> packages that must not be imported at module level
+APP_FILES: Dict[Path, List[str]] = {
+    TASK1_DIR / "app.py": ["langchain", "langchain_experimental", "langchain_openai", "openai"],
+    TASK1_DIR.parent / "app.py": ["langchain", "langchain_experimental", "langchain_openai", "openai"],
+}
+
+
+# One cold import under -X importtime; returns (cumulative microseconds, modules imported)
+def measure_import(module: str) -> Tuple[int, List[str]]:
+    env = dict(os.environ, PYTHONPATH=str(TASK1_DIR))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=TASK1_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    total, modules = 0, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            cumulative_us = int(cumulative)
+        except ValueError:
+            continue  # header line
+        name = name.rstrip()
+        modules.append(name.strip())
+        # Top-level entries (no indentation) are what this import actually cost
+        if not name.startswith("  "):
+            total += cumulative_us
+    return total, modules
+
+
+def top_level_imports(path: Path) -> List[str]:
+    tree = ast.parse(path.read_text())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.append(node.module.split(".")[0])
+    return names
+
+
+def run_checks(repeat: int, baseline: Optional[Dict[str, float]],
+               threshold: float) -> Tuple[Dict[str, float], List[str]]:
+    results, failures = {}, []
+    for module, forbidden in IMPORT_TARGETS.items():
+        runs = [measure_import(module) for _ in range(repeat)]
+        ms = statistics.median(total for total, _ in runs) / 1000
+        results[module] = round(ms, 1)
+        loaded = {name.split(".")[0] for name in runs[0][1]}
+        for name in forbidden:
+            if name in loaded:
+                failures.append(f"import {module} loads {name}")
+        budget = baseline.get(module) if baseline else None
+        status = ""
+        if budget and ms > budget * (1 + threshold):
+            failures.append(f"import {module}: {ms:.1f} ms > budget {budget:.1f} ms (+{threshold:.0%})")
+            status = "  REGRESSION"
+        print(f"{module:<16} {ms:>8.1f} ms{status}")
+    for path, forbidden in APP_FILES.items():
+        if not path.exists():
+            continue
+        eager = sorted(set(top_level_imports(path)) & set(forbidden))
+        if eager:
+            failures.append(f"{path.name} imports {', '.join(eager)} at module level")
+    return results, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check cold import times against a budget")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per module; the median is used")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE),
+                        help="JSON of module -> ms budget from a previous --save-baseline")
+    parser.add_argument("--no-baseline", action="store_true", help="Only check for eager imports, not times")
+    parser.add_argument("--save-baseline", help="Write the measured times as the new budget")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown over the baseline")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and not args.no_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results, failures = run_checks(args.repeat, baseline, args.threshold)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if failures:
+        print("Import-time check failed:")
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("Import-time check passed.")
@@ -0,0 +1,101 @@
+# Load test for query_service.py
+# Starts the service in process over the latest invoicer snapshot, samples customer and invoice ids,
+# then hammers each endpoint from concurrent clients and reports p50/p99 latency and throughput.
+#
+# Usage (from the task1 folder, after a run of invoicer.py):
+#   python -m bench.load_test_service --clients 16 --requests 2000
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from typing import Dict, List
+
+from bench.run_benchmarks import percentile
+from query_service import QueryService, make_handler, prepare_statements
+from utils.result_cache import QueryCache
+from utils.storage import SNAPSHOT_DIR, ConnectionBroker
+
+
+def _sample_ids(broker: ConnectionBroker, limit: int) -> List[Dict[str, str]]:
+    with broker.cursor() as cur:
+        cur.execute(f"SELECT customer_id, id FROM invoices USING SAMPLE reservoir({int(limit)} ROWS)")
+        return [{"customer_id": c, "invoice_id": i} for c, i in cur.fetchall()]
+
+
+def _paths(samples: List[Dict[str, str]], endpoint: str) -> List[str]:
+    if endpoint == "summary":
+        return [f"/customers/{s['customer_id']}/summary" for s in samples]
+    if endpoint == "invoice":
+        return [f"/customers/{s['customer_id']}/invoices/{s['invoice_id']}" for s in samples]
+    return ["/billing/plans?start=2024-01-01&end=2024-12-31", "/billing/plans?start=2024-03-01&end=2024-03-31"]
+
+
+def run_clients(base_url: str, paths: List[str], clients: int, requests: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    per_client = max(1, requests // clients)
+
+    def client(seed: int):
+        rng = random.Random(seed)
+        local = []
+        for _ in range(per_client):
+            path = rng.choice(paths)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + path) as response:
+                    response.read()
+            except urllib.error.URLError:
+                with lock:
+                    errors[0] += 1
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test for the query service")
+    parser.add_argument("--db", default=str(SNAPSHOT_DIR), help="Snapshot folder or a single DuckDB file")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per endpoint")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--sample", type=int, default=500, help="Distinct customers/invoices to query")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the result cache to measure raw query latency")
+    args = parser.parse_args()
+
+    broker = ConnectionBroker(args.db, max_idle=args.pool_size, on_cursor=prepare_statements)
+    # --no-cache turns off both tiers; otherwise results live in memory only, so a warm disk
+    # tier from earlier runs does not hide the query latency
+    cache = QueryCache(cache_dir=None, memory_bytes=0 if args.no_cache else 64 * 1024 ** 2)
+    service = QueryService(broker, cache)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    samples = _sample_ids(broker, args.sample)
+    results = {}
+    for endpoint in ("summary", "invoice", "billing_by_plan"):
+        results[endpoint] = run_clients(base_url, _paths(samples, endpoint), args.clients, args.requests)
+        print(f"{endpoint:<16} {json.dumps(results[endpoint])}")
+    server.shutdown()
+    print("cache", json.dumps(service.cache.stats))
@@ -0,0 +1,151 @@
+# Local stand-in for the Metronome API
+# Serves the customers, invoices and credit grant endpoints used by utils from a generated
+# dataset, with configurable latency, page size and error rate. Point the client at it with
+#   BASE_URL=http://127.0.0.1:8765
+#
+# Usage (from the task1 folder):
+#   python -m bench.mock_api --data bench_data --latency-ms 50 --page-size 100 --error-rate 0.01
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from bench.generate_data import generate, load_dataset
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 0.0  # Mean added latency per request
+    jitter_ms: float = 0.0  # Uniform +/- jitter around the mean
+    page_size: int = 0  # Default page size when the client sends no limit; 0 returns everything
+    error_rate: float = 0.0  # Fraction of requests answered with a 500
+    seed: int = 0
+
+
+def _paginate(items: List[Any], limit: Optional[int], cursor: Optional[str]) -> Dict[str, Any]:
+    start = int(cursor) if cursor else 0
+    if not limit:
+        return {"data": items[start:], "next_page": None}
+    end = start + limit
+    return {"data": items[start:end], "next_page": str(end) if end < len(items) else None}
+
+
+class MockMetronome:
+    def __init__(self, dataset: Dict[str, Any], config: Optional[MockConfig] = None):
+        self.config = config or MockConfig()
+        self.customers = dataset["customers"]
+        self.customers_by_id = {c["id"]: c for c in self.customers}
+        self.invoices = dataset["invoices"]
+        self.grants_by_customer: Dict[str, List[Dict[str, Any]]] = {}
+        for grant in dataset["credit_grants"]:
+            self.grants_by_customer.setdefault(grant["customer_id"], []).append(grant)
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+
+    def _limit(self, value: Optional[str]) -> int:
+        return int(value) if value else self.config.page_size
+
+    # Returns (status, payload) for a request; the HTTP handler only does transport
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        with self._lock:
+            self.request_count += 1
+            delay = self.config.latency_ms + self._rng.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+            fail = self._rng.random() < self.config.error_rate
+            if fail:
+                self.error_count += 1
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if fail:
+            return 500, {"message": "Injected failure"}
+
+        parts = [p for p in path.split("/") if p]
+        if parts and parts[0] == "v1":
+            parts = parts[1:]
+
+        if method == "GET" and parts == ["customers"]:
+            return 200, _paginate(self.customers, self._limit(query.get("limit")), query.get("next_page"))
+        if method == "GET" and len(parts) == 2 and parts[0] == "customers":
+            customer = self.customers_by_id.get(parts[1])
+            return (200, {"data": customer}) if customer else (404, {"message": "Customer not found"})
+        if method == "GET" and len(parts) == 3 and parts[0] == "customers" and parts[2] == "invoices":
+            if parts[1] not in self.customers_by_id:
+                return 404, {"message": "Customer not found"}
+            invoices = self.invoices.get(parts[1], [])
+            return 200, _paginate(invoices, self._limit(query.get("limit")), query.get("next_page"))
+        if method == "POST" and parts == ["credits", "listGrants"]:
+            customer_ids = body.get("customer_ids") or list(self.customers_by_id)
+            grants = [g for cid in customer_ids for g in self.grants_by_customer.get(cid, [])]
+            return 200, _paginate(grants, self._limit(body.get("limit")), body.get("next_page"))
+        return 404, {"message": f"Unknown endpoint {method} {path}"}
+
+
+def _make_handler(api: MockMetronome):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self._respond(*api.handle("GET", url.path, query, {}))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            self._respond(*api.handle("POST", url.path, {}, body))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Start the mock server on a background thread; returns the server and its base url
+def serve_in_thread(dataset: Dict[str, Any], config: Optional[MockConfig] = None,
+                    host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    api = MockMetronome(dataset, config)
+    server = ThreadingHTTPServer((host, port), _make_handler(api))
+    server.daemon_threads = True
+    server.api = api
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic Metronome API locally")
+    parser.add_argument("--data", help="Directory written by bench.generate_data; generates in memory if omitted")
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = load_dataset(Path(args.data)) if args.data else generate(customers=args.customers, events=0)
+    config = MockConfig(args.latency_ms, args.jitter_ms, args.page_size, args.error_rate, args.seed)
+    server, base_url = serve_in_thread(dataset, config, args.host, args.port)
+    print(f"Mock Metronome API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,276 @@
+# Benchmark suite for the Task 1 invoicer pipeline
+# Spins up the mock Metronome API on a synthetic dataset, runs each stage of the invoicer
+# (fetch customers, fetch invoices, fetch credit grants, flatten + write, DuckDB load) in process,
+# then runs invoicer.py end to end against the same server.
+# Reports throughput, per-request latency percentiles and peak RSS for each stage,
+# and compares against a saved baseline to flag regressions.
+#
+# Usage (from the task1 folder):
+#   python -m bench.run_benchmarks --customers 500 --latency-ms 20 --save-baseline bench/baseline.json
+#   python -m bench.run_benchmarks --customers 500 --latency-ms 20 --baseline bench/baseline.json
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from bench.generate_data import generate
+from bench.mock_api import MockConfig, serve_in_thread
+
+TASK1_DIR = Path(__file__).resolve().parent.parent
+
+
+# Current resident set size in bytes; falls back to the process peak off Linux
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    # Samples RSS on a background thread so each stage gets its own peak
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+# Wrap utils.get / utils.post so every API call's latency is recorded against the running stage
+def _record_latencies(utils_module, latencies: List[float]) -> None:
+    for name in ("get", "post"):
+        original = getattr(utils_module, name)
+
+        def timed(*args, _original=original, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        setattr(utils_module, name, timed)
+
+
+def run_stage(name: str, fn: Callable[[], int], latencies: List[float]) -> Dict[str, Any]:
+    latencies.clear()
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        records = fn()
+        elapsed = time.perf_counter() - start
+    result = {
+        "stage": name,
+        "seconds": round(elapsed, 4),
+        "records": records,
+        "records_per_sec": round(records / elapsed, 1) if elapsed > 0 else None,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+    }
+    if latencies:
+        result["latency"] = _latency_summary(latencies)
+    print(f"{name:<18} {elapsed:>8.3f}s {records:>9} records  peak rss {result['peak_rss_mb']} MB")
+    return result
+
+
+def run_in_process(base_url: str, work_dir: Path) -> List[Dict[str, Any]]:
+    # utils reads BASE_URL and API_KEY at import time, so point it at the mock first
+    os.environ["BASE_URL"] = base_url
+    os.environ.setdefault("API_KEY", "bench")
+    import duckdb
+    import pandas as pd
+    import utils
+
+    latencies: List[float] = []
+    _record_latencies(utils, latencies)
+    state: Dict[str, Any] = {}
+
+    def fetch_customers():
+        state["customers"] = utils.get_customers()
+        return len(state["customers"])
+
+    def fetch_invoices():
+        state["invoices"] = []
+        for customer in state["customers"]:
+            state["invoices"].extend(utils.models_to_dicts(utils.get_customer_invoices(customer.id)))
+        return len(state["invoices"])
+
+    def fetch_credits():
+        customer_ids = [customer.id for customer in state["customers"]]
+        state["credit_grants"] = utils.models_to_dicts(utils.get_credit_balances(customer_ids=customer_ids))
+        return len(state["credit_grants"])
+
+    def flatten_and_write():
+        customers = utils.models_to_dicts(state["customers"])
+        for name, rows in (("customer_list", customers), ("invoices", state["invoices"]),
+                           ("credit_balances", state["credit_grants"])):
+            with open(work_dir / f"{name}.json", "w") as f:
+                json.dump(rows, f)
+            pd.DataFrame(rows).to_csv(work_dir / f"{name}.csv", index=False)
+        return len(customers) + len(state["invoices"]) + len(state["credit_grants"])
+
+    def duckdb_load():
+        con = duckdb.connect(str(work_dir / "bench.db"))
+        rows = 0
+        for table, csv_name in (("customers", "customer_list"), ("invoices", "invoices"),
+                                ("credit_balances", "credit_balances")):
+            con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_csv_auto('{work_dir / csv_name}.csv')")
+            rows += con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        con.close()
+        return rows
+
+    return [
+        run_stage("fetch_customers", fetch_customers, latencies),
+        run_stage("fetch_invoices", fetch_invoices, latencies),
+        run_stage("fetch_credits", fetch_credits, latencies),
+        run_stage("flatten_write", flatten_and_write, latencies),
+        run_stage("duckdb_load", duckdb_load, latencies),
+    ]
+
+
+# Run invoicer.py unchanged in a scratch directory against the mock server
+def run_end_to_end(base_url: str, work_dir: Path, customers: int) -> Dict[str, Any]:
+    run_dir = work_dir / "invoicer_run"
+    (run_dir / "submissions").mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, BASE_URL=base_url, PYTHONPATH=str(TASK1_DIR),
+               INVOICER_METRICS_DIR=str(run_dir / "metrics"))
+    env.setdefault("API_KEY", "bench")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, str(TASK1_DIR / "invoicer.py")], cwd=run_dir, env=env,
+                          capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = peak if sys.platform == "darwin" else peak * 1024
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+    result = {
+        "stage": "invoicer_end_to_end",
+        "seconds": round(elapsed, 4),
+        "records": customers,
+        "records_per_sec": round(customers / elapsed, 1) if elapsed > 0 else None,
+        "peak_rss_mb": round(peak / 2**20, 1),
+        "ok": proc.returncode == 0,
+    }
+    # Per-stage timings reported by invoicer.py's own instrumentation
+    metrics_log = run_dir / "metrics" / "metrics.jsonl"
+    if metrics_log.exists():
+        with open(metrics_log) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        result["invoicer_stages"] = [e for e in events if e.get("event") == "stage"]
+    print(f"{'invoicer_e2e':<18} {elapsed:>8.3f}s {customers:>9} customers peak rss {result['peak_rss_mb']} MB")
+    return result
+
+
+# Flag any stage whose time or peak memory grew more than `threshold` over the baseline
+def find_regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float) -> List[str]:
+    previous = {r["stage"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        # A failed run is a regression whatever its timings (and fast failures would look like a speedup)
+        if result.get("ok") is False:
+            regressions.append(f"{result['stage']}: failed")
+            continue
+        before = previous.get(result["stage"])
+        if not before:
+            continue
+        for metric in ("seconds", "peak_rss_mb"):
+            if before.get(metric) and result[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{result['stage']}.{metric}: {before[metric]} -> {result[metric]}")
+        if before.get("latency") and result.get("latency"):
+            old, new = before["latency"]["p99_ms"], result["latency"]["p99_ms"]
+            if old and new > old * (1 + threshold):
+                regressions.append(f"{result['stage']}.p99_ms: {old} -> {new}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the invoicer pipeline against a mock Metronome API")
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--invoices-per-customer", type=int, default=12)
+    parser.add_argument("--grants-per-customer", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--page-size", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-e2e", action="store_true", help="Skip the end-to-end invoicer.py run")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a results JSON from a previous run")
+    parser.add_argument("--save-baseline", help="Write results JSON as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before flagging, e.g. 0.2 = 20%%")
+    args = parser.parse_args()
+
+    dataset = generate(args.customers, args.invoices_per_customer, args.grants_per_customer, events=0, seed=args.seed)
+    config = MockConfig(args.latency_ms, args.jitter_ms, args.page_size, args.error_rate, args.seed)
+    server, base_url = serve_in_thread(dataset, config)
+    work_dir = Path(tempfile.mkdtemp(prefix="invoicer_bench_"))
+    try:
+        results = run_in_process(base_url, work_dir)
+        if not args.skip_e2e:
+            results.append(run_end_to_end(base_url, work_dir, args.customers))
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "config": vars(args),
+        "mock_requests": server.api.request_count,
+        "mock_errors": server.api.error_count,
+        "stages": results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f)["stages"], args.threshold)
+        if regressions:
+            print("Regressions found:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("No regressions against baseline.")
+    elif any(result.get("ok") is False for result in results):
+        print("Failed stages:", ", ".join(r["stage"] for r in results if r.get("ok") is False))
+        sys.exit(1)
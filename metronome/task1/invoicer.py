@@ -1,89 +1,217 @@
-
 # # Task 1 - Querying the Metronome API
 #  - Query the Metronome API to retrieve relevant customer data.
 #  - Process the retrieved data to generate a summary report (csv).
 #  - Include essential customer information such as customer name, customer invoice balance, credit balance, etc. 
 #  - Process the report to a single csv
+#
+# The fetch -> validate -> flatten -> load phases run as a staged pipeline (utils/pipeline.py):
+# customer pages stream in while invoices and credit grants are fetched, validated, flattened and
+# appended to DuckDB concurrently, each stage with its own worker count and bounded input queue.
 
 # %%
-import pandas as pd
+import argparse
+from datetime import datetime, timezone
+from functools import partial
 from dotenv import load_dotenv
 import os
-from utils import get_customers, load_and_process_data, get_customer_invoices, get_credit_balances, models_to_dicts
-import json
 from pathlib import Path
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from utils import (iter_pages, fetch_customer_invoices_raw, fetch_credit_grants_raw,
+                   models_to_dicts, validate_records)
+from utils.archive import RunArchive, load_manifest, new_run_id, prune as prune_archive
+from utils.checkpoint import (CHECKPOINT_TABLE, CheckpointEntry, atomic_path, completed, create_checkpoint_table,
+                              record as record_checkpoints)
+from utils.metrics import METRICS, start_profile, stop_profile
+from utils import ledger
+from utils.pipeline import Pipeline, Stage
+from utils.result_cache import QueryCache
+from utils.results import write_csv
+from utils.sharding import SHARD_DIR, export_shard, merge_shards, parse_shard_spec, run_local_shards, shard_name, shard_of
+from utils.storage import SNAPSHOT_DIR, prepare_staging, publish
+from utils.warehouse import TABLE_MODELS, append_rows, bump_versions, create_tables, create_version_table, to_row
 
 load_dotenv()
 
 # Data directories
 DATA_DIR = Path("data")
-RAW_DATA_DIR = DATA_DIR / "raw"
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
-# Create directories if they don't exist
-# Skip if they do
-DATA_DIR.mkdir(exist_ok=True)
-RAW_DATA_DIR.mkdir(exist_ok=True)
-PROCESSED_DATA_DIR.mkdir(exist_ok=True)
 
 customers_csv = PROCESSED_DATA_DIR / "customer_list.csv"
 customer_invoices_csvs = PROCESSED_DATA_DIR / "invoices.csv"
 customer_credit_balances_csv = PROCESSED_DATA_DIR / "credit_balances.csv"
+REPORT_CSV = Path("./submissions/task_1_invoicing_invoicer.csv")
+TABLE_CSVS = {
+    "customers": customers_csv,
+    "invoices": customer_invoices_csvs,
+    "credit_balances": customer_credit_balances_csv,
+}
 
-# DuckDB name
-DB_NAME = "invoicer.db"
+# Raw API records go to the content-addressed archive (utils/archive.py), one manifest per run
+ARCHIVE_KEEP_RUNS = int(os.getenv("INVOICER_ARCHIVE_KEEP_RUNS", 0))
 
-# %%
-# Preload customer data for selection tab
-customer_list = get_customers()
-customer_list_dicts = models_to_dicts(customer_list)
-# Save customer list to file
-with open(RAW_DATA_DIR / "customer_list.json", "w") as f:
-    json.dump(customer_list_dicts, f)
-# Save to csv   
-customer_list_df = pd.DataFrame(customer_list_dicts)
-customer_list_df.to_csv(customers_csv, index=False)
+# Tables each shard exports and the merge step combines; the checkpoints travel with the data so
+# --resume on a merged snapshot skips the customers the shards already loaded
+SHARD_TABLES = list(TABLE_MODELS) + ledger.LEDGER_TABLES + [CHECKPOINT_TABLE]
 
-# %%
-# Get invoices for each customer
-all_invoices_all_customers = []
-for customer in customer_list:
-    invoices = get_customer_invoices(customer.id)
-    invoices_dicts = models_to_dicts(invoices)
-    # Save invoices to file
-    with open(RAW_DATA_DIR / f"{customer.id}_invoices.json", "w") as f:
-        json.dump(invoices_dicts, f)
-    all_invoices_all_customers.extend(invoices_dicts)
-# Save all invoices to single csv
-all_invoices_df = pd.DataFrame(all_invoices_all_customers)
-all_invoices_df.to_csv(customer_invoices_csvs, index=False)
+# DuckDB is built in a staging file and published as a read-only snapshot under SNAPSHOT_DIR
+# (utils/storage.py), so readers never block on a running load
 
 # %%
-# Get credit balances for each customer
-customer_ids = [customer.id for customer in customer_list]
-credit_balances = get_credit_balances(customer_ids=customer_ids)
-credit_balances_dicts = models_to_dicts(credit_balances)
-print(len(credit_balances_dicts))
-# Save credit balances to file
-with open(RAW_DATA_DIR / "credit_balances.json", "w") as f:
-    json.dump(credit_balances_dicts, f)
-
-# Save to a single csv
-credit_balances_df = pd.DataFrame(credit_balances_dicts)
-credit_balances_df.to_csv(customer_credit_balances_csv, index=False)
+# Pipeline source: walk the customer pages, passing each page on to be loaded and
+# fanning out an invoice fetch per customer and a credit grant fetch per chunk of customers.
+# With a shard (i, N) only customers hashed to shard i are kept. `done` holds the customer ids
+# already checkpointed per kind; that work is skipped when resuming.
+def customer_tasks(credit_chunk_size: int, shard: Optional[Tuple[int, int]] = None,
+                   done: Optional[Dict[str, Set[str]]] = None) -> Iterator[Tuple]:
+    done = done or {"customer": set(), "invoices": set(), "credits": set()}
+    prefix = f"{shard_name(*shard)}_" if shard else ""
+    pending_ids: List[str] = []
+    credit_chunk = 0
+    for page_no, page in enumerate(iter_pages("GET", "customers")):
+        if "error" in page:
+            print("Error fetching customers:", page["error"])
+            break
+        customers = page.get("data", [])
+        if shard:
+            customers = [c for c in customers if shard_of(c["id"], shard[1]) == shard[0]]
+        new_customers = [c for c in customers if c["id"] not in done["customer"]]
+        if new_customers:
+            yield ("customers", f"{prefix}customer_list_{page_no}", new_customers)
+        for customer in customers:
+            if customer["id"] not in done["invoices"]:
+                yield ("fetch_invoices", customer["id"])
+            if customer["id"] not in done["credits"]:
+                pending_ids.append(customer["id"])
+            if len(pending_ids) >= credit_chunk_size:
+                yield ("fetch_credits", f"{prefix}{credit_chunk}", pending_ids)
+                pending_ids, credit_chunk = [], credit_chunk + 1
+    if pending_ids:
+        yield ("fetch_credits", f"{prefix}{credit_chunk}", pending_ids)
 
-# %%
-import duckdb
-con = duckdb.connect(DB_NAME)
 
-# %%
-# Load customers into duckdb
-con.execute(f"CREATE TABLE customers AS SELECT * FROM read_csv_auto('{customers_csv}')")
+# Pipeline source for --replay: the work units of an archived run, in their original order
+def replay_tasks(run_id: str, done: Optional[Dict[str, Set[str]]] = None) -> Iterator[Tuple]:
+    done = done or {"customer": set(), "invoices": set(), "credits": set()}
+    for key, entry in load_manifest(run_id)["entries"].items():
+        if set(entry["customer_ids"]) <= done[entry["checkpoint"]]:
+            continue
+        yield ("replay", key, entry)
+
+
+# Stage 1 (network I/O): fetch raw pages for a task and archive the raw records, or read them
+# back from the archive when replaying
+# -> (table, work unit key, raw records, checkpoint kind, customer ids covered)
+def fetch_stage(archive: RunArchive, task: Tuple) -> List[Tuple]:
+    kind = task[0]
+    if kind == "replay":
+        _, key, entry = task
+        records = [archive.store.get(digest) for digest in entry["records"]]
+        archive.link(key, entry["records"], table=entry["table"], checkpoint=entry["checkpoint"],
+                     customer_ids=entry["customer_ids"])
+        METRICS.inc("invoicer_stage_records_total", len(records), stage="fetch")
+        return [(entry["table"], key, records, entry["checkpoint"], entry["customer_ids"])]
+    if kind == "customers":
+        _, key, customers = task
+        customer_ids = [c["id"] for c in customers]
+        archive.add(key, customers, table="customers", checkpoint="customer", customer_ids=customer_ids)
+        return [("customers", key, customers, "customer", customer_ids)]
+    if kind == "fetch_invoices":
+        customer_id = task[1]
+        raw_data = fetch_customer_invoices_raw(customer_id)
+        table, key, checkpoint, customer_ids = "invoices", f"{customer_id}_invoices", "invoices", [customer_id]
+    else:
+        chunk, customer_ids = task[1], task[2]
+        raw_data = fetch_credit_grants_raw(customer_ids)
+        table, key, checkpoint = "credit_balances", f"credit_balances_{chunk}", "credits"
+    if "error" in raw_data:
+        # Not checkpointed, so a --resume run will try it again
+        print(f"Error fetching {table} for {key}:", raw_data["error"])
+        return []
+    METRICS.inc("invoicer_stage_records_total", len(raw_data["data"]), stage="fetch")
+    archive.add(key, raw_data["data"], table=table, checkpoint=checkpoint, customer_ids=customer_ids)
+    return [(table, key, raw_data["data"], checkpoint, customer_ids)]
+
 
-# Load invoices into duckdb
-con.execute(f"CREATE TABLE invoices AS SELECT * FROM read_csv_auto('{customer_invoices_csvs}')")
+# Stage 2 (CPU): validate raw records into models
+def validate_stage(item: Tuple) -> List[Tuple]:
+    table, key, raw_records, checkpoint, customer_ids = item
+    try:
+        models = validate_records(TABLE_MODELS[table], raw_records)
+    except ValidationError as e:
+        print(f"Validation error in {key}:", e.json())
+        return []
+    return [(table, key, models, checkpoint, customer_ids)]
 
-# Load credit balances into duckdb
-con.execute(f"CREATE TABLE credit_balances AS SELECT * FROM read_csv_auto('{customer_credit_balances_csv}')")
+
+# Stage 3: flatten models to rows
+def flatten_stage(archive: RunArchive, item: Tuple) -> List[Tuple]:
+    table, key, models, checkpoint, customer_ids = item
+    records = models_to_dicts(models)
+    # Checkpoints point at the work unit in this run's archive manifest
+    raw_ref = f"{archive.run_id}/{key}"
+    METRICS.inc("invoicer_stage_records_total", len(records), stage="flatten")
+    rows = [to_row(r) for r in records]
+    # Credit grants also feed the point-in-time ledger, parsed once here
+    ledger_batch = ledger.ledger_rows(records) if table == "credit_balances" else ([], [])
+    # Checkpoint each customer with its own row count; credit grants arrive for a chunk of customers
+    if table == "customers":
+        counts = {customer_id: 1 for customer_id in customer_ids}
+    else:
+        counts = {customer_id: 0 for customer_id in customer_ids}
+        for record in records:
+            if record.get("customer_id") in counts:
+                counts[record["customer_id"]] += 1
+    entries = [(checkpoint, customer_id, n, raw_ref) for customer_id, n in counts.items()]
+    return [(table, rows, entries, ledger_batch)]
+
+
+# Stage 4 (single writer): buffer rows and append them to DuckDB in batches. Each flush commits
+# the rows of every table together with their checkpoints in a single transaction.
+class DuckDBLoader:
+    def __init__(self, con, batch_size: int):
+        self.con = con
+        self.batch_size = batch_size
+        self.buffers: Dict[str, List[Dict[str, Any]]] = {table: [] for table in TABLE_MODELS}
+        self.checkpoints: List[CheckpointEntry] = []
+        self.ledger_grants: List[Dict[str, Any]] = []
+        self.ledger_entries: List[Dict[str, Any]] = []
+        self.buffered = 0
+        self.rows_loaded = 0
+
+    def load(self, item: Tuple) -> None:
+        table, rows, entries, (ledger_grants, ledger_entries) = item
+        self.buffers[table].extend(rows)
+        self.checkpoints.extend(entries)
+        self.ledger_grants.extend(ledger_grants)
+        self.ledger_entries.extend(ledger_entries)
+        self.buffered += len(rows)
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.checkpoints:
+            return
+        self.con.begin()
+        try:
+            loaded = sum(append_rows(self.con, table, rows) for table, rows in self.buffers.items())
+            ledger.append(self.con, self.ledger_grants, self.ledger_entries)
+            record_checkpoints(self.con, self.checkpoints)
+            changed = [table for table, rows in self.buffers.items() if rows]
+            bump_versions(self.con, changed + (ledger.LEDGER_TABLES if self.ledger_grants else []))
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
+        METRICS.inc("invoicer_stage_records_total", loaded, stage="load")
+        self.rows_loaded += loaded
+        self.buffers = {table: [] for table in TABLE_MODELS}
+        self.checkpoints = []
+        self.ledger_grants, self.ledger_entries = [], []
+        self.buffered = 0
 
 
 # %%
@@ -93,11 +221,6 @@ def convert_kv_to_json(kv_str: str) -> str:
     kv_str = kv_str.replace("'", '"')
     return kv_str
 
-# Register the function in DuckDB
-#con.remove_function("convert_kv_to_json")
-con.create_function("convert_kv_to_json", convert_kv_to_json)
-
-
 
 # %% [markdown]
 # # Notes
@@ -107,7 +230,7 @@ con.create_function("convert_kv_to_json", convert_kv_to_json)
 # - Finally, I only gave myself so much time. I am sure there are areas to be improved. 
 
 # %%
-con.execute("""
+BALANCE_REPORT_QUERY = """
             
 WITH ranked_invoices AS (
     SELECT customer_id,
@@ -125,36 +248,13 @@ invoice_totals as (
        FROM ranked_invoices
        WHERE rn = 1
        GROUP BY customer_id),
- balance_unpack AS (
-    SELECT
-        id,
-        name,
-        customer_id,
-        reason,
-        JSON(convert_kv_to_json(balance)) AS balance_properties,
-        JSON(convert_kv_to_json(deductions)) AS deductions_properties,
-        JSON(convert_kv_to_json(grant_amount)) AS grant_amount_properties
-    FROM credit_balances
-    WHERE balance IS NOT NULL),
-            
-   balance_adjustments as (select
-            id,
-            name,
-            customer_id,
-            reason, 
-            deductions_properties[0].amount::double as deductions_amount, 
-            deductions_properties[0].running_balance::double as running_balance, 
-            balance_properties.including_pending::double as including_pending,
-            balance_properties.excluding_pending::double as excluding_pending,
-            grant_amount_properties.amount::double as grant_amount
-            FROM balance_unpack
-            ),
+ -- Credit balance per customer as of $as_of from the point-in-time ledger (utils/ledger.py):
+ -- live grants only, expired grants count as 0. Bound rather than now() so it is part of the cache key
     total_adjustments as (
         SELECT
             customer_id,
-            CONCAT('$', ROUND(SUM(running_balance/100),2), ' USD') AS total_balance_credits
-        FROM balance_adjustments
-        GROUP BY 1
+            CONCAT('$', ROUND(credit_balance/100,2), ' USD') AS total_balance_credits
+        FROM customer_credit_balances_as_of($as_of)
     )
             select c.name,
             i.total_invoiced as current_invoice_balance,
@@ -164,7 +264,175 @@ invoice_totals as (
             LEFT JOIN total_adjustments t ON c.id = t.customer_id
             ORDER BY c.name
             
-            """).fetchdf().to_csv("./submissions/task_1_invoicing_invoicer.csv", index=False)
+            """
 
 
+# %%
+def connect(db_path: str):
+    # Deferred so importing invoicer (or `--help`) does not load duckdb
+    import duckdb
 
+    con = duckdb.connect(db_path)
+    # Register the function in DuckDB
+    con.create_function("convert_kv_to_json", convert_kv_to_json)
+    return con
+
+
+# Run the API -> DuckDB pipeline into `con`, optionally for a single shard of customers
+# With --resume the existing tables are kept and checkpointed work is skipped
+def ingest(con, args: argparse.Namespace, shard: Optional[Tuple[int, int]] = None) -> None:
+    create_tables(con, replace=not args.resume)
+    create_checkpoint_table(con, replace=not args.resume)
+    ledger.create_ledger_tables(con, replace=not args.resume)
+    create_version_table(con, replace=not args.resume)
+    done = None
+    if args.resume:
+        done = {kind: completed(con, kind) for kind in ("customer", "invoices", "credits")}
+        print("Resuming: {} customers, {} invoice sets and {} credit sets already loaded".format(
+            len(done["customer"]), len(done["invoices"]), len(done["credits"])))
+    archive = RunArchive(new_run_id(shard_name(*shard) if shard else None),
+                         meta={"shard": args.shard, "resume": args.resume, "replay_of": args.replay})
+    loader = DuckDBLoader(con, args.batch_size)
+    pipeline = Pipeline([
+        Stage("fetch", partial(fetch_stage, archive), workers=args.fetch_workers, queue_size=args.queue_size),
+        Stage("validate", validate_stage, workers=args.validate_workers, queue_size=args.queue_size),
+        Stage("flatten", partial(flatten_stage, archive), workers=args.flatten_workers, queue_size=args.queue_size),
+        # DuckDB allows one writer, so loading is always a single worker
+        Stage("load", loader.load, workers=1, queue_size=args.queue_size, flush=loader.flush),
+    ])
+    source = replay_tasks(args.replay, done) if args.replay else customer_tasks(args.credit_chunk_size, shard, done)
+    try:
+        with METRICS.stage("pipeline") as stage:
+            pipeline.run(source)
+            stage.records = loader.rows_loaded
+    finally:
+        # Written even if the run fails, so the work that did complete can be replayed
+        print(f"Archived run {archive.run_id} ({archive.write()})")
+    print(f"Loaded {loader.rows_loaded} rows")
+    with METRICS.stage("ledger_compact"):
+        ledger.compact(con)
+
+
+# Export the processed CSVs and write the summary report from a loaded database, with credit
+# balances as of `as_of` (naive UTC, default now)
+def report(con, as_of: Optional[datetime] = None) -> None:
+    as_of = as_of or datetime.now(timezone.utc).replace(tzinfo=None)
+    # Keep the processed CSVs for anyone reading them directly
+    with METRICS.stage("export_csv") as stage:
+        for table, csv_path in TABLE_CSVS.items():
+            with atomic_path(csv_path) as tmp:
+                con.execute(f"COPY {table} TO '{tmp}' (FORMAT CSV, HEADER, DELIMITER ',')")
+            METRICS.record_write("csv", csv_path)
+        stage.records = len(TABLE_CSVS)
+
+    # Written straight from Arrow, without a pandas copy. The result is cached against the table
+    # versions it was built from, so readers of the published snapshot get it without rerunning it.
+    with METRICS.stage("report") as stage:
+        table = QueryCache().query(con, BALANCE_REPORT_QUERY, {"as_of": as_of}, name="balance_report")
+        stage.records = write_csv(table, REPORT_CSV)
+    METRICS.record_write("csv", REPORT_CSV)
+
+
+# Forward the pipeline tuning flags to shard worker processes
+def _worker_args(args: argparse.Namespace) -> List[str]:
+    return ["--fetch-workers", str(args.fetch_workers), "--validate-workers", str(args.validate_workers),
+            "--flatten-workers", str(args.flatten_workers), "--queue-size", str(args.queue_size),
+            "--batch-size", str(args.batch_size), "--credit-chunk-size", str(args.credit_chunk_size)] + \
+           (["--resume"] if args.resume else [])
+
+
+def run(args: argparse.Namespace) -> None:
+    # Create directories if they don't exist
+    # Skip if they do
+    DATA_DIR.mkdir(exist_ok=True)
+    PROCESSED_DATA_DIR.mkdir(exist_ok=True)
+
+    if args.shard:
+        # Worker: load one shard into its own database and publish it as Parquet
+        index, total = parse_shard_spec(args.shard)
+        SHARD_DIR.mkdir(parents=True, exist_ok=True)
+        db_path = SHARD_DIR / f"{shard_name(index, total)}.db"
+        con = connect(str(db_path))
+        ingest(con, args, (index, total))
+        with METRICS.stage("export_shard"):
+            export_shard(con, SHARD_TABLES, index, total)
+        con.close()
+        METRICS.record_write("duckdb", db_path)
+        return
+
+    if args.shards:
+        # Coordinator: one local process per shard, then merge
+        failed = run_local_shards(os.path.abspath(__file__), args.shards, _worker_args(args))
+        if failed:
+            sys.exit(f"Shards failed: {failed}; rerun them with --shard i/{args.shards} and then --merge {args.shards}")
+        args.merge = args.shards
+
+    staging = prepare_staging(resume=args.resume and not args.merge)
+    con = connect(str(staging))
+    if args.merge:
+        with METRICS.stage("merge_shards"):
+            merge_shards(con, SHARD_TABLES, args.merge)
+            # Merged tables come from Parquet; add back the ledger balance macros
+            ledger.create_ledger_tables(con, replace=False)
+            create_version_table(con)
+            bump_versions(con, list(TABLE_MODELS) + ledger.LEDGER_TABLES)
+    else:
+        ingest(con, args)
+    report(con, args.as_of)
+    con.execute("CHECKPOINT")
+    con.close()
+    with METRICS.stage("publish_snapshot"):
+        snapshot = publish(staging)
+    print(f"Published {snapshot} (readers: {SNAPSHOT_DIR}/CURRENT)")
+    METRICS.record_write("duckdb", snapshot)
+    # Only pruned here: shard workers may still be writing blobs no manifest refers to yet
+    if ARCHIVE_KEEP_RUNS:
+        print(f"Pruned {prune_archive(ARCHIVE_KEEP_RUNS)} unreferenced archive blobs")
+
+
+# --as-of value: an ISO date or datetime; offsets are converted to naive UTC like the ledger
+def as_of_arg(value: str) -> datetime:
+    try:
+        as_of = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an ISO date or datetime: {value!r}")
+    if as_of.tzinfo is not None:
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+    return as_of
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the Task 1 invoicing summary from the Metronome API")
+    parser.add_argument("--fetch-workers", type=int, default=int(os.getenv("INVOICER_FETCH_WORKERS", 8)),
+                        help="Concurrent API requests")
+    parser.add_argument("--validate-workers", type=int, default=int(os.getenv("INVOICER_VALIDATE_WORKERS", 2)))
+    parser.add_argument("--flatten-workers", type=int, default=int(os.getenv("INVOICER_FLATTEN_WORKERS", 2)))
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv("INVOICER_QUEUE_SIZE", 64)),
+                        help="Max items buffered in front of each stage (backpressure)")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("INVOICER_BATCH_SIZE", 5000)),
+                        help="Rows per DuckDB append")
+    parser.add_argument("--credit-chunk-size", type=int, default=int(os.getenv("INVOICER_CREDIT_CHUNK_SIZE", 100)),
+                        help="Customers per credits/listGrants request")
+    parser.add_argument("--resume", action="store_true",
+                        help="Keep the existing database and skip customers already checkpointed by a previous run")
+    parser.add_argument("--as-of", type=as_of_arg, default=os.getenv("INVOICER_AS_OF"),
+                        help="Report credit balances as of this UTC date or time, e.g. 2024-03-31 (default now)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--shard", help="Only process customers in shard i of N (e.g. 0/4) and write Parquet under "
+                                          "INVOICER_SHARD_DIR; no report")
+    mode.add_argument("--shards", type=int, help="Run N local shard processes, merge them and write the report")
+    mode.add_argument("--merge", type=int, help="Merge the Parquet output of N shards and write the report")
+    mode.add_argument("--replay", metavar="RUN_ID",
+                      help="Load the raw records of an archived run (data/archive/manifests) instead of calling the API")
+    return parser.parse_args(argv)
+
+
+# %%
+if __name__ == "__main__":
+    # Opt-in profiler, see utils/metrics.py (INVOICER_PROFILE=invoicer.prof)
+    args = parse_args()
+    profile = start_profile()
+    run(args)
+    # Export run metrics (INVOICER_METRICS_DIR / INVOICER_METRICS_URL) and the profile, if enabled
+    stop_profile(profile)
+    METRICS.export(shard_name(*parse_shard_spec(args.shard)) if args.shard else None)
@@ -0,0 +1,293 @@
+# Read-only HTTP/JSON query service over the invoicer warehouse
+# Answers customer summaries, invoice reconstruction, usage by date range and billing by plan
+# straight from invoicer.db, without rerunning invoicer.py or opening the Streamlit app.
+#
+#   GET /customers/<id>/summary
+#   GET /customers/<id>/invoices/<invoice_id>
+#   GET /customers/<id>/usage?start=2024-03-10&end=2024-03-25
+#   GET /billing/plans?start=2024-03-01&end=2024-03-31
+#   GET /health
+#
+# Usage (from the task1 folder):
+#   python query_service.py --events-db ../task2/egress.db --port 8080
+#
+# Reads go through a utils.storage.ConnectionBroker: read-only cursors on the latest snapshot
+# published by invoicer.py, so queries never wait on a running load. Every query is PREPAREd once
+# on each pooled cursor (prepare_statements) and a request only EXECUTEs it with its values, so
+# the SQL is not parsed and planned again per request. Results go through the version-keyed
+# utils.result_cache.QueryCache, the same cache and invalidation the invoicer report uses.
+import argparse
+import ast
+import json
+import re
+import traceback
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import duckdb
+
+from utils.result_cache import MEMORY_BYTES, QueryCache
+from utils.storage import SNAPSHOT_DIR, ConnectionBroker
+
+CUSTOMER_SUMMARY_SQL = """
+WITH finalized AS (
+    SELECT customer_id, total, end_timestamp,
+           ROW_NUMBER() OVER (PARTITION BY customer_id ORDER BY end_timestamp DESC) AS rn
+    FROM invoices
+    WHERE customer_id = $customer_id AND status = 'FINALIZED'
+)
+SELECT c.id AS customer_id,
+       c.name,
+       c.external_id,
+       (SELECT COUNT(*) FROM invoices WHERE customer_id = $customer_id) AS invoice_count,
+       (SELECT SUM(total) FROM finalized) AS total_invoiced,
+       (SELECT total FROM finalized WHERE rn = 1) AS current_invoice_balance,
+       (SELECT credit_balance FROM customer_credit_balances_as_of($as_of, customer := $customer_id))
+           AS credit_balance
+FROM customers c
+WHERE c.id = $customer_id
+"""
+
+INVOICE_SQL = """
+SELECT * FROM invoices WHERE customer_id = $customer_id AND id = $invoice_id
+"""
+
+USAGE_SQL = """
+SELECT event_type,
+       CAST(date_trunc('day', timestamp) AS DATE) AS day,
+       COUNT(*) AS events
+FROM {events_table}
+WHERE customer_id IN ($customer_id, $alias)
+  AND timestamp >= CAST($period_start AS TIMESTAMP) AND timestamp < CAST($period_end AS TIMESTAMP) + INTERVAL 1 DAY
+GROUP BY ALL
+ORDER BY day, event_type
+"""
+
+BILLING_BY_PLAN_SQL = """
+SELECT plan_name,
+       COUNT(DISTINCT customer_id) AS customers,
+       COUNT(*) AS invoices,
+       SUM(total) AS total_billed
+FROM invoices
+WHERE status = 'FINALIZED'
+  AND start_timestamp >= CAST($period_start AS VARCHAR) AND start_timestamp < CAST($period_end AS VARCHAR) || 'T23:59:59.999Z'
+GROUP BY plan_name
+ORDER BY total_billed DESC
+"""
+
+# Statements prepared on every cursor. Usage is prepared for both places the events table can
+# live (the snapshot itself or the attached egress database); only the one that exists prepares.
+STATEMENTS = {
+    "customer_summary": CUSTOMER_SUMMARY_SQL,
+    "invoice": INVOICE_SQL,
+    "usage_events": USAGE_SQL.format(events_table="events"),
+    "usage_egress_events": USAGE_SQL.format(events_table="egress.events"),
+    "billing_by_plan": BILLING_BY_PLAN_SQL,
+}
+# Customer summaries report credit balances as of the start of the current minute, so repeated
+# requests within it share a cache entry
+AS_OF_RESOLUTION_SECONDS = 60
+
+# Invoice columns stored as Python reprs by utils.warehouse.to_row
+_NESTED_INVOICE_COLUMNS = ["credit_type", "line_items", "invoice_adjustments", "custom_fields",
+                           "customer_custom_fields", "plan_custom_fields"]
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+# ATTACH the events database on every snapshot connection the broker opens
+def attach_events(events_db: Optional[str]):
+    def on_connect(con) -> None:
+        if events_db:
+            con.execute(f"ATTACH '{events_db}' AS egress (READ_ONLY)")
+    return on_connect
+
+
+def find_events_table(broker: ConnectionBroker) -> Optional[str]:
+    with broker.cursor() as cur:
+        for table in ("events", "egress.events"):
+            try:
+                cur.execute(f"SELECT 1 FROM {table} LIMIT 0")
+                return table
+            except duckdb.Error:
+                continue
+    return None
+
+
+# on_cursor hook for the broker
+def prepare_statements(cur) -> None:
+    for name, sql in STATEMENTS.items():
+        try:
+            cur.execute(f"PREPARE {name} AS {sql}")
+        except duckdb.CatalogException:
+            # A table this statement reads is not in this snapshot (e.g. no events attached)
+            continue
+
+
+# EXECUTE takes values, not bound parameters; every request value is a string or a timestamp
+def sql_literal(value: Any) -> str:
+    if isinstance(value, datetime):
+        return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Names are quoted so a parameter named like a keyword (e.g. end) still parses
+def execute_statement(cur, name: str, params: Dict[str, Any]):
+    args = ", ".join(f'"{key}" := {sql_literal(value)}' for key, value in params.items())
+    return cur.execute(f"EXECUTE {name}({args})")
+
+
+def summary_as_of() -> datetime:
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    return now - timedelta(seconds=now.timestamp() % AS_OF_RESOLUTION_SECONDS)
+
+
+def _parse_nested(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def _date_param(params: Dict[str, str], name: str) -> str:
+    value = params.get(name)
+    if not value or not _DATE_RE.match(value):
+        raise BadRequest(f"Query parameter '{name}' must be a date like 2024-03-01")
+    return value
+
+
+class QueryService:
+    # `broker` must prepare STATEMENTS on its cursors (on_cursor=prepare_statements)
+    def __init__(self, broker: ConnectionBroker, cache: QueryCache):
+        self.broker = broker
+        self.cache = cache
+        self.events_table = find_events_table(broker)
+
+    def _query(self, name: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self.broker.session() as session:
+            cur = session.cursor
+            table = self.cache.query(cur, STATEMENTS[name], params, name=name,
+                                     execute=lambda: execute_statement(cur, name, params))
+        return table.to_pylist()
+
+    def customer_summary(self, customer_id: str) -> Dict[str, Any]:
+        rows = self._query("customer_summary", {"customer_id": customer_id, "as_of": summary_as_of()})
+        if not rows:
+            raise NotFound(f"Customer {customer_id} not found")
+        return rows[0]
+
+    def invoice(self, customer_id: str, invoice_id: str) -> Dict[str, Any]:
+        rows = self._query("invoice", {"customer_id": customer_id, "invoice_id": invoice_id})
+        if not rows:
+            raise NotFound(f"Invoice {invoice_id} not found for customer {customer_id}")
+        invoice = dict(rows[0])
+        for column in _NESTED_INVOICE_COLUMNS:
+            invoice[column] = _parse_nested(invoice.get(column))
+        return invoice
+
+    def usage(self, customer_id: str, params: Dict[str, str]) -> Dict[str, Any]:
+        if not self.events_table:
+            raise NotFound("No events table loaded; start the service with --events-db")
+        start, end = _date_param(params, "start"), _date_param(params, "end")
+        # Egress events are keyed by ingest alias as often as by customer id
+        alias = params.get("alias", customer_id)
+        name = "usage_" + self.events_table.replace(".", "_")
+        rows = self._query(name, {"customer_id": customer_id, "alias": alias,
+                                   "period_start": start, "period_end": end})
+        return {"customer_id": customer_id, "start": start, "end": end, "usage": rows}
+
+    def billing_by_plan(self, params: Dict[str, str]) -> Dict[str, Any]:
+        start, end = _date_param(params, "start"), _date_param(params, "end")
+        rows = self._query("billing_by_plan", {"period_start": start, "period_end": end})
+        return {"start": start, "end": end, "plans": rows}
+
+    def route(self, path: str, params: Dict[str, str]) -> Any:
+        parts = [p for p in path.split("/") if p]
+        if parts == ["health"]:
+            stats = dict(self.cache.stats)
+            return {"status": "ok", "data_version": self.broker.version,
+                    "cache_hits": stats["memory_hits"] + stats["disk_hits"], "cache_misses": stats["misses"],
+                    "cache_uncached": stats["uncached"]}
+        if len(parts) == 3 and parts[0] == "customers" and parts[2] == "summary":
+            return self.customer_summary(parts[1])
+        if len(parts) == 4 and parts[0] == "customers" and parts[2] == "invoices":
+            return self.invoice(parts[1], parts[3])
+        if len(parts) == 3 and parts[0] == "customers" and parts[2] == "usage":
+            return self.usage(parts[1], params)
+        if parts == ["billing", "plans"]:
+            return self.billing_by_plan(params)
+        raise NotFound(f"Unknown endpoint {path}")
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def make_handler(service: QueryService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload, default=_json_default).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                self._respond(200, service.route(url.path, params))
+            except NotFound as e:
+                self._respond(404, {"error": str(e)})
+            except BadRequest as e:
+                self._respond(400, {"error": str(e)})
+            except duckdb.Error as e:
+                self._respond(500, {"error": f"Query failed: {e}"})
+            except Exception as e:
+                traceback.print_exc()
+                self._respond(500, {"error": f"Internal error: {type(e).__name__}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only query service over the invoicer warehouse")
+    parser.add_argument("--db", default=str(SNAPSHOT_DIR),
+                        help="Snapshot folder published by invoicer.py, or a single DuckDB file")
+    parser.add_argument("--events-db", help="DuckDB file with an events table (e.g. the Task 2 egress.db)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pool-size", type=int, default=8, help="Idle cursors kept per snapshot")
+    parser.add_argument("--cache-mb", type=float, default=MEMORY_BYTES / 1024 ** 2,
+                        help="In-memory result cache size (INVOICER_CACHE_MEMORY_MB)")
+    args = parser.parse_args()
+
+    broker = ConnectionBroker(args.db, on_connect=attach_events(args.events_db), max_idle=args.pool_size,
+                              on_cursor=prepare_statements)
+    service = QueryService(broker, QueryCache(memory_bytes=int(args.cache_mb * 1024 ** 2)))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Query service on http://{args.host}:{args.port} over {args.db}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,70 @@
+# Near-real-time ingestion of usage events (utils/events.py)
+# Tails NDJSON event files and/or listens on a local socket, and appends micro-batches to the
+# `events` table of a DuckDB file, keeping per-customer running counters in `event_counters`.
+# Works against the Task 2 egress.db too: events already loaded from the CSV dump are kept and
+# the counters start from them.
+#
+# Usage (from the task1 folder):
+#   python stream_events.py --db ../task2/egress.db --tail data/events/*.ndjson --listen 127.0.0.1:9099
+#
+# One JSON object per line, with the columns of the egress events table:
+#   {"transaction_id": "...", "customer_id": "...", "timestamp": "2024-03-10 12:00:00",
+#    "event_type": "image_modeler", "properties": "{num_images=2, image_size=1024x1024}",
+#    "environment_type": "PRODUCTION"}
+import argparse
+import time
+
+from utils.events import EventIngestor, FileTailer, SocketSource, committed_offsets, file_source
+from utils.metrics import METRICS
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Stream NDJSON usage events into DuckDB in micro-batches")
+    parser.add_argument("--db", default="events.db")
+    parser.add_argument("--tail", nargs="*", default=[], help="NDJSON files to follow")
+    parser.add_argument("--listen", help="host:port to accept NDJSON over TCP")
+    parser.add_argument("--batch-rows", type=int, default=5000, help="Flush once a batch has this many lines")
+    parser.add_argument("--batch-ms", type=float, default=250, help="Flush a batch at most this long after it started")
+    parser.add_argument("--report-every", type=float, default=5, help="Seconds between progress lines")
+    args = parser.parse_args(argv)
+    if not args.tail and not args.listen:
+        parser.error("Give at least one of --tail or --listen")
+
+    import duckdb
+
+    con = duckdb.connect(args.db)
+    ingestor = EventIngestor(con, max_rows=args.batch_rows, max_latency=args.batch_ms / 1000)
+    offsets = committed_offsets(con)
+    tailers = [FileTailer(path, ingestor.inbox, offsets.get(file_source(path))) for path in args.tail]
+    socket_source = None
+    if args.listen:
+        host, port = args.listen.rsplit(":", 1)
+        socket_source = SocketSource(host, int(port), ingestor.inbox)
+    ingestor.start()
+    for tailer in tailers:
+        tailer.start()
+    if socket_source:
+        socket_source.start()
+        print("Listening on {}:{}".format(*socket_source.address))
+    try:
+        # Runs until interrupted or until the ingestor fails; stop() below raises its error
+        while ingestor.error is None:
+            time.sleep(args.report_every)
+            print(" ".join(f"{k}={v}" for k, v in ingestor.stats.items()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for tailer in tailers:
+            tailer.stop()
+            tailer.join()
+        if socket_source:
+            socket_source.stop()
+        try:
+            ingestor.stop()
+        finally:
+            con.close()
+            METRICS.export("stream_events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Approximate exploration datasets (utils/approx.py)
+#   python -m pytest tests/test_approx.py     (from the task1 folder)
+import gc
+import io
+import threading
+
+import pytest
+
+from utils import approx
+
+pytest.importorskip("duckdb")
+
+
+def _csv(path, rows):
+    path.write_text("status,total\n" + "".join(f"{'open' if i % 3 else 'paid'},{i}\n" for i in range(rows)))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    yield
+    for dataset in approx._DATASETS.values():
+        dataset.close()
+    approx._DATASETS.clear()
+
+
+def test_least_recently_used_dataset_is_closed_and_pruned(tmp_path):
+    explore = tmp_path / "explore"
+    explore.mkdir()
+    files = [_csv(tmp_path / f"export_{i}.csv", 50 + i) for i in range(3)]
+    first = approx.open_dataset(files[0], explore_dir=explore, keep=2)
+    second = approx.open_dataset(files[1], explore_dir=explore, keep=2)
+    assert approx.open_dataset(files[0], explore_dir=explore, keep=2) is first
+    approx.open_dataset(files[2], explore_dir=explore, keep=2)
+
+    # `second` was least recently used: out of the registry and closed, but its file stays while
+    # something still holds the handle
+    assert list(approx._DATASETS) == [first.key, approx.dataset_key(files[2], None, approx.SAMPLE_ROWS, None)]
+    assert second.con is None
+    assert second.db_path.exists()
+    assert first.group_by(["status"]).num_rows == 2
+
+    second_path = second.db_path
+    del second
+    gc.collect()
+    approx.prune(explore, keep=2)
+    assert not second_path.exists()
+    assert len(list(explore.glob("*.duckdb"))) == 2
+
+
+def test_evicted_handle_can_still_be_queried(tmp_path):
+    explore = tmp_path / "explore"
+    explore.mkdir()
+    files = [_csv(tmp_path / f"export_{i}.csv", 60 + i) for i in range(2)]
+    held = approx.open_dataset(files[0], explore_dir=explore, keep=1)
+    # A slow exact query is still queued on the handle when it is evicted
+    future = approx.EXACT_RUNNER.submit(held, "exact_group_by", ["status"], "total")
+    approx.open_dataset(files[1], explore_dir=explore, keep=1)
+    assert held.key not in approx._DATASETS
+
+    assert future.result(timeout=30).num_rows == 2
+    assert held.group_by(["status"], "total").column("row_count").to_pylist() == [40.0, 20.0]
+    # Reopened only for the query, then closed again
+    assert held.con is None
+
+
+def test_build_runs_outside_the_registry_lock(tmp_path, monkeypatch):
+    build = approx.build_dataset
+    locked = []
+
+    def checked_build(*args, **kwargs):
+        locked.append(approx._DATASETS_LOCK.locked())
+        build(*args, **kwargs)
+
+    monkeypatch.setattr(approx, "build_dataset", checked_build)
+    path = _csv(tmp_path / "export.csv", 20)
+    datasets = []
+    threads = [threading.Thread(target=lambda: datasets.append(approx.open_dataset(path, explore_dir=tmp_path)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Built once, by one thread, without holding the registry lock
+    assert locked == [False]
+    assert all(dataset is datasets[0] for dataset in datasets)
+
+
+def test_uploads_are_named_by_content(tmp_path):
+    a = approx.save_upload(io.BytesIO(b"status,total\nopen,1\n"), "export.csv", tmp_path)
+    b = approx.save_upload(io.BytesIO(b"status,total\nopen,2\n"), "export.csv", tmp_path)
+    again = approx.save_upload(io.BytesIO(b"status,total\nopen,1\n"), "export.csv", tmp_path)
+    assert a != b and a == again
+    assert a.read_bytes() == b"status,total\nopen,1\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([a.name, b.name])
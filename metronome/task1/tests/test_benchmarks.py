@@ -0,0 +1,18 @@
+# Benchmark regression check (bench/run_benchmarks.py)
+#   python -m pytest tests/test_benchmarks.py     (from the task1 folder)
+from bench.run_benchmarks import find_regressions
+
+BASELINE = [{"stage": "invoicer_end_to_end", "seconds": 10.0, "peak_rss_mb": 200.0, "ok": True}]
+
+
+def test_failed_run_is_a_regression():
+    # Fails fast, so its timings alone would pass
+    failed = [{"stage": "invoicer_end_to_end", "seconds": 1.0, "peak_rss_mb": 50.0, "ok": False}]
+    assert find_regressions(failed, BASELINE, 0.2) == ["invoicer_end_to_end: failed"]
+    assert find_regressions(failed, [], 0.2) == ["invoicer_end_to_end: failed"]
+
+
+def test_slowdown_past_threshold():
+    slower = [{"stage": "invoicer_end_to_end", "seconds": 12.5, "peak_rss_mb": 210.0, "ok": True}]
+    assert find_regressions(slower, BASELINE, 0.2) == ["invoicer_end_to_end.seconds: 10.0 -> 12.5"]
+    assert find_regressions(slower, BASELINE, 0.3) == []
@@ -0,0 +1,110 @@
+# Micro-batch event ingestion (utils/events.py)
+#   python -m pytest tests/test_events.py     (from the task1 folder)
+import json
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from utils.events import EventIngestor, FileTailer, committed_offsets, file_source
+
+duckdb = pytest.importorskip("duckdb")
+
+
+def _line(tid, customer="c1", ts="2024-03-10 12:00:00", props="{num_images=2, image_size=1024x1024}", **extra):
+    return json.dumps({"transaction_id": tid, "customer_id": customer, "timestamp": ts, "event_type": "image_modeler",
+                       "properties": props, "environment_type": "PRODUCTION", **extra}).encode()
+
+
+def _counters(con):
+    return con.execute("SELECT customer_id, events, num_images FROM event_counters ORDER BY customer_id").fetchall()
+
+
+def test_batch_path_matches_per_event_rules():
+    con = duckdb.connect()
+    ingestor = EventIngestor(con)
+    lines = [
+        _line("t1"),
+        _line("t2", customer="c2", props="{num_images=5}"),
+        _line("t1"),                                         # duplicate inside the batch
+        _line("t3", ts="2024-03-10T14:00:00+02:00"),         # offset: left to pydantic, stored as UTC
+        _line("t4", props="{image_size=512x512}"),           # no num_images
+        _line("t5", props="not properties"),                 # rejected: properties
+        _line("t6", ts="yesterday"),                         # rejected: validation
+        json.dumps({"transaction_id": "t7"}).encode(),       # rejected: validation (missing fields)
+        b"",
+    ]
+    assert ingestor.flush(lines, {}) == 4
+    assert ingestor.stats["rejected"] == 3
+    assert ingestor.stats["duplicates"] == 1
+    assert _counters(con) == [("c1", 3, 4), ("c2", 1, 5)]
+    assert con.execute("SELECT timestamp FROM events WHERE transaction_id = 't3'").fetchone()[0].hour == 12
+
+    # Events from earlier batches are dropped by the table's key; a malformed line makes the
+    # whole batch take the per-event path
+    assert ingestor.flush([_line("t2", customer="c2"), _line("t8", customer="c2"), b"{not json"], {}) == 1
+    assert ingestor.stats["rejected"] == 4
+    assert _counters(con) == [("c1", 3, 4), ("c2", 2, 7)]
+    assert ingestor.counter_snapshot()[("c2", "image_modeler")]["num_images"] == 7
+
+
+def test_tailer_resumes_from_offset_saved_under_any_spelling(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "events.ndjson").write_bytes(_line("t1") + b"\n" + _line("t2") + b"\n")
+    con = duckdb.connect(str(tmp_path / "events.db"))
+    ingestor = EventIngestor(con, max_latency=0.02)
+    tailer = FileTailer("./events.ndjson", ingestor.inbox, poll=0.01)
+    ingestor.start()
+    tailer.start()
+    deadline = time.monotonic() + 10
+    while ingestor.stats["inserted"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tailer.stop()
+    tailer.join()
+    ingestor.stop()
+
+    offsets = committed_offsets(con)
+    assert list(offsets) == [file_source("events.ndjson")]
+    assert offsets[file_source(str(tmp_path / "events.ndjson"))][1] == os.path.getsize("events.ndjson")
+
+    inbox = queue.Queue()
+    resumed = FileTailer("events.ndjson", inbox, offsets.get(file_source("events.ndjson")), poll=0.01)
+    resumed.start()
+    with open("events.ndjson", "ab") as f:
+        f.write(_line("t3") + b"\n")
+    source, _, _, lines = inbox.get(timeout=10)
+    resumed.stop()
+    resumed.join()
+    assert [json.loads(line)["transaction_id"] for line in lines] == ["t3"]
+
+
+def test_failed_flush_is_raised_by_stop(tmp_path):
+    con = duckdb.connect(str(tmp_path / "events.db"))
+    ingestor = EventIngestor(con, max_rows=1, max_latency=0.01, queue_size=4)
+    write = ingestor._write
+    calls = []
+
+    def failing_write(received, events, offsets):
+        calls.append(offsets)
+        if len(calls) == 1:
+            write(received, events, offsets)
+            return
+        raise duckdb.IOException("disk full")
+
+    ingestor._write = failing_write
+    ingestor.start()
+    # Far more batches than the inbox and parsed queues hold: the source must never block
+    put = threading.Thread(target=lambda: [ingestor.inbox.put(("f", 1, i, [_line(f"t{i}")])) for i in range(50)])
+    put.start()
+    put.join(timeout=10)
+    assert not put.is_alive()
+    stopper = threading.Thread(target=lambda: pytest.raises(duckdb.IOException, ingestor.stop))
+    stopper.start()
+    stopper.join(timeout=10)
+    assert not stopper.is_alive()
+    assert isinstance(ingestor.error, duckdb.IOException)
+    # Nothing after the failed batch was written, so the committed offset is the first batch's
+    assert committed_offsets(con) == {"f": (1, 0)}
+    assert con.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 1
@@ -0,0 +1,69 @@
+# Point-in-time balances from utils/ledger.py
+#   python -m pytest tests/test_ledger.py     (from the task1 folder)
+from datetime import datetime
+
+import pytest
+
+from utils import ledger
+
+duckdb = pytest.importorskip("duckdb")
+
+START = datetime(2024, 1, 1)
+
+
+def _grant(amount=100.0):
+    return {"credit_grant_id": "g1", "customer_id": "c1", "name": "promo", "grant_amount": amount,
+            "effective_at": START, "expires_at": datetime(2025, 1, 1), "priority": 1.0}
+
+
+def _entry(effective_at, amount, seq=0, pending=False):
+    return {"customer_id": "c1", "credit_grant_id": "g1", "effective_at": effective_at, "entry_seq": seq,
+            "amount": amount, "running_balance": 0.0, "reason": "usage", "invoice_id": None,
+            "created_by": "test", "pending": pending}
+
+
+def _balance(con, as_of):
+    row = ledger.grant_balances_as_of(con, as_of, "c1").fetchone()
+    return row[8], row[9]
+
+
+@pytest.mark.parametrize("interval", [1, 2, 32])
+def test_deduction_at_grant_start_is_counted(interval):
+    con = duckdb.connect()
+    ledger.create_ledger_tables(con)
+    entries = [_entry(START, -10.0), _entry(datetime(2024, 2, 1), -5.0)]
+    ledger.append(con, [_grant()], entries, interval=interval)
+
+    assert _balance(con, START) == (90.0, 90.0)
+    assert _balance(con, datetime(2024, 1, 15)) == (90.0, 90.0)
+    assert _balance(con, datetime(2024, 3, 1)) == (85.0, 85.0)
+    assert _balance(con, datetime(2023, 12, 31)) == (0.0, 0.0)
+
+
+def test_pending_entries_and_reload():
+    con = duckdb.connect()
+    ledger.create_ledger_tables(con)
+    entries = [_entry(START, -10.0), _entry(datetime(2024, 2, 1), -5.0), _entry(START, -1.0, pending=True)]
+    ledger.append(con, [_grant()], entries)
+    # Loading the same grant again must not duplicate posted entries
+    ledger.append(con, [_grant()], entries)
+    ledger.compact(con)
+
+    assert _balance(con, datetime(2024, 3, 1)) == (85.0, 84.0)
+
+
+def test_reload_with_reordered_deductions():
+    con = duckdb.connect()
+    ledger.create_ledger_tables(con)
+    first = [_entry(START, -10.0, seq=0), _entry(datetime(2024, 2, 1), -5.0, seq=1),
+             _entry(datetime(2024, 2, 1), -5.0, seq=2)]
+    ledger.append(con, [_grant()], first)
+    # The API lists the same deductions in another order, plus a new one
+    second = [_entry(datetime(2024, 2, 1), -5.0, seq=0), _entry(START, -10.0, seq=1),
+              _entry(datetime(2024, 2, 1), -5.0, seq=2), _entry(datetime(2024, 4, 1), -1.0, seq=3)]
+    ledger.append(con, [_grant()], second)
+    ledger.compact(con)
+
+    assert con.execute("SELECT COUNT(*) FROM credit_ledger").fetchone()[0] == 4
+    assert _balance(con, datetime(2024, 3, 1)) == (80.0, 80.0)
+    assert _balance(con, datetime(2024, 5, 1)) == (79.0, 79.0)
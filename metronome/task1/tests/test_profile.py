@@ -0,0 +1,32 @@
+# INVOICER_PROFILE dumps include the work done in pipeline worker threads
+#   python -m pytest tests/test_profile.py     (from the task1 folder)
+import pstats
+
+from utils.metrics import start_profile, stop_profile
+from utils.pipeline import Pipeline, Stage
+
+
+def fetch_items(item):
+    return [item * 2]
+
+
+def validate_items(item):
+    return [sum(range(item))]
+
+
+def load_items(item):
+    return None
+
+
+def test_profile_contains_stage_functions(tmp_path):
+    path = tmp_path / "run.prof"
+    handle = start_profile(str(path))
+    Pipeline([
+        Stage("fetch", fetch_items, workers=2),
+        Stage("validate", validate_items, workers=2),
+        Stage("load", load_items),
+    ]).run(range(200))
+    stop_profile(handle)
+
+    functions = {name for _, _, name in pstats.Stats(str(path)).stats}
+    assert {"fetch_items", "validate_items", "load_items"} <= functions
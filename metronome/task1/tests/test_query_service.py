@@ -0,0 +1,132 @@
+# Query service (query_service.py): prepared statements on pooled cursors, cached results
+#   python -m pytest tests/test_query_service.py     (from the task1 folder)
+from datetime import datetime
+
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from query_service import QueryService, make_handler, prepare_statements
+from utils import ledger
+from utils.result_cache import QueryCache
+from utils.storage import ConnectionBroker
+from utils.warehouse import TABLE_MODELS, append_rows, bump_versions, create_tables, create_version_table
+
+duckdb = pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "invoicer.duckdb"
+    con = duckdb.connect(str(path))
+    create_tables(con)
+    ledger.create_ledger_tables(con)
+    create_version_table(con)
+    append_rows(con, "customers", [{"id": "c1", "name": "O'Brien & Co", "external_id": "ext-1"}])
+    append_rows(con, "invoices", [
+        {"id": "i1", "customer_id": "c1", "status": "FINALIZED", "total": 40.0, "plan_name": "basic",
+         "start_timestamp": "2024-01-01T00:00:00Z", "end_timestamp": "2024-02-01"},
+        {"id": "i2", "customer_id": "c1", "status": "FINALIZED", "total": 60.0, "plan_name": "basic",
+         "start_timestamp": "2024-02-01T00:00:00Z", "end_timestamp": "2024-03-01"},
+    ])
+    con.execute("CREATE TABLE events (transaction_id VARCHAR, customer_id VARCHAR, event_type VARCHAR, "
+                "timestamp TIMESTAMP)")
+    con.execute("""INSERT INTO events VALUES
+        ('t1', 'c1', 'api_call', '2024-01-31 23:00:00'), ('t2', 'ext-1', 'api_call', '2024-02-01 01:00:00'),
+        ('t3', 'c1', 'api_call', '2024-02-02 00:00:00')""")
+    grant = {"credit_grant_id": "g1", "customer_id": "c1", "name": "promo", "grant_amount": 100.0,
+             "effective_at": datetime(2024, 1, 1), "expires_at": datetime(2099, 1, 1), "priority": 1.0}
+    ledger.append(con, [grant], [])
+    bump_versions(con, list(TABLE_MODELS) + ledger.LEDGER_TABLES)
+    con.close()
+    return path
+
+
+@pytest.fixture
+def service(db):
+    broker = ConnectionBroker(db, max_idle=1, on_cursor=prepare_statements)
+    yield QueryService(broker, QueryCache(cache_dir=None))
+    broker.close()
+
+
+def test_statements_are_prepared_once_per_cursor(db):
+    prepared = []
+
+    def on_cursor(cur):
+        prepared.append(cur)
+        prepare_statements(cur)
+
+    broker = ConnectionBroker(db, max_idle=1, on_cursor=on_cursor)
+    service = QueryService(broker, QueryCache(cache_dir=None, memory_bytes=0))
+    assert service.invoice("c1", "i1")["total"] == 40.0
+    assert service.invoice("c1", "i2")["total"] == 60.0
+    # The pooled cursor is reused; its statements are not prepared again
+    assert len(prepared) == 1
+    broker.close()
+
+
+def test_results_are_cached_per_table_version(service):
+    summary = service.customer_summary("c1")
+    assert summary["name"] == "O'Brien & Co"
+    assert summary["invoice_count"] == 2
+    assert summary["current_invoice_balance"] == 60.0
+    assert summary["credit_balance"] == 100.0
+    assert service.customer_summary("c1") == summary
+    assert service.cache.stats["misses"] == 1
+    assert service.cache.stats["memory_hits"] == 1
+
+
+def test_values_are_quoted(service):
+    from query_service import NotFound
+
+    with pytest.raises(NotFound):
+        service.invoice("c1", "i1' OR '1'='1")
+
+
+def test_usage_covers_the_end_day(service):
+    usage = service.usage("c1", {"start": "2024-01-31", "end": "2024-02-01", "alias": "ext-1"})
+    assert [(row["day"].isoformat(), row["events"]) for row in usage["usage"]] == [
+        ("2024-01-31", 1), ("2024-02-01", 1)]
+
+
+def test_billing_by_plan(service):
+    plans = service.billing_by_plan({"start": "2024-02-01", "end": "2024-12-31"})["plans"]
+    assert plans == [{"plan_name": "basic", "customers": 1, "invoices": 1, "total_billed": 60.0}]
+
+
+@pytest.fixture
+def base_url(service):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_http_endpoints(base_url):
+    status, body = _get(base_url + "/billing/plans?start=2024-01-01&end=2024-12-31")
+    assert status == 200 and body["plans"][0]["invoices"] == 2
+    status, body = _get(base_url + "/customers/c1/usage?start=2024-01-01&end=2024-12-31")
+    assert status == 200 and sum(row["events"] for row in body["usage"]) == 2
+    assert _get(base_url + "/billing/plans?start=2024-01-01")[0] == 400
+
+
+def test_unexpected_errors_are_a_500(service, base_url, monkeypatch):
+    def broken(customer_id):
+        raise KeyError("credit_balance")
+
+    monkeypatch.setattr(service, "customer_summary", broken)
+    status, body = _get(base_url + "/customers/c1/summary")
+    assert status == 500 and body["error"] == "Internal error: KeyError"
@@ -0,0 +1,48 @@
+# Task 1 summary report (invoicer.report) over a loaded database
+#   python -m pytest tests/test_report.py     (from the task1 folder)
+from datetime import datetime
+
+import pytest
+
+import invoicer
+from utils import ledger
+from utils.warehouse import TABLE_MODELS, append_rows, bump_versions, create_tables, create_version_table
+
+duckdb = pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def con(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "processed").mkdir(parents=True)
+    (tmp_path / "submissions").mkdir()
+    con = invoicer.connect(":memory:")
+    create_tables(con)
+    ledger.create_ledger_tables(con)
+    create_version_table(con)
+    append_rows(con, "customers", [{"id": "c1", "name": "Acme"}])
+    append_rows(con, "invoices", [{"id": "i1", "customer_id": "c1", "status": "FINALIZED", "total": 12345.0,
+                                   "end_timestamp": "2024-02-01T00:00:00Z"}])
+    grant = {"credit_grant_id": "g1", "customer_id": "c1", "name": "promo", "grant_amount": 10000.0,
+             "effective_at": datetime(2024, 1, 1), "expires_at": datetime(2024, 6, 1), "priority": 1.0}
+    deduction = {"customer_id": "c1", "credit_grant_id": "g1", "effective_at": datetime(2024, 2, 1), "entry_seq": 0,
+                 "amount": -2500.0, "running_balance": 7500.0, "reason": "usage", "invoice_id": "i1",
+                 "created_by": "test", "pending": False}
+    ledger.append(con, [grant], [deduction])
+    bump_versions(con, list(TABLE_MODELS) + ledger.LEDGER_TABLES)
+    return con
+
+
+def _report_lines(con, as_of):
+    invoicer.report(con, as_of)
+    return invoicer.REPORT_CSV.read_text().splitlines()
+
+
+def test_report_as_of_a_past_date(con):
+    args = invoicer.parse_args(["--as-of", "2024-03-31"])
+    assert _report_lines(con, args.as_of) == [
+        "name,current_invoice_balance,credit_balance", "Acme,$123.45 USD,$75.0 USD"]
+
+
+def test_grant_has_expired_by_default(con):
+    assert _report_lines(con, None)[1] == "Acme,$123.45 USD,$0.0 USD"
@@ -0,0 +1,65 @@
+# Query result cache keys (utils/result_cache.py)
+#   python -m pytest tests/test_result_cache.py     (from the task1 folder)
+from datetime import datetime
+
+import pytest
+
+from utils import ledger
+from utils.result_cache import QueryCache, is_volatile
+from utils.warehouse import bump_versions, create_version_table
+
+duckdb = pytest.importorskip("duckdb")
+
+BALANCE_SQL = "SELECT customer_id, credit_balance FROM customer_credit_balances_as_of($as_of)"
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    ledger.create_ledger_tables(con)
+    create_version_table(con)
+    grant = {"credit_grant_id": "g1", "customer_id": "c1", "name": "promo", "grant_amount": 100.0,
+             "effective_at": datetime(2024, 1, 1), "expires_at": datetime(2024, 6, 1), "priority": 1.0}
+    ledger.append(con, [grant], [])
+    bump_versions(con, ledger.LEDGER_TABLES)
+    return con
+
+
+def test_as_of_is_part_of_the_key(con, tmp_path):
+    cache = QueryCache(tmp_path)
+    before = cache.query(con, BALANCE_SQL, {"as_of": datetime(2024, 3, 1)})
+    after = cache.query(con, BALANCE_SQL, {"as_of": datetime(2024, 7, 1)})
+    assert before.column("credit_balance").to_pylist() == [100.0]
+    assert after.column("credit_balance").to_pylist() == [0.0]
+    assert cache.stats["misses"] == 2
+
+    # A new process sharing the disk tier gets the result for the same as-of time
+    again = QueryCache(tmp_path).query(con, BALANCE_SQL, {"as_of": datetime(2024, 3, 1)})
+    assert again.equals(before)
+
+
+def test_time_dependent_sql_is_not_cached(con, tmp_path):
+    cache = QueryCache(tmp_path)
+    sql = "SELECT * FROM customer_credit_balances_as_of(now() AT TIME ZONE 'UTC')"
+    cache.query(con, sql)
+    cache.query(con, sql)
+    assert cache.stats["uncached"] == 2
+    assert not list(tmp_path.glob("*.arrow"))
+
+
+def test_is_volatile():
+    assert is_volatile("SELECT now()")
+    assert is_volatile("SELECT CURRENT_TIMESTAMP")
+    assert not is_volatile("SELECT 'now' AS word FROM invoices")
+    assert not is_volatile("SELECT nowhere FROM invoices")
+
+
+def test_bound_queries_are_timed_and_explained(con, tmp_path, monkeypatch):
+    from utils.metrics import METRICS
+
+    monkeypatch.setenv("INVOICER_EXPLAIN", "1")
+    seen = len(METRICS.events)
+    QueryCache(tmp_path).query(con, BALANCE_SQL, {"as_of": datetime(2024, 3, 1)}, name="bound_balance")
+    explained = [e for e in METRICS.events[seen:] if e["event"] == "duckdb_explain_analyze"]
+    assert [e["query"] for e in explained] == ["bound_balance"]
+    assert METRICS.histograms[("duckdb_statement_seconds", (("query", "bound_balance"),))].count == 1
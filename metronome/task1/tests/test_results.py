@@ -0,0 +1,73 @@
+# CSV output of the Arrow result path (utils/results.py)
+#   python -m pytest tests/test_results.py     (from the task1 folder)
+import io
+from pathlib import Path
+
+import pytest
+
+from utils.results import write_csv
+
+pa = pytest.importorskip("pyarrow")
+pd = pytest.importorskip("pandas")
+
+TASK1_DIR = Path(__file__).resolve().parents[1]
+
+
+def test_csv_is_quoted_only_where_needed(tmp_path):
+    table = pa.table({
+        "name": ["AJLUAY Corp.", "Smith, Jones & Co", 'The "Best" Inc', None],
+        "current_invoice_balance": ["$1629.04 USD", "$1.0 USD", None, "$0.0 USD"],
+        "total": [1629.04, 1.0, None, 0.5],
+    })
+    path = tmp_path / "report.csv"
+    assert write_csv(table, path) == 4
+    assert path.read_text() == (
+        "name,current_invoice_balance,total\n"
+        "AJLUAY Corp.,$1629.04 USD,1629.04\n"
+        '"Smith, Jones & Co",$1.0 USD,1.0\n'
+        '"The ""Best"" Inc",,\n'
+        ",$0.0 USD,0.5\n"
+    )
+
+
+def test_floats_are_written_like_pandas(tmp_path):
+    values = [1.0, 0.0, -0.0, 1e15, 123456789012345.0, 1e16, 1e-05, 0.1, 1 / 3, float("nan"), float("inf"), None]
+    keys = [f"k{i}" for i in range(len(values))]
+    table = pa.table({"key": keys, "x": pa.array(values, pa.float64())})
+    path = tmp_path / "floats.csv"
+    write_csv(table, path)
+    expected = io.StringIO()
+    pd.DataFrame({"key": keys, "x": pd.Series(values, dtype="float64")}).to_csv(expected, index=False)
+    assert path.read_text() == expected.getvalue()
+
+    table = pa.table({"y": pa.array([1.0, 1.5, None], pa.float32())})
+    write_csv(table, path)
+    assert path.read_text() == "y\n1.0\n1.5\n\n"
+
+
+def test_nested_columns_are_json(tmp_path):
+    table = pa.table({
+        "id": ["i1", "i2"],
+        "line_items": [[{"name": "seats", "total": 10.0}], []],
+        "custom_fields": pa.array([{"plan": "pro"}, None], pa.struct([("plan", pa.string())])),
+    })
+    path = tmp_path / "nested.csv"
+    assert write_csv(table, path) == 2
+    assert path.read_text() == (
+        "id,line_items,custom_fields\n"
+        'i1,"[{""name"": ""seats"", ""total"": 10.0}]","{""plan"": ""pro""}"\n'
+        "i2,[],\n"
+    )
+
+
+def test_csv_matches_the_submission_format(tmp_path):
+    sample = TASK1_DIR / "submissions" / "task_1_invoicing.csv"
+    expected = sample.read_text()
+    import pyarrow.csv as pacsv
+
+    table = pacsv.read_csv(sample, convert_options=pacsv.ConvertOptions(
+        column_types={"name": pa.string(), "current_invoice_balance": pa.string(), "credit_balance": pa.string()},
+        strings_can_be_null=True))
+    path = tmp_path / "report.csv"
+    write_csv(pa.RecordBatchReader.from_batches(table.schema, table.to_batches(max_chunksize=7)), path)
+    assert path.read_text() == expected
@@ -0,0 +1,57 @@
+# Sharded invoicer runs followed by --resume, against the mock API
+#   python -m pytest tests/test_sharding.py     (from the task1 folder)
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from bench.generate_data import generate
+from bench.mock_api import serve_in_thread
+
+duckdb = pytest.importorskip("duckdb")
+
+TASK1_DIR = Path(__file__).resolve().parents[1]
+
+
+def _invoicer(run_dir: Path, base_url: str, *args: str) -> None:
+    env = dict(os.environ, BASE_URL=base_url, API_KEY="test", PYTHONPATH=str(TASK1_DIR))
+    proc = subprocess.run([sys.executable, str(TASK1_DIR / "invoicer.py"), *args], cwd=run_dir, env=env,
+                          capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+
+
+def _counts(run_dir: Path):
+    from utils.storage import current_snapshot
+
+    con = duckdb.connect(str(current_snapshot(run_dir / "data" / "snapshots")), read_only=True)
+    try:
+        return {table: con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("customers", "invoices", "credit_balances", "credit_ledger", "_checkpoints")}
+    finally:
+        con.close()
+
+
+def test_resume_after_merge_skips_sharded_work(tmp_path):
+    dataset = generate(40, 3, 1, events=0, seed=3)
+    server, base_url = serve_in_thread(dataset)
+    try:
+        (tmp_path / "submissions").mkdir()
+        _invoicer(tmp_path, base_url, "--shards", "2")
+        merged = _counts(tmp_path)
+        requests_before = server.api.request_count
+        _invoicer(tmp_path, base_url, "--resume")
+        resumed = _counts(tmp_path)
+        invoice_requests = server.api.request_count - requests_before
+    finally:
+        server.shutdown()
+
+    assert merged["customers"] == 40
+    assert merged["invoices"] == sum(len(v) for v in dataset["invoices"].values())
+    assert merged["_checkpoints"] == 3 * 40
+    assert resumed == merged
+    # Only the customer listing is requested again
+    assert invoice_requests == 1
+    report = (tmp_path / "submissions" / "task_1_invoicing_invoicer.csv").read_text().splitlines()
+    assert len(report) == 1 + 40
@@ -1,13 +1,14 @@
 from pydantic import BaseModel, ValidationError
 import requests
 from requests.exceptions import HTTPError, RequestException
-import pandas as pd
-from typing import List, Optional, Union, Dict, Any
+from typing import List, Optional, Union, Dict, Any, Iterator
 from dotenv import load_dotenv
 import os
+import time
 from datetime import datetime
 #from uuid import UUID
 import json
+from .metrics import METRICS, endpoint_label
 
 
 # Get parent path
@@ -130,68 +131,118 @@ class CreditGrant(BaseModel):
 
 
 
-# Function to handle HTTP GET requests
-def get(endpoint: str, params: dict = {}) -> Dict[str, Any]:
+# Validate raw API records into models, recording validation time per model
+def validate_records(model, items: List[Dict[str, Any]]) -> List[Any]:
+    start = time.perf_counter()
+    records = [model(**item) for item in items]
+    METRICS.observe("invoicer_validation_seconds", time.perf_counter() - start, model=model.__name__)
+    METRICS.inc("invoicer_validated_records_total", len(records), model=model.__name__)
+    return records
+
+
+# Retry transient failures (rate limits, 5xx, dropped connections) with exponential backoff
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", 0.5))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Shared request path for GET/POST: retries, latency metrics and error mapping
+def _send(method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
     headers = {"Authorization": f"Bearer {API_KEY}"}
     full_endpoint = f"{BASE_URL}/{endpoint}"
+    label = endpoint_label(endpoint)
     
-    try:
-        response = requests.get(full_endpoint, headers=headers, params=params)
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
-        
-        return response.json()  # Successful response, return JSON
-        
-    except HTTPError as http_err:
-        if response.status_code == 401:
-            return {"error": "Unauthorized access, please check your API key."}
-        elif response.status_code == 403:
-            return {"error": "Forbidden access, you don't have permission."}
-        elif response.status_code == 404:
-            return {"error": "Endpoint not found."}
-        elif response.status_code == 500:
-            return {"error": "Internal server error, please try again later."}
-        else:
-            return {"error": f"HTTP error occurred: {http_err}"}  # Catching all HTTP errors
-    except RequestException as req_err:
-        return {"error": f"Request error occurred: {req_err}"}  # For any other request issues
-    except Exception as err:
-        return {"error": f"An unexpected error occurred: {err}"}
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            METRICS.inc("metronome_request_retries_total", endpoint=label, method=method)
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        start = time.perf_counter()
+        response = None
+        try:
+            response = requests.request(method, full_endpoint, headers=headers, **kwargs)
+            response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
+            
+            return response.json()  # Successful response, return JSON
+            
+        except HTTPError as http_err:
+            if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                continue
+            METRICS.inc("metronome_request_errors_total", endpoint=label, method=method, status=response.status_code)
+            if response.status_code == 401:
+                return {"error": "Unauthorized access, please check your API key."}
+            elif response.status_code == 403:
+                return {"error": "Forbidden access, you don't have permission."}
+            elif response.status_code == 404:
+                return {"error": "Endpoint not found."}
+            elif response.status_code == 500:
+                return {"error": "Internal server error, please try again later."}
+            else:
+                return {"error": f"HTTP error occurred: {http_err}"}  # Catching all HTTP errors
+        except RequestException as req_err:
+            if attempt < MAX_RETRIES:
+                continue
+            METRICS.inc("metronome_request_errors_total", endpoint=label, method=method, status="network")
+            return {"error": f"Request error occurred: {req_err}"}  # For any other request issues
+        except Exception as err:
+            METRICS.inc("metronome_request_errors_total", endpoint=label, method=method, status="unexpected")
+            return {"error": f"An unexpected error occurred: {err}"}
+        finally:
+            status = response.status_code if response is not None else "network"
+            METRICS.observe("metronome_request_seconds", time.perf_counter() - start,
+                            endpoint=label, method=method, status=status)
+
+
+# Function to handle HTTP GET requests
+def get(endpoint: str, params: dict = {}) -> Dict[str, Any]:
+    return _send("GET", endpoint, params=params)
 
 
 # Function to handle HTTP POST requests
 def post(endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    full_endpoint = f"{BASE_URL}/{endpoint}"
-    
-    try:
-        response = requests.post(full_endpoint, headers=headers, json=data)
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
-        
-        return response.json()  # Successful response, return JSON
-    
-    except HTTPError as http_err:
-        if response.status_code == 401:
-            return {"error": "Unauthorized access, please check your API key."}
-        elif response.status_code == 403:
-            return {"error": "Forbidden access, you don't have permission."}
-        elif response.status_code == 404:
-            return {"error": "Endpoint not found."}
-        elif response.status_code == 500:
-            return {"error": "Internal server error, please try again later."}
-        else:
-            return {"error": f"HTTP error occurred: {http_err}"}  # Catching all HTTP errors
-    except RequestException as req_err:
-        return {"error": f"Request error occurred: {req_err}"}  # For any other request issues
-    except Exception as err:
-        return {"error": f"An unexpected error occurred: {err}"}
+    return _send("POST", endpoint, json=data)
+
+
+# Follow `next_page` cursors, yielding each raw page response.
+# GET endpoints take the cursor as a query param, POST endpoints in the body.
+# An error response is yielded as-is and ends the iteration.
+def iter_pages(method: str, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    params = dict(params or {})
+    while True:
+        raw_data = get(endpoint, params=params) if method == "GET" else post(endpoint, params)
+        yield raw_data
+        next_page = raw_data.get("next_page")
+        if "error" in raw_data or not next_page:
+            return
+        params["next_page"] = next_page
+
+
+# Fetch every page of an endpoint into a single {"data": [...]} response (or the first error)
+def fetch_all(method: str, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    data = []
+    for page in iter_pages(method, endpoint, params):
+        if "error" in page:
+            return page
+        data.extend(page.get("data", []))
+    return {"data": data}
+
+
+def fetch_customer_invoices_raw(customer_id: str) -> Dict[str, Any]:
+    return fetch_all("GET", f"customers/{customer_id}/invoices")
+
+
+def fetch_credit_grants_raw(customer_ids: List[str]) -> Dict[str, Any]:
+    return fetch_all("POST", "credits/listGrants", {"customer_ids": customer_ids})
 
 
 def get_customers(**params) -> List[Customer]:
-        raw_data = get("customers", params=params)
+        raw_data = fetch_all("GET", "customers", params=params)
         print(params)
+        if "error" in raw_data:
+            print("Error fetching customers:", raw_data["error"])
+            return []
         try:
             # Extract customers from 'data' key and convert each entry to a Customer model
-            return [Customer(**item) for item in raw_data.get("data", [])]
+            return validate_records(Customer, raw_data.get("data", []))
         except ValidationError as e:
             print("Validation error:", e.json())
             return []
@@ -206,7 +257,7 @@ def get_customer(customer_id: str) -> Customer:
     
 
 def get_customer_invoices(customer_id: str) -> List[Invoice]:
-    raw_data = get(f"customers/{customer_id}/invoices")
+    raw_data = fetch_customer_invoices_raw(customer_id)
     # If the raw_data contains an error, return an empty list
     if "error" in raw_data:
         print("Error fetching invoices:", raw_data["error"])
@@ -215,13 +266,13 @@ def get_customer_invoices(customer_id: str) -> List[Invoice]:
     print("Fetching invoices for customer:", customer_id)
     try:
         # Return the list of Invoice objects, assuming "data" is the correct key for valid responses
-        return [Invoice(**item) for item in raw_data.get("data", [])]
+        return validate_records(Invoice, raw_data.get("data", []))
     except ValidationError as e:
         print("Validation error:", e.json())
         return []
 
 def get_credit_balances(**data: Dict[str, Any]) -> List[Balance]:
-    raw_data = post("credits/listGrants", data)
+    raw_data = fetch_all("POST", "credits/listGrants", data)
     # If the raw_data contains an error, return an empty list
     if "error" in raw_data:
         print("Error fetching balances:", raw_data["error"])
@@ -230,7 +281,7 @@ def get_credit_balances(**data: Dict[str, Any]) -> List[Balance]:
     print("Fetching balances for {} customers".format(len(data.get("customer_ids", []))))
     try:
         # Parse the raw data into CreditGrant objects and return only the balance part
-        credit_grants = [CreditGrant(**item) for item in raw_data.get("data", [])]
+        credit_grants = validate_records(CreditGrant, raw_data.get("data", []))
         return [grant for grant in credit_grants]
     except ValidationError as e:
         print("Validation error:", e.json())
@@ -257,21 +308,32 @@ def unnest_dict(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def load_and_process_data(api_results,json_file_raw,json_file_flat, csv_file):
+# json_file_raw / json_file_flat may be None to skip those files; with archive_key the records
+# are stored in the content-addressed archive (utils/archive.py) under a manifest of their own
+def load_and_process_data(api_results,json_file_raw,json_file_flat, csv_file, archive_key=None):
     # Convert data models to dictionaries
     data_dicts_list = models_to_dicts(api_results)
 
+    if archive_key:
+        from .archive import RunArchive, new_run_id
+        archive = RunArchive(new_run_id(archive_key))
+        archive.add(archive_key, data_dicts_list)
+        archive.write()
 
     # Write JSON data to JSON file
-    with open(json_file_raw, "w") as f:
-        json.dump(data_dicts_list, f)
+    if json_file_raw:
+        with open(json_file_raw, "w") as f:
+            json.dump(data_dicts_list, f)
 
     flat_data = [unnest_dict(d) for d in data_dicts_list]
 
     # Write flattened JSON data to JSON file
-    with open(json_file_flat, "w") as f:
-        json.dump(flat_data, f)
+    if json_file_flat:
+        with open(json_file_flat, "w") as f:
+            json.dump(flat_data, f)
     # Convert JSON data to a Pandas DataFrame and write to CSV
+    # pandas is imported lazily so the API client can be used without it
+    import pandas as pd
     df = pd.DataFrame(flat_data)
     df.to_csv(csv_file, index=False)
     return df
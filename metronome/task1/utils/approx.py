@@ -0,0 +1,431 @@
+# Approximate exploration of large CSV/Parquet exports (the app's summary and explorer tabs)
+# Opening a file imports it once into a scratch DuckDB database under EXPLORE_DIR and, in the same
+# step, builds what the interactive queries read instead of the full table:
+#   sample    SAMPLE_ROWS rows, a uniform reservoir sample or stratified on one column (so a rare
+#             status or a small customer is not lost); each row carries its weight N_h / n_h
+#   strata    population and sample size per stratum
+#   profile   per column over the full table: HyperLogLog distinct count (approx_count_distinct)
+#             and, for numeric columns, t-digest quantiles (approx_quantile), min, max and mean
+# Group-bys run on the sample and return estimates with 95% confidence intervals (stratified
+# expansion estimator for counts and sums, ratio estimator for means); per-group quantiles come
+# with a DKW bound on their rank error. The exact query runs over the full table on a background
+# thread (ExactRunner) when the user asks for it.
+#
+#   dataset = open_dataset("data/processed/invoices.csv", strata="status")
+#   estimate = dataset.group_by(["status"], "total")          # pyarrow.Table, from the sample
+#   future = EXACT_RUNNER.submit(dataset, "exact_group_by", ["status"], "total")
+#
+# The database for a file is keyed on its path, size, mtime and the sampling options, so reruns
+# and restarts reuse it; duckdb is imported inside the functions like elsewhere in utils.
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from .checkpoint import atomic_path
+from .metrics import METRICS, timed_query
+
+EXPLORE_DIR = Path(os.getenv("INVOICER_EXPLORE_DIR", "data/explore"))
+SAMPLE_ROWS = int(os.getenv("INVOICER_SAMPLE_ROWS", 100_000))
+# Every stratum keeps at least this many sampled rows (or all of its rows)
+MIN_STRATUM_ROWS = int(os.getenv("INVOICER_MIN_STRATUM_ROWS", 1000))
+KEEP_DATASETS = int(os.getenv("INVOICER_EXPLORE_KEEP", 8))
+EXACT_WORKERS = int(os.getenv("INVOICER_EXACT_WORKERS", 2))
+PROFILE_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+SAMPLE_SEED = 42
+Z_95 = 1.96
+# Bumped when the layout of the scratch database changes
+LAYOUT_VERSION = 1
+
+# Every dataset handle not yet garbage collected; prune() keeps their files
+_LIVE: "weakref.WeakSet[ApproxDataset]" = weakref.WeakSet()
+
+NUMERIC_TYPES = {"TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT",
+                 "UINTEGER", "UBIGINT", "FLOAT", "DOUBLE", "REAL"}
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def is_numeric(column_type: str) -> bool:
+    return column_type in NUMERIC_TYPES or column_type.startswith("DECIMAL")
+
+
+def _reader(path: Path) -> str:
+    if path.suffix.lower() == ".parquet":
+        return f"read_parquet({quote_literal(path)})"
+    return f"read_csv_auto({quote_literal(path)})"
+
+
+# Column names of a file without importing it (DuckDB only sniffs the head)
+def source_columns(path) -> List[str]:
+    import duckdb
+
+    con = duckdb.connect()
+    try:
+        return [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {_reader(Path(path))}").fetchall()]
+    finally:
+        con.close()
+
+
+def _quantile_list(qs: Sequence[float]) -> str:
+    return "[" + ", ".join(repr(float(q)) for q in qs) + "]"
+
+
+class ApproxDataset:
+    # Handles stay usable after close() (e.g. eviction from the registry while a Streamlit session
+    # or an ExactRunner job still holds one): a query on a closed dataset reopens the connection
+    # for as long as queries are running
+    def __init__(self, db_path: Path, key: str):
+        self.db_path = db_path
+        self.key = key
+        self.con = self._connect()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._closing = False
+        with _DATASETS_LOCK:
+            _LIVE.add(self)
+        meta = dict(self.con.execute("SELECT key, value FROM meta").fetchall())
+        self.source = meta["source"]
+        self.strata = meta["strata"] or None
+        self.population = int(meta["population"])
+        self.sample_rows = int(meta["sample_rows"])
+        self.column_types: Dict[str, str] = {
+            name: column_type for name, column_type, *_ in self.con.execute("DESCRIBE data").fetchall()}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.column_types)
+
+    @property
+    def numeric_columns(self) -> List[str]:
+        return [name for name, column_type in self.column_types.items() if is_numeric(column_type)]
+
+    # Every query gets its own cursor, so the UI and ExactRunner threads can share a dataset
+    def _query(self, sql: str, name: str):
+        with self._lock:
+            if self.con is None:
+                self.con = self._connect()
+                METRICS.inc("invoicer_explore_datasets_total", outcome="reopened")
+            self._active += 1
+            con = self.con
+        try:
+            cur = con.cursor()
+            try:
+                return timed_query(cur, sql, name).fetch_arrow_table()
+            finally:
+                cur.close()
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._closing and self._active == 0:
+                    self._close_connection()
+
+    def _connect(self):
+        import duckdb
+
+        return duckdb.connect(str(self.db_path), read_only=True)
+
+    # Call with self._lock held
+    def _close_connection(self) -> None:
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    def profile(self):
+        return self._query("SELECT * FROM profile ORDER BY position", "explore_profile")
+
+    def head(self, rows: int = 5):
+        return self._query(f"SELECT * FROM data LIMIT {int(rows)}", "explore_head")
+
+    # The sample without its bookkeeping columns (e.g. for the LangChain agent)
+    def sample_table(self):
+        return self._query("SELECT * EXCLUDE (_stratum, _weight) FROM sample", "explore_sample")
+
+    # Estimated row count, sum and mean of `value` per group, from the sample, with the half-width
+    # of a 95% confidence interval next to each (`row_count_ci`, `value_sum_ci`, `value_mean_ci`). Groups absent
+    # from the sample are absent from the result.
+    def group_by(self, by: Sequence[str], value: Optional[str] = None, z: float = Z_95):
+        keys = ", ".join(quote_ident(c) for c in by)
+        lead = keys + ", " if keys else ""
+        v = f"CAST({quote_ident(value)} AS DOUBLE)" if value else "0"
+        partition = f"PARTITION BY {keys}" if keys else ""
+        # k = N_h (N_h - n_h) / (n_h (n_h - 1)): variance of an expanded total per unit of
+        # within-stratum sum of squares; zero when the stratum was sampled whole
+        sql = f"""
+            WITH per AS (
+                SELECT {lead}_stratum, COUNT(*)::DOUBLE AS c,
+                       COALESCE(SUM({v}), 0) AS sv, COALESCE(SUM({v} * {v}), 0) AS svv
+                FROM sample GROUP BY {lead}_stratum
+            ), est AS (
+                SELECT per.*, s.population::DOUBLE / s.sampled AS w, s.sampled::DOUBLE AS n,
+                       s.population::DOUBLE * (s.population - s.sampled) / s.sampled
+                           / GREATEST(s.sampled - 1, 1) AS k
+                FROM per JOIN strata s ON per._stratum = s.stratum
+            ), ratio AS (
+                SELECT est.*, SUM(w * sv) OVER ({partition}) / SUM(w * c) OVER ({partition}) AS r
+                FROM est
+            )
+            SELECT {lead}SUM(c)::BIGINT AS sample_rows,
+                   SUM(w * c) AS row_count,
+                   {z} * sqrt(GREATEST(SUM(k * (c - c * c / n)), 0)) AS row_count_ci"""
+        if value:
+            sql += f""",
+                   SUM(w * sv) AS value_sum,
+                   {z} * sqrt(GREATEST(SUM(k * (svv - sv * sv / n)), 0)) AS value_sum_ci,
+                   ANY_VALUE(r) AS value_mean,
+                   {z} * sqrt(GREATEST(SUM(k * ((svv - 2 * r * sv + r * r * c) - (sv - r * c) ^ 2 / n)), 0))
+                       / SUM(w * c) AS value_mean_ci"""
+        sql += " FROM ratio"
+        if keys:
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return self._query(sql, "explore_approx_group_by")
+
+    def exact_group_by(self, by: Sequence[str], value: Optional[str] = None):
+        keys = ", ".join(quote_ident(c) for c in by)
+        lead = keys + ", " if keys else ""
+        sql = f"SELECT {lead}COUNT(*) AS row_count"
+        if value:
+            v = f"CAST({quote_ident(value)} AS DOUBLE)"
+            sql += f", SUM({v}) AS value_sum, AVG({v}) AS value_mean"
+        sql += " FROM data"
+        if keys:
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return self._query(sql, "explore_exact_group_by")
+
+    # Quantiles of `column` per group from the sample (t-digest), with the DKW bound on their rank
+    # error for each group's sample size. Without `by`, the full-table sketch taken at load time is
+    # returned (rank error 0 here; the t-digest's own error is far smaller than the sample's).
+    # Rows are not weighted, so on a stratified sample group by the strata column for unbiased results.
+    def quantiles(self, column: str, by: Sequence[str] = (), qs: Sequence[float] = PROFILE_QUANTILES):
+        if not by and tuple(qs) == PROFILE_QUANTILES:
+            return self._query(
+                f"SELECT non_null AS sample_rows, quantiles, 0.0::DOUBLE AS rank_error FROM profile "
+                f"WHERE \"column\" = {quote_literal(column)}", "explore_quantiles")
+        keys = ", ".join(quote_ident(c) for c in by)
+        lead = keys + ", " if keys else ""
+        v = f"CAST({quote_ident(column)} AS DOUBLE)"
+        sql = (f"SELECT {lead}COUNT({v}) AS sample_rows, approx_quantile({v}, {_quantile_list(qs)}) AS quantiles, "
+               f"sqrt(ln(2 / 0.05) / (2 * GREATEST(COUNT({v}), 1))) AS rank_error FROM sample")
+        if keys:
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return self._query(sql, "explore_approx_quantiles")
+
+    def exact_quantiles(self, column: str, by: Sequence[str] = (), qs: Sequence[float] = PROFILE_QUANTILES):
+        keys = ", ".join(quote_ident(c) for c in by)
+        lead = keys + ", " if keys else ""
+        sql = (f"SELECT {lead}quantile_cont(CAST({quote_ident(column)} AS DOUBLE), {_quantile_list(qs)}) AS quantiles "
+               f"FROM data")
+        if keys:
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return self._query(sql, "explore_exact_quantiles")
+
+    # Closes now, or when the last running query (e.g. an exact one) finishes
+    def close(self) -> None:
+        with self._lock:
+            self._closing = True
+            if self._active == 0:
+                self._close_connection()
+
+
+def dataset_key(path: Path, strata: Optional[str], sample_rows: int, where: Optional[str]) -> str:
+    stat = os.stat(path)
+    parts = [str(path.resolve()), stat.st_size, stat.st_mtime_ns, strata or "", sample_rows, where or "",
+             LAYOUT_VERSION]
+    return hashlib.sha256("\0".join(map(str, parts)).encode()).hexdigest()[:20]
+
+
+# One pass for the HLL distinct counts and quantile sketches of every column
+def _build_profile(con, numeric_quantiles: Sequence[float]) -> None:
+    columns = [(name, column_type) for name, column_type, *_ in con.execute("DESCRIBE data").fetchall()]
+    exprs = []
+    for name, column_type in columns:
+        col = quote_ident(name)
+        exprs += [f"COUNT({col})", f"approx_count_distinct({col})"]
+        if is_numeric(column_type):
+            v = f"CAST({col} AS DOUBLE)"
+            exprs += [f"MIN({v})", f"MAX({v})", f"AVG({v})", f"approx_quantile({v}, {_quantile_list(numeric_quantiles)})"]
+    values = list(con.execute(f"SELECT {', '.join(exprs)} FROM data").fetchone()) if exprs else []
+    con.execute("""CREATE TABLE profile (
+        position INTEGER, "column" VARCHAR, type VARCHAR, non_null BIGINT, distinct_approx BIGINT,
+        min DOUBLE, max DOUBLE, mean DOUBLE, quantiles DOUBLE[]
+    )""")
+    rows = []
+    for position, (name, column_type) in enumerate(columns):
+        non_null, distinct = values.pop(0), values.pop(0)
+        stats = [values.pop(0) for _ in range(4)] if is_numeric(column_type) else [None] * 4
+        rows.append((position, name, column_type, non_null, distinct, *stats))
+    con.executemany("INSERT INTO profile VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def _build_sample(con, strata: Optional[str], sample_rows: int) -> None:
+    con.execute(f"SELECT setseed({SAMPLE_SEED / 100})")
+    if strata is None:
+        con.execute("CREATE TABLE strata AS SELECT 'all' AS stratum, COUNT(*) AS population, "
+                    f"LEAST(COUNT(*), {int(sample_rows)}) AS sampled FROM data")
+        weight = con.execute("SELECT population::DOUBLE / GREATEST(sampled, 1) FROM strata").fetchone()[0]
+        con.execute(f"CREATE TABLE sample AS SELECT *, 'all' AS _stratum, {weight}::DOUBLE AS _weight FROM data "
+                    f"USING SAMPLE reservoir({int(sample_rows)} ROWS) REPEATABLE ({SAMPLE_SEED})")
+        return
+    # Proportional allocation with a floor per stratum, capped at the stratum's size
+    stratum = f"COALESCE(CAST({quote_ident(strata)} AS VARCHAR), '(null)')"
+    con.execute(f"""CREATE TABLE strata AS
+        SELECT stratum, population,
+               LEAST(population, GREATEST({MIN_STRATUM_ROWS},
+                     CAST(round({int(sample_rows)} * population / SUM(population) OVER ()) AS BIGINT))) AS sampled
+        FROM (SELECT {stratum} AS stratum, COUNT(*) AS population FROM data GROUP BY 1)""")
+    con.execute(f"""CREATE TABLE sample AS
+        SELECT d.* EXCLUDE (_rn), s.population::DOUBLE / s.sampled AS _weight
+        FROM (SELECT *, row_number() OVER (PARTITION BY _stratum ORDER BY random()) AS _rn
+              FROM (SELECT *, {stratum} AS _stratum FROM data)) d
+        JOIN strata s ON d._stratum = s.stratum
+        WHERE d._rn <= s.sampled""")
+
+
+def build_dataset(path: Path, db_path: Path, strata: Optional[str] = None, sample_rows: int = SAMPLE_ROWS,
+                  where: Optional[str] = None) -> None:
+    import duckdb
+
+    with METRICS.stage("explore_load"):
+        with atomic_path(db_path) as tmp:
+            # duckdb wants to create the file itself
+            tmp.unlink()
+            con = duckdb.connect(str(tmp))
+            try:
+                con.execute(f"CREATE TABLE data AS SELECT * FROM {_reader(path)}" + (f" WHERE {where}" if where else ""))
+                _build_sample(con, strata, sample_rows)
+                _build_profile(con, PROFILE_QUANTILES)
+                population = con.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+                sampled = con.execute("SELECT COUNT(*) FROM sample").fetchone()[0]
+                con.execute("CREATE TABLE meta (key VARCHAR, value VARCHAR)")
+                con.executemany("INSERT INTO meta VALUES (?, ?)", [
+                    ("source", str(path)), ("strata", strata or ""),
+                    ("population", str(population)), ("sample_rows", str(sampled))])
+                con.execute("CHECKPOINT")
+            finally:
+                con.close()
+    METRICS.record_write("explore", db_path)
+
+
+# Keep at most `keep` scratch databases: those of datasets still referenced anywhere (open or
+# evicted but held by a session), then the most recently used
+def prune(explore_dir: Path = EXPLORE_DIR, keep: int = KEEP_DATASETS) -> None:
+    paths = list(explore_dir.glob("*.duckdb"))
+    with _DATASETS_LOCK:
+        open_paths = {dataset.db_path for dataset in list(_LIVE)}
+    closed = sorted((p for p in paths if p not in open_paths), key=lambda p: p.stat().st_mtime)
+    for path in closed[:max(len(paths) - max(keep, 1), 0)]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+# Open datasets, least recently used first; at most `keep` stay open
+_DATASETS: "OrderedDict[str, ApproxDataset]" = OrderedDict()
+_DATASETS_LOCK = threading.Lock()
+# One lock per dataset being built, so imports of different files run side by side
+_BUILD_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def _open_cached(key: str) -> Optional[ApproxDataset]:
+    dataset = _DATASETS.get(key)
+    if dataset is not None:
+        _DATASETS.move_to_end(key)
+    return dataset
+
+
+# Import `path` (once per file version and sampling options) and return its dataset; one per
+# process, shared by Streamlit sessions. `where` is a fixed SQL filter applied at import.
+# Past `keep` open datasets the least recently used is closed, then its file can be pruned.
+def open_dataset(path, strata: Optional[str] = None, sample_rows: int = SAMPLE_ROWS,
+                 where: Optional[str] = None, explore_dir: Path = EXPLORE_DIR,
+                 keep: int = KEEP_DATASETS) -> ApproxDataset:
+    path = Path(path)
+    key = dataset_key(path, strata, sample_rows, where)
+    with _DATASETS_LOCK:
+        dataset = _open_cached(key)
+        if dataset is not None:
+            return dataset
+        build_lock = _BUILD_LOCKS.setdefault(key, threading.Lock())
+    with build_lock:
+        with _DATASETS_LOCK:
+            # Built by another session while this one waited
+            dataset = _open_cached(key)
+        if dataset is not None:
+            return dataset
+        db_path = explore_dir / f"{key}.duckdb"
+        if db_path.exists():
+            METRICS.inc("invoicer_explore_datasets_total", outcome="reused")
+            os.utime(db_path)
+        else:
+            build_dataset(path, db_path, strata, sample_rows, where)
+            METRICS.inc("invoicer_explore_datasets_total", outcome="built")
+        dataset = ApproxDataset(db_path, key)
+        with _DATASETS_LOCK:
+            _DATASETS[key] = dataset
+            _BUILD_LOCKS.pop(key, None)
+            evicted = []
+            while len(_DATASETS) > max(keep, 1):
+                evicted.append(_DATASETS.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+        METRICS.inc("invoicer_explore_datasets_total", outcome="evicted")
+    prune(explore_dir, keep)
+    return dataset
+
+
+# Copy an uploaded file object to disk for DuckDB, named by a hash of its content, so uploads
+# with the same name and size but different rows get their own copy (and their own dataset)
+def save_upload(fileobj, name: str, upload_dir: Optional[Path] = None) -> Path:
+    upload_dir = upload_dir or EXPLORE_DIR / "uploads"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(prefix=".upload.", suffix=".tmp", dir=upload_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(1 << 20), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        path = upload_dir / f"{digest.hexdigest()[:16]}_{Path(name).name}"
+        if not path.exists():
+            os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return path
+
+
+class ExactRunner:
+    # Runs exact queries on a small thread pool. Asking again for a query that is running (or has
+    # finished) returns the same future, so Streamlit reruns do not start it twice.
+    def __init__(self, workers: int = EXACT_WORKERS, keep: int = 64):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exact-query")
+        self._futures: "OrderedDict[tuple, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.keep = keep
+
+    def submit(self, dataset: ApproxDataset, method: str, *args: Any) -> Future:
+        key = (dataset.key, method, repr(args))
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._pool.submit(getattr(dataset, method), *args)
+                self._futures[key] = future
+            self._futures.move_to_end(key)
+            while len(self._futures) > self.keep:
+                self._futures.popitem(last=False)
+            return future
+
+
+EXACT_RUNNER = ExactRunner()
@@ -0,0 +1,154 @@
+# Content-addressed archive of raw API responses
+# Each raw record is serialized canonically (sorted keys, compact separators), hashed with sha256
+# and stored once as a zstd-compressed blob at ARCHIVE_DIR/blobs/<ab>/<sha256>.zst. A run writes a
+# manifest, ARCHIVE_DIR/manifests/<run_id>.json.zst, listing per work unit (a customer page, a
+# customer's invoices, a chunk of credit grants) the blob hashes of its records in order, so:
+#   - records unchanged since an earlier run cost a hash and no write,
+#   - any run in the archive replays exactly into the loaders (invoicer.py --replay <run_id>),
+#   - prune() keeps the newest manifests and deletes blobs no kept run refers to.
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from .checkpoint import atomic_path
+from .metrics import METRICS
+
+ARCHIVE_DIR = Path(os.getenv("INVOICER_ARCHIVE_DIR", "data/archive"))
+ZSTD_LEVEL = int(os.getenv("INVOICER_ARCHIVE_ZSTD_LEVEL", 3))
+
+
+def canonical_bytes(record: Any) -> bytes:
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def new_run_id(suffix: Optional[str] = None) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return f"{stamp}_{suffix}" if suffix else stamp
+
+
+class BlobStore:
+    def __init__(self, root: Path = ARCHIVE_DIR, level: int = ZSTD_LEVEL):
+        self.root = Path(root)
+        self.level = level
+        self._known: Set[str] = set()
+        self._local = threading.local()
+
+    # zstd (de)compressors are not thread-safe; keep one pair per thread
+    def _codec(self):
+        if not hasattr(self._local, "codec"):
+            import zstandard
+
+            self._local.codec = (zstandard.ZstdCompressor(level=self.level), zstandard.ZstdDecompressor())
+        return self._local.codec
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest}.zst"
+
+    # Store one record if it is new; returns its hash either way
+    def put(self, record: Any) -> str:
+        data = canonical_bytes(record)
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self._known or self.blob_path(digest).exists():
+            self._known.add(digest)
+            METRICS.inc("invoicer_archive_records_total", outcome="deduplicated")
+            return digest
+        path = self.blob_path(digest)
+        with atomic_path(path) as tmp:
+            with open(tmp, "wb") as f:
+                f.write(self._codec()[0].compress(data))
+        self._known.add(digest)
+        METRICS.inc("invoicer_archive_records_total", outcome="stored")
+        METRICS.record_write("archive", path)
+        return digest
+
+    def get(self, digest: str) -> Any:
+        with open(self.blob_path(digest), "rb") as f:
+            return json.loads(self._codec()[1].decompress(f.read()))
+
+    def write_compressed(self, path: Path, data: bytes) -> None:
+        with atomic_path(path) as tmp:
+            with open(tmp, "wb") as f:
+                f.write(self._codec()[0].compress(data))
+
+    def read_compressed(self, path: Path) -> bytes:
+        with open(path, "rb") as f:
+            return self._codec()[1].decompress(f.read())
+
+
+def manifest_path(run_id: str, root: Path = ARCHIVE_DIR) -> Path:
+    return Path(root) / "manifests" / f"{run_id}.json.zst"
+
+
+class RunArchive:
+    # Collects the blobs of one run; work units are added concurrently by the fetch workers
+    def __init__(self, run_id: Optional[str] = None, store: Optional[BlobStore] = None,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.run_id = run_id or new_run_id()
+        self.store = store or BlobStore()
+        self.meta = meta or {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    # Archive the raw records of one work unit; `info` is kept in the manifest for replay
+    def add(self, key: str, records: List[Any], **info) -> List[str]:
+        hashes = [self.store.put(record) for record in records]
+        with self._lock:
+            self.entries[key] = dict(info, records=hashes)
+        return hashes
+
+    # Record a work unit whose blobs are already stored (replaying an earlier run)
+    def link(self, key: str, hashes: List[str], **info) -> None:
+        with self._lock:
+            self.entries[key] = dict(info, records=list(hashes))
+
+    def write(self) -> Path:
+        with self._lock:
+            manifest = {"run_id": self.run_id, "created_at": datetime.now(timezone.utc).isoformat(),
+                        **self.meta, "entries": self.entries}
+        path = manifest_path(self.run_id, self.store.root)
+        self.store.write_compressed(path, json.dumps(manifest).encode())
+        METRICS.record_write("archive", path)
+        return path
+
+
+def list_runs(root: Path = ARCHIVE_DIR) -> List[str]:
+    return sorted(p.name[:-len(".json.zst")] for p in (Path(root) / "manifests").glob("*.json.zst"))
+
+
+def load_manifest(run_id: str, store: Optional[BlobStore] = None) -> Dict[str, Any]:
+    store = store or BlobStore()
+    path = manifest_path(run_id, store.root)
+    if not path.exists():
+        raise FileNotFoundError(f"No archived run {run_id!r} in {store.root}; known runs: {', '.join(list_runs(store.root))}")
+    return json.loads(store.read_compressed(path))
+
+
+# Yield (key, info, records) for every work unit of an archived run, records in their original order
+def replay(run_id: str, store: Optional[BlobStore] = None) -> Iterator[Tuple[str, Dict[str, Any], List[Any]]]:
+    store = store or BlobStore()
+    for key, entry in load_manifest(run_id, store)["entries"].items():
+        info = {k: v for k, v in entry.items() if k != "records"}
+        yield key, info, [store.get(digest) for digest in entry["records"]]
+
+
+# Keep the newest `keep` manifests and delete blobs none of them refer to
+def prune(keep: int, store: Optional[BlobStore] = None) -> int:
+    store = store or BlobStore()
+    runs = list_runs(store.root)
+    for run_id in runs[:-max(keep, 1)]:
+        manifest_path(run_id, store.root).unlink()
+    live: Set[str] = set()
+    for run_id in list_runs(store.root):
+        for entry in load_manifest(run_id, store)["entries"].values():
+            live.update(entry["records"])
+    removed = 0
+    for path in (store.root / "blobs").glob("*/*.zst"):
+        if path.name[:-len(".zst")] not in live:
+            path.unlink()
+            removed += 1
+    store._known.clear()
+    return removed
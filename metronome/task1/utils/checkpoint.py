@@ -0,0 +1,65 @@
+# Checkpoints for resumable invoicer runs
+# Completed work is recorded in a _checkpoints table inside the same DuckDB database, in the same
+# transaction as the rows it covers, so a checkpoint exists if and only if its data was committed.
+# Each entry is one unit of work: a customer row, a customer's invoices, or a customer's credit grants.
+# File outputs go through atomic_path(): written to a temp file next to the target and renamed into
+# place, so a crash never leaves a half-written JSON/CSV/Parquet file behind.
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Set, Tuple
+
+CHECKPOINT_TABLE = "_checkpoints"
+
+# (kind, customer_id, rows, raw_file)
+CheckpointEntry = Tuple[str, str, int, str]
+
+
+def create_checkpoint_table(con, replace: bool = True) -> None:
+    verb = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+    con.execute(f"""{verb} {CHECKPOINT_TABLE} (
+        kind VARCHAR,
+        customer_id VARCHAR,
+        rows BIGINT,
+        raw_file VARCHAR,
+        committed_at TIMESTAMP
+    )""")
+
+
+def completed(con, kind: str) -> Set[str]:
+    rows = con.execute(f"SELECT customer_id FROM {CHECKPOINT_TABLE} WHERE kind = ?", [kind]).fetchall()
+    return {row[0] for row in rows}
+
+
+# Record finished work; call inside the transaction that appended the rows
+def record(con, entries: List[CheckpointEntry]) -> None:
+    if not entries:
+        return
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    con.executemany(f"INSERT INTO {CHECKPOINT_TABLE} VALUES (?, ?, ?, ?, ?)",
+                    [(kind, customer_id, rows, raw_file, now) for kind, customer_id, rows, raw_file in entries])
+
+
+# Yield a temp path in the target's folder; on success it replaces `path` atomically
+@contextmanager
+def atomic_path(path) -> Iterator[Path]:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    os.close(fd)
+    try:
+        yield Path(tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def atomic_write_text(path, text: str) -> None:
+    with atomic_path(path) as tmp:
+        with open(tmp, "w") as f:
+            f.write(text)
@@ -0,0 +1,371 @@
+# Local customer directory
+# Customers are kept in a DuckDB file (DIRECTORY_DB) and loaded into an in-memory index, so the app
+# resolves and searches customers without calling the API:
+#   exact    id, external_id, ingest alias or name (names are not unique; every match is returned)
+#   prefix   any indexed key, or any word of the name, starting with the query (sorted keys + bisect)
+#   fuzzy    Jaro-Winkler similarity to the name, external_id or an alias, scored by DuckDB over the
+#            stored table, for typos
+# search() pages through prefix matches; when there are fewer than a page of them (usually a typo),
+# fuzzy matches follow, best first.
+#
+# refresh() walks the customers endpoint page by page and only rewrites records whose content hash
+# changed. The page cursor is saved with each page, so an interrupted refresh resumes where it
+# stopped; customers not seen by a completed pass are removed.
+#
+#   directory = get_directory()
+#   directory.refresh_in_background()          # when older than DIRECTORY_MAX_AGE
+#   page = directory.search("acme", page=0)    # page.items: List[DirectoryEntry]
+#   entry = directory.resolve("ext_123")
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import iter_pages
+from .archive import canonical_bytes
+from .metrics import METRICS
+
+DIRECTORY_DB = Path(os.getenv("INVOICER_DIRECTORY_DB", "data/customers.db"))
+# Seconds before refresh_in_background() starts another pass
+DIRECTORY_MAX_AGE = float(os.getenv("INVOICER_DIRECTORY_MAX_AGE", 900))
+PAGE_LIMIT = 100
+PAGE_SIZE = 25
+# API pages are written to the store in batches of about this many records
+FLUSH_ROWS = 5000
+FUZZY_MIN_SCORE = 0.85
+# Prefix/fuzzy matches collected per query before paging
+MAX_MATCHES = 1000
+
+DIRECTORY_TABLE = "customer_directory"
+STATE_TABLE = "customer_directory_state"
+
+DirectoryEntry = namedtuple("DirectoryEntry", ["id", "name", "external_id", "ingest_aliases", "label"])
+SearchPage = namedtuple("SearchPage", ["items", "total", "page", "pages"])
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text: Optional[str]) -> str:
+    return _SPACE_RE.sub(" ", (text or "").casefold()).strip()
+
+
+def record_hash(record: Dict[str, Any]) -> str:
+    return hashlib.sha256(canonical_bytes(record)).hexdigest()
+
+
+def make_entry(customer_id: str, name: Optional[str], external_id: Optional[str],
+               ingest_aliases: Optional[List[str]]) -> DirectoryEntry:
+    name = name or ""
+    # Duplicate names are told apart by external id, else by the start of the id
+    label = f"{name} ({external_id or customer_id[:8]})"
+    return DirectoryEntry(customer_id, name, external_id, list(ingest_aliases or []), label)
+
+
+def to_entry(record: Dict[str, Any]) -> DirectoryEntry:
+    return make_entry(record["id"], record.get("name"), record.get("external_id"), record.get("ingest_aliases"))
+
+
+# Normalized keys an entry is found by: id, external id, aliases, the name and each later word of it
+def entry_keys(entry: DirectoryEntry) -> Set[str]:
+    keys = {normalize(entry.id), normalize(entry.external_id), *(normalize(a) for a in entry.ingest_aliases)}
+    name = normalize(entry.name)
+    words = name.split(" ")
+    keys.update(" ".join(words[i:]) for i in range(len(words)))
+    keys.discard("")
+    return keys
+
+
+def create_directory_tables(con) -> None:
+    con.execute(f"""CREATE TABLE IF NOT EXISTS {DIRECTORY_TABLE} (
+        id VARCHAR PRIMARY KEY,
+        name VARCHAR,
+        external_id VARCHAR,
+        ingest_aliases VARCHAR[],
+        record VARCHAR,
+        record_hash VARCHAR,
+        generation BIGINT,
+        refreshed_at TIMESTAMP
+    )""")
+    con.execute(f"CREATE INDEX IF NOT EXISTS {DIRECTORY_TABLE}_name ON {DIRECTORY_TABLE} (name)")
+    con.execute(f"CREATE INDEX IF NOT EXISTS {DIRECTORY_TABLE}_external_id ON {DIRECTORY_TABLE} (external_id)")
+    con.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (key VARCHAR PRIMARY KEY, value VARCHAR)")
+
+
+class _Index:
+    # In-memory lookups; mutated under CustomerDirectory._lock
+    def __init__(self):
+        self.entries: Dict[str, DirectoryEntry] = {}
+        self.hashes: Dict[str, str] = {}
+        self.exact: Dict[str, Set[str]] = {}
+        self.sorted_keys: List[Tuple[str, str]] = []
+        self._by_name: Optional[List[str]] = None
+
+    # Add or replace entries; sorted_keys is re-sorted once per batch
+    def add_many(self, items: Iterable[Tuple[DirectoryEntry, str]]) -> None:
+        items = list(items)
+        self._by_name = None
+        for entry, _ in items:
+            self.remove(entry.id)
+        for entry, digest in items:
+            self.entries[entry.id] = entry
+            self.hashes[entry.id] = digest
+            for key in entry_keys(entry):
+                self.exact.setdefault(key, set()).add(entry.id)
+                self.sorted_keys.append((key, entry.id))
+        if items:
+            self.sorted_keys.sort()
+
+    def remove(self, customer_id: str) -> None:
+        entry = self.entries.pop(customer_id, None)
+        if entry is None:
+            return
+        del self.hashes[customer_id]
+        self._by_name = None
+        for key in entry_keys(entry):
+            ids = self.exact.get(key, set())
+            ids.discard(customer_id)
+            if not ids:
+                self.exact.pop(key, None)
+            i = bisect.bisect_left(self.sorted_keys, (key, customer_id))
+            if i < len(self.sorted_keys) and self.sorted_keys[i] == (key, customer_id):
+                del self.sorted_keys[i]
+
+    # All ids ordered by name, for browsing without a query
+    def by_name(self) -> List[str]:
+        if self._by_name is None:
+            self._by_name = sorted(self.entries, key=lambda cid: (normalize(self.entries[cid].name), cid))
+        return self._by_name
+
+    def prefix(self, query: str, limit: int) -> List[str]:
+        ids: Dict[str, None] = {}
+        i = bisect.bisect_left(self.sorted_keys, (query, ""))
+        while i < len(self.sorted_keys) and len(ids) < limit:
+            key, customer_id = self.sorted_keys[i]
+            if not key.startswith(query):
+                break
+            ids[customer_id] = None
+            i += 1
+        return list(ids)
+
+
+class CustomerDirectory:
+    def __init__(self, path=DIRECTORY_DB):
+        import duckdb
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = duckdb.connect(str(self.path))
+        create_directory_tables(self.con)
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        self._index = _Index()
+        with METRICS.stage("directory_load") as stage:
+            rows = self.con.execute(
+                f"SELECT id, name, external_id, ingest_aliases, record_hash FROM {DIRECTORY_TABLE}").fetchall()
+            self._index.add_many((make_entry(*row[:4]), row[4]) for row in rows)
+            stage.records = len(rows)
+
+    def __len__(self) -> int:
+        return len(self._index.entries)
+
+    def get(self, customer_id: str) -> Optional[DirectoryEntry]:
+        return self._index.entries.get(customer_id)
+
+    # Every customer whose id, external id, alias or full name equals `term`
+    def lookup(self, term: str) -> List[DirectoryEntry]:
+        with self._lock:
+            ids = self._index.exact.get(normalize(term), ())
+            return sorted((self._index.entries[cid] for cid in ids), key=lambda e: (normalize(e.name), e.id))
+
+    # The one customer `term` names, or None when there is no match or more than one
+    def resolve(self, term: str) -> Optional[DirectoryEntry]:
+        entry = self.get(term)
+        if entry is not None:
+            return entry
+        matches = self.lookup(term)
+        return matches[0] if len(matches) == 1 else None
+
+    def search(self, query: str = "", page: int = 0, page_size: int = PAGE_SIZE, fuzzy: bool = True) -> SearchPage:
+        query = normalize(query)
+        with self._lock:
+            if not query:
+                ids = self._index.by_name()
+            else:
+                ids = self._index.prefix(query, MAX_MATCHES)
+                # Fuzzy matches only fill in when the prefix matches don't fill a page (typos)
+                if fuzzy and len(ids) < page_size:
+                    seen = set(ids)
+                    ids += [cid for cid in self._fuzzy(query, MAX_MATCHES) if cid not in seen and cid in self._index.entries]
+                    ids = ids[:MAX_MATCHES]
+            pages = max(1, -(-len(ids) // page_size))
+            page = min(max(page, 0), pages - 1)
+            items = [self._index.entries[cid] for cid in ids[page * page_size:(page + 1) * page_size]]
+        return SearchPage(items, len(ids), page, pages)
+
+    # Ids by best Jaro-Winkler similarity of the name, external id or an alias to `query`
+    def _fuzzy(self, query: str, limit: int) -> List[str]:
+        rows = self.con.execute(f"""
+            SELECT id FROM (
+                SELECT id, name, GREATEST(
+                    jaro_winkler_similarity(lower(name), $query),
+                    jaro_winkler_similarity(lower(COALESCE(external_id, '')), $query),
+                    COALESCE(list_max(list_transform(ingest_aliases, a -> jaro_winkler_similarity(lower(a), $query))), 0)
+                ) AS score
+                FROM {DIRECTORY_TABLE}
+            ) WHERE score >= $min_score
+            ORDER BY score DESC, lower(name), id LIMIT $limit""",
+            {"query": query, "min_score": FUZZY_MIN_SCORE, "limit": limit}).fetchall()
+        return [row[0] for row in rows]
+
+    # Raw API records, e.g. to write customers.csv without fetching again
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.con.execute(f"SELECT record FROM {DIRECTORY_TABLE} ORDER BY name, id").fetchall()
+        return [json.loads(record) for (record,) in rows]
+
+    def _state(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self.con.execute(f"SELECT key, value FROM {STATE_TABLE}").fetchall())
+
+    def _set_state(self, values: Dict[str, str]) -> None:
+        placeholders = ", ".join(["(?, ?)"] * len(values))
+        self.con.execute(f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES {placeholders}",
+                         [item for pair in values.items() for item in pair])
+
+    # Seconds since the last completed refresh (None if there has not been one)
+    def age(self) -> Optional[float]:
+        completed = self._state().get("completed_at")
+        return time.time() - float(completed) if completed else None
+
+    # Apply a batch of customer records in one transaction: rewrite the changed ones, mark every one
+    # as seen, and save the cursor to resume from
+    def _apply_batch(self, records: List[Dict[str, Any]], generation: int, next_page: Optional[str]) -> Tuple[int, int]:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        changed = []
+        for record in records:
+            digest = record_hash(record)
+            if self._index.hashes.get(record["id"]) != digest:
+                changed.append((record, digest))
+        with self._lock:
+            self.con.execute("BEGIN TRANSACTION")
+            try:
+                # Delete + insert rather than an upsert: DuckDB can't update indexed columns in place
+                if changed:
+                    import pandas as pd
+
+                    batch = pd.DataFrame(
+                        [(record["id"], record.get("name"), record.get("external_id"),
+                          list(record.get("ingest_aliases") or []), json.dumps(record), digest, generation, now)
+                         for record, digest in changed],
+                        columns=["id", "name", "external_id", "ingest_aliases", "record", "record_hash",
+                                 "generation", "refreshed_at"])
+                    self.con.execute(f"DELETE FROM {DIRECTORY_TABLE} WHERE id IN (SELECT unnest(?))", [batch["id"].tolist()])
+                    self.con.register("_directory_batch", batch)
+                    try:
+                        self.con.execute(f"INSERT INTO {DIRECTORY_TABLE} BY NAME SELECT * FROM _directory_batch")
+                    finally:
+                        self.con.unregister("_directory_batch")
+                self.con.execute(f"UPDATE {DIRECTORY_TABLE} SET generation = ? WHERE id IN (SELECT unnest(?))",
+                                 [generation, [record["id"] for record in records]])
+                self._set_state({"generation": str(generation), "cursor": next_page or ""})
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+            self._index.add_many((to_entry(record), digest) for record, digest in changed)
+        return len(changed), len(records) - len(changed)
+
+    # One pass over the customers endpoint (or `pages`, e.g. from a mock); returns counts
+    def refresh(self, pages: Optional[Iterable[Dict[str, Any]]] = None) -> Dict[str, int]:
+        with self._refresh_lock:
+            state = self._state()
+            cursor = state.get("cursor")
+            generation = int(state.get("generation", 0)) + (0 if cursor else 1)
+            if pages is None:
+                params: Dict[str, Any] = {"limit": PAGE_LIMIT}
+                if cursor:
+                    params["next_page"] = cursor
+                pages = iter_pages("GET", "customers", params)
+            stats = {"changed": 0, "unchanged": 0, "removed": 0}
+            with METRICS.stage("directory_refresh") as stage:
+                batch: List[Dict[str, Any]] = []
+
+                def flush() -> None:
+                    changed, unchanged = self._apply_batch(batch, generation, cursor)
+                    stats["changed"] += changed
+                    stats["unchanged"] += unchanged
+                    stage.records += len(batch)
+                    batch.clear()
+
+                for page in pages:
+                    if "error" in page:
+                        # Keep what was read; the next refresh resumes from the failed page
+                        flush()
+                        self.last_error = str(page["error"])
+                        METRICS.inc("invoicer_directory_refresh_total", outcome="error")
+                        return stats
+                    batch.extend(page.get("data", []))
+                    cursor = page.get("next_page")
+                    if len(batch) >= FLUSH_ROWS:
+                        flush()
+                flush()
+                with self._lock:
+                    removed = [row[0] for row in self.con.execute(
+                        f"DELETE FROM {DIRECTORY_TABLE} WHERE generation < ? RETURNING id", [generation]).fetchall()]
+                    for customer_id in removed:
+                        self._index.remove(customer_id)
+                    self._set_state({"cursor": "", "completed_at": str(time.time())})
+                stats["removed"] = len(removed)
+            self.last_error = None
+            for outcome, count in stats.items():
+                METRICS.inc("invoicer_directory_records_total", count, outcome=outcome)
+            METRICS.inc("invoicer_directory_refresh_total", outcome="completed")
+            return stats
+
+    # Start a refresh on a daemon thread when the directory is stale and none is running
+    def refresh_in_background(self, max_age: float = DIRECTORY_MAX_AGE) -> bool:
+        age = self.age()
+        if age is not None and age < max_age:
+            return False
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return False
+            self._refresh_thread = threading.Thread(target=self._refresh_quietly, name="customer-directory", daemon=True)
+            self._refresh_thread.start()
+        return True
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            self.last_error = repr(e)
+
+    @property
+    def refreshing(self) -> bool:
+        return self._refresh_thread is not None and self._refresh_thread.is_alive()
+
+    def close(self) -> None:
+        with self._lock:
+            self.con.close()
+
+
+_DIRECTORIES: Dict[str, CustomerDirectory] = {}
+_DIRECTORIES_LOCK = threading.Lock()
+
+
+# One directory per database file per process (Streamlit sessions share it)
+def get_directory(path=DIRECTORY_DB) -> CustomerDirectory:
+    key = str(Path(path).resolve())
+    with _DIRECTORIES_LOCK:
+        if key not in _DIRECTORIES:
+            _DIRECTORIES[key] = CustomerDirectory(path)
+        return _DIRECTORIES[key]
@@ -0,0 +1,502 @@
+# Streaming ingestion of usage events
+# Tails NDJSON files and/or reads NDJSON from a local TCP socket, validates each event and its
+# `properties` (the egress "{num_images=3, image_size=1024x1024}" encoding) and appends
+# micro-batches to the `events` table, flushing when a batch reaches max_rows or max_latency.
+# A batch is parsed as a whole: pyarrow reads the NDJSON into columns and DuckDB checks the
+# fields, casts the timestamps and pulls num_images out of `properties`. Only lines that fail
+# those checks (or a batch pyarrow cannot read, e.g. one with a malformed line) go through the
+# per-event pydantic path, which decides whether they are rejected.
+# Each batch is a single transaction that:
+#   - inserts the events with INSERT OR IGNORE on transaction_id, so an event seen before (resent,
+#     replayed after a restart, or arriving from two sources) is dropped,
+#   - adds the inserted events to event_counters, running totals per customer and event type,
+#   - advances event_offsets for the files it came from, so a restart resumes after the last
+#     committed batch instead of rereading whole files.
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from .metrics import METRICS
+
+EVENT_COLUMNS = ["transaction_id", "customer_id", "timestamp", "event_type", "properties", "environment_type"]
+
+
+class UsageEvent(BaseModel):
+    transaction_id: str
+    customer_id: str
+    timestamp: datetime
+    event_type: str
+    properties: Optional[str] = None
+    environment_type: Optional[str] = None
+
+
+_EVENT_BATCH = TypeAdapter(List[UsageEvent])
+
+# Timestamps the batch path casts itself: naive ISO 8601, or UTC with a trailing Z. Others (offsets,
+# bare dates, epoch numbers) are left to pydantic.
+_TIMESTAMP_RE = r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?Z?"
+# What parse_properties() accepts: {key=value, ...} with non-blank keys
+_PROPERTIES_RE = r"\s*\{\s*([^=,\s][^=,]*=[^,]*(,\s*[^=,\s][^=,]*=[^,]*)*)?\s*\}\s*"
+_NUM_IMAGES_RE = r"[{,]\s*num_images\s*=\s*(-?\d+)\s*[,}]"
+
+# Columns of a parsed batch: the events columns plus num_images and the line's position in the batch
+_PARSE_SQL = f"""
+    SELECT _line, transaction_id, customer_id, ts AS timestamp, event_type, properties, environment_type,
+           COALESCE(num_images, 0) AS num_images,
+           transaction_id IS NOT NULL AND customer_id IS NOT NULL AND event_type IS NOT NULL AND ts IS NOT NULL
+           AND (properties IS NULL OR (regexp_full_match(properties, '{_PROPERTIES_RE}')
+                                       AND (num_images IS NOT NULL OR NOT contains(properties, 'num_images'))))
+               AS ok
+    FROM (
+        SELECT *,
+               TRY_CAST(CASE WHEN regexp_full_match(timestamp, '{_TIMESTAMP_RE}') THEN rtrim(timestamp, 'Z') END
+                        AS TIMESTAMP) AS ts,
+               TRY_CAST(regexp_extract(properties, '{_NUM_IMAGES_RE}', 1) AS BIGINT) AS num_images
+        FROM _event_raw
+    )"""
+
+# (source, inode, offset after the last complete line, lines); inode/offset are None for sockets
+InboxItem = Tuple[str, Optional[int], Optional[int], List[bytes]]
+
+
+# "{num_images=3, image_size=1024x1024}" -> {"num_images": 3, "image_size": "1024x1024"}
+def parse_properties(value: Optional[str]) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    text = value.strip()
+    if not (text.startswith("{") and text.endswith("}")):
+        raise ValueError(f"properties must look like {{key=value, ...}}, got {value!r}")
+    props: Dict[str, Any] = {}
+    body = text[1:-1].strip()
+    if not body:
+        return props
+    for pair in body.split(","):
+        key, sep, raw = pair.partition("=")
+        if not sep or not key.strip():
+            raise ValueError(f"properties must look like {{key=value, ...}}, got {value!r}")
+        raw = raw.strip()
+        props[key.strip()] = int(raw) if raw.lstrip("-").isdigit() else raw
+    return props
+
+
+def _utc_naive(dt: datetime) -> datetime:
+    return dt if dt.tzinfo is None else dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _table_exists(con, table: str) -> bool:
+    return con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table]).fetchone()[0] > 0
+
+
+def create_event_tables(con) -> None:
+    if _table_exists(con, "events"):
+        # An events table loaded from the CSV dump has no key; dedup needs a unique index
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS events_transaction_id ON events (transaction_id)")
+    else:
+        con.execute("""CREATE TABLE events (
+            transaction_id VARCHAR PRIMARY KEY, customer_id VARCHAR, timestamp TIMESTAMP,
+            event_type VARCHAR, properties VARCHAR, environment_type VARCHAR)""")
+    if not _table_exists(con, "event_counters"):
+        con.execute("""CREATE TABLE event_counters (
+            customer_id VARCHAR, event_type VARCHAR, events BIGINT, num_images BIGINT,
+            first_event_at TIMESTAMP, last_event_at TIMESTAMP, updated_at TIMESTAMP,
+            PRIMARY KEY (customer_id, event_type))""")
+        # Start the counters from whatever the events table already holds
+        con.execute(r"""
+            INSERT INTO event_counters
+            SELECT customer_id, event_type, COUNT(*),
+                   COALESCE(SUM(TRY_CAST(regexp_extract(properties, 'num_images=(-?\d+)', 1) AS BIGINT)), 0),
+                   MIN(timestamp), MAX(timestamp), now() AT TIME ZONE 'UTC'
+            FROM events GROUP BY ALL""")
+    con.execute("""CREATE TABLE IF NOT EXISTS event_offsets (
+        source VARCHAR PRIMARY KEY, inode BIGINT, "offset" BIGINT, updated_at TIMESTAMP)""")
+
+
+# Key a tailed file is checkpointed under in event_offsets, the same however the path was spelled
+def file_source(path) -> str:
+    return os.path.abspath(path)
+
+
+def committed_offsets(con) -> Dict[str, Tuple[int, int]]:
+    rows = con.execute('SELECT source, inode, "offset" FROM event_offsets').fetchall()
+    return {source: (inode, offset) for source, inode, offset in rows}
+
+
+class FileTailer(threading.Thread):
+    # Follows one NDJSON file like `tail -F`: waits for it to appear, reads complete lines in
+    # chunks, and reopens from the start when the file is replaced or truncated
+    def __init__(self, path, inbox: "queue.Queue[InboxItem]", start: Optional[Tuple[int, int]] = None,
+                 poll: float = 0.05, chunk_bytes: int = 1 << 16):
+        super().__init__(daemon=True, name=f"tail:{path}")
+        self.path = Path(path)
+        self.source = file_source(path)
+        self.inbox = inbox
+        self.start_at = start
+        self.poll = poll
+        self.chunk_bytes = chunk_bytes
+        self._stopping = threading.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _open(self):
+        f = open(self.path, "rb")
+        inode = os.fstat(f.fileno()).st_ino
+        offset = 0
+        # Resume from the committed offset only if it is still the same file
+        if self.start_at and self.start_at[0] == inode:
+            offset = self.start_at[1]
+            f.seek(offset)
+        self.start_at = None
+        return f, inode, offset
+
+    def _replaced(self, inode: int, position: int) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return stat.st_ino != inode or stat.st_size < position
+
+    def run(self) -> None:
+        f = None
+        buffer = b""
+        while not self._stopping.is_set():
+            if f is None:
+                if not self.path.exists():
+                    self._stopping.wait(self.poll)
+                    continue
+                f, inode, consumed = self._open()
+                buffer = b""
+            data = f.read(self.chunk_bytes)
+            if not data:
+                if self._replaced(inode, consumed + len(buffer)):
+                    f.close()
+                    f = None
+                else:
+                    self._stopping.wait(self.poll)
+                continue
+            buffer += data
+            end = buffer.rfind(b"\n")
+            if end < 0:
+                continue
+            lines, buffer = buffer[:end].split(b"\n"), buffer[end + 1:]
+            consumed += end + 1
+            self.inbox.put((self.source, inode, consumed, lines))
+        if f is not None:
+            f.close()
+
+
+class SocketSource:
+    # Local TCP listener; each connection streams NDJSON lines
+    def __init__(self, host: str, port: int, inbox: "queue.Queue[InboxItem]"):
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                source = "socket:{}:{}".format(*self.client_address[:2])
+                buffer = b""
+                while True:
+                    data = self.request.recv(1 << 16)
+                    if not data:
+                        break
+                    buffer += data
+                    end = buffer.rfind(b"\n")
+                    if end >= 0:
+                        inbox.put((source, None, None, buffer[:end].split(b"\n")))
+                        buffer = buffer[end + 1:]
+                if buffer.strip():
+                    inbox.put((source, None, None, [buffer]))
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="events-socket")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class EventIngestor:
+    # Single writer: drains the inbox and commits a micro-batch every max_rows lines or
+    # max_latency seconds after the first line of the batch arrived, whichever comes first.
+    # Batches are parsed on the collecting thread and committed on a writer thread, so parsing the
+    # next batch overlaps the insert and commit of the previous one (both release the GIL).
+    def __init__(self, con, max_rows: int = 5000, max_latency: float = 0.25, queue_size: int = 1024,
+                 lag_samples: int = 1_000_000):
+        self.con = con
+        # Parsing runs its DuckDB checks on its own cursor, outside the writer's transaction
+        self._parse_con = con.cursor()
+        # Parsed batches waiting for the writer; small, so a slow writer holds back the inbox
+        self._parsed: "queue.Queue[Optional[Tuple]]" = queue.Queue(maxsize=2)
+        self.max_rows = max_rows
+        self.max_latency = max_latency
+        self.inbox: "queue.Queue[InboxItem]" = queue.Queue(maxsize=queue_size)
+        self.counters: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.stats = {"received": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "batches": 0}
+        # Seconds from each inserted event's timestamp to the commit that made it visible
+        self.lags: "deque[float]" = deque(maxlen=lag_samples)
+        # First exception raised while parsing or writing; raised again by stop()
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="events-ingestor")
+        self._writer = threading.Thread(target=self._write_batches, daemon=True, name="events-writer")
+        create_event_tables(con)
+        for (customer_id, event_type, events, num_images, last_event_at) in con.execute(
+                "SELECT customer_id, event_type, events, num_images, last_event_at FROM event_counters").fetchall():
+            self.counters[(customer_id, event_type)] = {"events": events, "num_images": num_images,
+                                                        "last_event_at": last_event_at}
+
+    def start(self) -> None:
+        self._writer.start()
+        self._thread.start()
+
+    # Flush whatever is buffered and stop; call after the sources have stopped. Raises the error
+    # that stopped ingestion, if any (see `error`).
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._writer.join()
+        if self.error is not None:
+            raise self.error
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            if self.error is None:
+                self.error = error
+        METRICS.log("events_ingest_failed", error=repr(error))
+
+    def _run(self) -> None:
+        lines: List[bytes] = []
+        offsets: Dict[str, Tuple[int, int]] = {}
+        first_at = None
+        try:
+            while True:
+                timeout = self.max_latency if first_at is None else max(0.0, first_at + self.max_latency - time.monotonic())
+                try:
+                    source, inode, offset, chunk = self.inbox.get(timeout=timeout)
+                    # After a failure the inbox is still drained, so sources never block, but nothing
+                    # more is written: their offsets stay at the last committed batch
+                    if self.error is not None:
+                        continue
+                    lines.extend(chunk)
+                    if inode is not None:
+                        offsets[source] = (inode, offset)
+                    if first_at is None:
+                        first_at = time.monotonic()
+                except queue.Empty:
+                    if self._stop.is_set():
+                        break
+                if lines and (len(lines) >= self.max_rows or time.monotonic() - first_at >= self.max_latency):
+                    self._parsed.put(self._prepare(lines, offsets))
+                    lines, offsets, first_at = [], {}, None
+            if lines and self.error is None:
+                self._parsed.put(self._prepare(lines, offsets))
+        except Exception as e:
+            self._fail(e)
+            # Keep draining so the sources can still be stopped
+            while not self._stop.is_set():
+                try:
+                    self.inbox.get(timeout=self.max_latency)
+                except queue.Empty:
+                    pass
+        finally:
+            self._parsed.put(None)
+
+    def _write_batches(self) -> None:
+        while True:
+            batch = self._parsed.get()
+            if batch is None:
+                break
+            # Batches after a failed one are dropped: committing them would move the offsets past
+            # lines that were never written
+            if self.error is not None:
+                continue
+            try:
+                self._write(*batch)
+            except Exception as e:
+                self._fail(e)
+
+    # Parse and commit one batch on the calling thread
+    def flush(self, lines: List[bytes], offsets: Dict[str, Tuple[int, int]]) -> int:
+        return self._write(*self._prepare(lines, offsets))
+
+    # -> (lines received, parsed events or None, offsets), the arguments of _write()
+    def _prepare(self, lines: List[bytes], offsets: Dict[str, Tuple[int, int]]) -> Tuple:
+        received = len(lines)
+        lines = [line for line in lines if line.strip()]
+        return received, self._parse(lines) if lines else None, offsets
+
+    # Parse a batch into an Arrow table of valid events (the events columns, num_images and _line)
+    # with pyarrow and DuckDB; lines that fail the batch checks are handed to _parse_events()
+    def _parse(self, lines: List[bytes]):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.json as pj
+
+        # Every field is read as a string; _PARSE_SQL does the typing
+        schema = pa.schema([(column, pa.string()) for column in EVENT_COLUMNS])
+        try:
+            raw = pj.read_json(pa.BufferReader(b"\n".join(lines)),
+                               read_options=pj.ReadOptions(block_size=max(1 << 20, sum(map(len, lines)) // 8)),
+                               parse_options=pj.ParseOptions(explicit_schema=schema,
+                                                             unexpected_field_behavior="ignore"))
+        except pa.ArrowInvalid:
+            raw = None
+        if raw is None or raw.num_rows != len(lines):
+            return self._parse_events(lines, range(len(lines)))
+        raw = raw.append_column("_line", pa.array(range(len(lines)), pa.int64()))
+        self._parse_con.register("_event_raw", raw)
+        try:
+            parsed = self._parse_con.execute(_PARSE_SQL).fetch_arrow_table()
+        finally:
+            self._parse_con.unregister("_event_raw")
+        ok = parsed.column("ok")
+        valid = parsed.filter(ok).drop_columns(["ok"])
+        bad = parsed.filter(pc.invert(ok)).column("_line").to_pylist()
+        if not bad:
+            return valid
+        return pa.concat_tables([valid, self._parse_events([lines[i] for i in bad], bad)])
+
+    # Per-event path: json.loads, pydantic and parse_properties() decide what is valid and count
+    # the rejects. `positions` are the lines' places in the batch.
+    def _parse_events(self, lines: List[bytes], positions):
+        import pyarrow as pa
+
+        raw, raw_positions = [], []
+        for line, position in zip(lines, positions):
+            try:
+                raw.append(json.loads(line))
+                raw_positions.append(position)
+            except ValueError:
+                METRICS.inc("events_rejected_total", reason="json")
+                self.stats["rejected"] += 1
+        try:
+            events = list(zip(_EVENT_BATCH.validate_python(raw), raw_positions))
+        except ValidationError:
+            # Validate one by one to keep the good events of a batch with a bad one
+            events = []
+            for item, position in zip(raw, raw_positions):
+                try:
+                    events.append((UsageEvent.model_validate(item), position))
+                except ValidationError:
+                    METRICS.inc("events_rejected_total", reason="validation")
+                    self.stats["rejected"] += 1
+        valid, num_images = [], []
+        for event, position in events:
+            try:
+                images = parse_properties(event.properties).get("num_images")
+            except ValueError:
+                METRICS.inc("events_rejected_total", reason="properties")
+                self.stats["rejected"] += 1
+                continue
+            valid.append((event, position))
+            num_images.append(images if isinstance(images, int) else 0)
+        return pa.table({
+            "_line": pa.array([position for _, position in valid], pa.int64()),
+            "transaction_id": pa.array([e.transaction_id for e, _ in valid], pa.string()),
+            "customer_id": pa.array([e.customer_id for e, _ in valid], pa.string()),
+            "timestamp": pa.array([_utc_naive(e.timestamp) for e, _ in valid], pa.timestamp("us")),
+            "event_type": pa.array([e.event_type for e, _ in valid], pa.string()),
+            "properties": pa.array([e.properties for e, _ in valid], pa.string()),
+            "environment_type": pa.array([e.environment_type for e, _ in valid], pa.string()),
+            "num_images": pa.array(num_images, pa.int64()),
+        })
+
+    def _write(self, received: int, events, offsets: Dict[str, Tuple[int, int]]) -> int:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        start = time.perf_counter()
+        valid = events.num_rows if events is not None else 0
+        new, deltas = None, None
+        self.con.begin()
+        try:
+            if valid:
+                # First occurrence of each transaction_id in the batch; the table's unique key
+                # drops events seen in earlier batches
+                first = events.group_by("transaction_id", use_threads=False).aggregate([("_line", "min")])
+                batch = events.filter(pc.is_in(events.column("_line"), value_set=first.column("_line_min")))
+                columns = ", ".join(EVENT_COLUMNS)
+                self.con.register("_event_batch", batch)
+                try:
+                    inserted = self.con.execute(
+                        f"INSERT OR IGNORE INTO events ({columns}) SELECT {columns} FROM _event_batch "
+                        "RETURNING transaction_id").fetch_arrow_table().column(0)
+                finally:
+                    self.con.unregister("_event_batch")
+                new = batch.filter(pc.is_in(batch.column("transaction_id"), value_set=inserted))
+                if new.num_rows:
+                    deltas = new.group_by(["customer_id", "event_type"], use_threads=False).aggregate([
+                        ("transaction_id", "count"), ("num_images", "sum"),
+                        ("timestamp", "min"), ("timestamp", "max")]).rename_columns(
+                        ["customer_id", "event_type", "events", "num_images", "first_event_at", "last_event_at"])
+                    self._apply_counters(deltas)
+            if offsets:
+                self.con.executemany(
+                    'INSERT OR REPLACE INTO event_offsets VALUES (?, ?, ?, now() AT TIME ZONE \'UTC\')',
+                    [(source, inode, offset) for source, (inode, offset) in offsets.items()])
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
+        inserted = new.num_rows if new is not None else 0
+        lags: List[float] = []
+        if inserted:
+            # Seconds from each inserted event's timestamp to the commit that made it visible
+            committed = pa.scalar(datetime.now(timezone.utc).replace(tzinfo=None), pa.timestamp("us"))
+            micros = pc.subtract(committed, new.column("timestamp")).cast(pa.int64())
+            lags = pc.divide(micros.cast(pa.float64()), 1e6).to_pylist()
+        with self._lock:
+            for delta in deltas.to_pylist() if deltas is not None else []:
+                key = (delta["customer_id"], delta["event_type"])
+                total = self.counters.setdefault(key, {"events": 0, "num_images": 0, "last_event_at": None})
+                total["events"] += delta["events"]
+                total["num_images"] += delta["num_images"]
+                if total["last_event_at"] is None or delta["last_event_at"] > total["last_event_at"]:
+                    total["last_event_at"] = delta["last_event_at"]
+            self.lags.extend(lags)
+        self.stats["received"] += received
+        self.stats["inserted"] += inserted
+        self.stats["duplicates"] += valid - inserted
+        self.stats["batches"] += 1
+        METRICS.inc("events_inserted_total", inserted)
+        METRICS.inc("events_duplicates_total", valid - inserted)
+        METRICS.observe("events_batch_seconds", time.perf_counter() - start)
+        if lags:
+            METRICS.observe("events_ingest_lag_seconds", max(lags))
+        return inserted
+
+    # One set-based upsert of the batch's per-key deltas (an Arrow table); executemany would run
+    # the ON CONFLICT statement once per counter
+    def _apply_counters(self, deltas) -> None:
+        self.con.register("_counter_batch", deltas)
+        try:
+            self.con.execute("""
+                INSERT INTO event_counters
+                SELECT customer_id, event_type, events, num_images, first_event_at, last_event_at,
+                       now() AT TIME ZONE 'UTC'
+                FROM _counter_batch
+                ON CONFLICT (customer_id, event_type) DO UPDATE SET
+                    events = events + EXCLUDED.events,
+                    num_images = num_images + EXCLUDED.num_images,
+                    first_event_at = least(first_event_at, EXCLUDED.first_event_at),
+                    last_event_at = greatest(last_event_at, EXCLUDED.last_event_at),
+                    updated_at = EXCLUDED.updated_at""")
+        finally:
+            self.con.unregister("_counter_batch")
+
+    # Copy of the running counters, safe to read from other threads
+    def counter_snapshot(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        with self._lock:
+            return {key: dict(value) for key, value in self.counters.items()}
@@ -0,0 +1,208 @@
+# Point-in-time credit balance ledger
+# Every Deduction and pending deduction of a CreditGrant is stored as one row in credit_ledger,
+# kept sorted by (customer_id, credit_grant_id, effective_at). The API returns a grant with its
+# full deductions list, so loading a grant replaces all of its rows, like the grant row itself.
+# credit_ledger_checkpoints holds a grant's running balance every CHECKPOINT_INTERVAL distinct
+# timestamps (plus one at the grant start, which includes entries at that instant), so a balance
+# "as of T" is an ASOF join to the latest checkpoint <= T plus a sum over the entries after it up
+# to T, rather than a sum over the grant's whole history.
+# There are no indexes: DuckDB's ART indexes only serve constant point lookups, not the range and
+# ASOF joins the macros do, and keeping them up to date slows down every load.
+#
+#   SELECT * FROM credit_grant_balances_as_of(TIMESTAMP '2024-03-31', customer := '<id>')
+#   SELECT * FROM customer_credit_balances_as_of(TIMESTAMP '2024-03-31')
+#
+# Grants are 0 before their effective_at and from their expires_at on. draw_order ranks a
+# customer's live grants by priority, then earliest expiry: the order credits are consumed in.
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+LEDGER_TABLES = ["credit_ledger_grants", "credit_ledger", "credit_ledger_checkpoints"]
+# Tables each balance macro reads, for dependency tracking in utils/result_cache.py
+MACRO_TABLES = {
+    "credit_grant_balances_as_of": LEDGER_TABLES,
+    "customer_credit_balances_as_of": LEDGER_TABLES,
+}
+CHECKPOINT_INTERVAL = 32
+
+_GRANT_COLUMNS = ["credit_grant_id", "customer_id", "name", "grant_amount", "effective_at", "expires_at", "priority"]
+_ENTRY_COLUMNS = ["customer_id", "credit_grant_id", "effective_at", "entry_seq", "amount", "running_balance",
+                  "reason", "invoice_id", "created_by", "pending"]
+
+
+def parse_ts(value: Optional[str]) -> Optional[datetime]:
+    # API timestamps are ISO 8601 (often with a trailing Z); stored as naive UTC
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def create_ledger_tables(con, replace: bool = True) -> None:
+    verb = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+    con.execute(f"""{verb} credit_ledger_grants (
+        credit_grant_id VARCHAR, customer_id VARCHAR, name VARCHAR, grant_amount DOUBLE,
+        effective_at TIMESTAMP, expires_at TIMESTAMP, priority DOUBLE)""")
+    con.execute(f"""{verb} credit_ledger (
+        customer_id VARCHAR, credit_grant_id VARCHAR, effective_at TIMESTAMP, entry_seq INTEGER,
+        amount DOUBLE, running_balance DOUBLE, reason VARCHAR, invoice_id VARCHAR, created_by VARCHAR,
+        pending BOOLEAN)""")
+    con.execute(f"""{verb} credit_ledger_checkpoints (
+        credit_grant_id VARCHAR, customer_id VARCHAR, checkpoint_at TIMESTAMP, balance DOUBLE)""")
+    create_ledger_macros(con)
+
+
+def create_ledger_macros(con) -> None:
+    con.execute("""
+    CREATE OR REPLACE MACRO credit_grant_balances_as_of(as_of_ts, customer := NULL) AS TABLE
+    WITH grants AS (
+        SELECT g.*, CAST(as_of_ts AS TIMESTAMP) AS as_of
+        FROM credit_ledger_grants g
+        WHERE customer IS NULL OR g.customer_id = customer
+    ),
+    -- Latest checkpoint at or before as_of for each grant
+    seek AS (
+        SELECT g.*, c.checkpoint_at, c.balance AS checkpoint_balance
+        FROM grants g ASOF LEFT JOIN credit_ledger_checkpoints c
+          ON g.credit_grant_id = c.credit_grant_id AND g.as_of >= c.checkpoint_at
+    ),
+    -- Posted entries after the checkpoint, and pending entries, up to as_of
+    scan AS (
+        SELECT s.credit_grant_id,
+               COALESCE(SUM(l.amount) FILTER (WHERE NOT l.pending), 0) AS posted,
+               COALESCE(SUM(l.amount) FILTER (WHERE l.pending), 0) AS pending
+        FROM seek s LEFT JOIN credit_ledger l
+          ON l.credit_grant_id = s.credit_grant_id
+         AND l.effective_at <= s.as_of
+         AND (l.pending OR l.effective_at > s.checkpoint_at)
+        GROUP BY s.credit_grant_id
+    ),
+    balances AS (
+        SELECT s.customer_id, s.credit_grant_id, s.name, s.priority, s.effective_at, s.expires_at, s.as_of,
+               s.expires_at IS NOT NULL AND s.as_of >= s.expires_at AS expired,
+               s.checkpoint_at IS NULL AS not_yet_effective,
+               s.checkpoint_balance + sc.posted AS posted_balance,
+               sc.pending
+        FROM seek s JOIN scan sc ON s.credit_grant_id = sc.credit_grant_id
+    )
+    SELECT customer_id, credit_grant_id, name, priority, effective_at, expires_at, as_of, expired,
+           CASE WHEN expired OR not_yet_effective THEN 0 ELSE posted_balance END AS balance_excluding_pending,
+           CASE WHEN expired OR not_yet_effective THEN 0 ELSE posted_balance + pending END AS balance_including_pending,
+           CASE WHEN expired OR not_yet_effective THEN NULL
+                ELSE ROW_NUMBER() OVER (PARTITION BY customer_id, expired OR not_yet_effective
+                                        ORDER BY priority, expires_at, credit_grant_id) END AS draw_order
+    FROM balances
+    """)
+    con.execute("""
+    CREATE OR REPLACE MACRO customer_credit_balances_as_of(as_of_ts, customer := NULL) AS TABLE
+    SELECT customer_id,
+           SUM(balance_excluding_pending) AS credit_balance,
+           SUM(balance_including_pending) AS credit_balance_including_pending,
+           COUNT(*) FILTER (WHERE draw_order IS NOT NULL AND balance_excluding_pending > 0) AS active_grants,
+           MIN(expires_at) FILTER (WHERE draw_order IS NOT NULL AND balance_excluding_pending > 0) AS next_expiry
+    FROM credit_grant_balances_as_of(as_of_ts, customer := customer)
+    GROUP BY customer_id
+    """)
+
+
+# Split validated CreditGrant dicts into grant rows and ledger entry rows
+def ledger_rows(grants: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    grant_rows, entry_rows = [], []
+    for grant in grants:
+        grant_rows.append({
+            "credit_grant_id": grant["id"],
+            "customer_id": grant["customer_id"],
+            "name": grant["name"],
+            "grant_amount": grant["grant_amount"]["amount"],
+            "effective_at": parse_ts(grant["effective_at"]),
+            "expires_at": parse_ts(grant["expires_at"]),
+            "priority": grant["priority"],
+        })
+        for pending, entries in ((False, grant["deductions"]), (True, grant.get("pending_deductions") or [])):
+            for seq, entry in enumerate(entries):
+                entry_rows.append({
+                    "customer_id": grant["customer_id"],
+                    "credit_grant_id": entry.get("credit_grant_id") or grant["id"],
+                    "effective_at": parse_ts(entry["effective_at"]),
+                    "entry_seq": seq,
+                    "amount": entry["amount"],
+                    "running_balance": entry["running_balance"],
+                    "reason": entry["reason"],
+                    "invoice_id": entry.get("invoice_id"),
+                    "created_by": entry["created_by"],
+                    "pending": pending,
+                })
+    return grant_rows, entry_rows
+
+
+# Load a batch of grants: replace their grant rows and ledger entries, and rebuild their
+# checkpoints. Call inside the caller's transaction.
+def append(con, grant_rows: List[Dict[str, Any]], entry_rows: List[Dict[str, Any]],
+           interval: int = CHECKPOINT_INTERVAL) -> int:
+    if not grant_rows:
+        return 0
+    import pandas as pd
+
+    grants = pd.DataFrame(grant_rows, columns=_GRANT_COLUMNS)
+    entries = pd.DataFrame(entry_rows, columns=_ENTRY_COLUMNS)
+    con.register("_ledger_grants", grants)
+    con.register("_ledger_entries", entries)
+    try:
+        con.execute("DELETE FROM credit_ledger_grants WHERE credit_grant_id IN (SELECT credit_grant_id FROM _ledger_grants)")
+        con.execute("INSERT INTO credit_ledger_grants BY NAME SELECT * FROM _ledger_grants")
+        # Replaced rather than matched entry by entry: entries have no id, and entry_seq is only
+        # their position in the API's list, which can change between loads
+        con.execute("""DELETE FROM credit_ledger
+                       WHERE credit_grant_id IN (SELECT credit_grant_id FROM _ledger_grants)""")
+        con.execute("""
+            INSERT INTO credit_ledger BY NAME
+            SELECT * FROM _ledger_entries
+            ORDER BY customer_id, credit_grant_id, effective_at, pending, entry_seq""")
+        con.execute("""DELETE FROM credit_ledger_checkpoints
+                       WHERE credit_grant_id IN (SELECT credit_grant_id FROM _ledger_grants)""")
+        con.execute(f"""
+            INSERT INTO credit_ledger_checkpoints
+            WITH steps AS (
+                SELECT l.credit_grant_id, l.customer_id, l.effective_at AS checkpoint_at, SUM(l.amount) AS delta
+                FROM credit_ledger l
+                WHERE NOT l.pending AND l.credit_grant_id IN (SELECT credit_grant_id FROM _ledger_grants)
+                GROUP BY l.credit_grant_id, l.customer_id, l.effective_at
+            ),
+            running AS (
+                SELECT s.credit_grant_id, s.customer_id, s.checkpoint_at, g.effective_at AS grant_start,
+                       g.grant_amount + SUM(s.delta) OVER (PARTITION BY s.credit_grant_id ORDER BY s.checkpoint_at) AS balance,
+                       ROW_NUMBER() OVER (PARTITION BY s.credit_grant_id ORDER BY s.checkpoint_at) AS step
+                FROM steps s JOIN credit_ledger_grants g ON s.credit_grant_id = g.credit_grant_id
+            )
+            SELECT credit_grant_id, customer_id, checkpoint_at, balance FROM running
+            WHERE step % {int(interval)} = 0 AND checkpoint_at > grant_start
+            UNION ALL
+            -- The start checkpoint already covers posted entries at (or before) the grant's
+            -- effective_at, since the scan only adds entries after a checkpoint
+            SELECT g.credit_grant_id, g.customer_id, g.effective_at, g.grant_amount + COALESCE(SUM(l.amount), 0)
+            FROM _ledger_grants g LEFT JOIN credit_ledger l
+              ON l.credit_grant_id = g.credit_grant_id AND NOT l.pending AND l.effective_at <= g.effective_at
+            GROUP BY g.credit_grant_id, g.customer_id, g.effective_at, g.grant_amount
+            """)
+    finally:
+        con.unregister("_ledger_grants")
+        con.unregister("_ledger_entries")
+    return len(entry_rows)
+
+
+# Rewrite the ledger in key order after a load so scans stay sequential; appends only sort per batch
+def compact(con) -> None:
+    con.execute("""CREATE OR REPLACE TABLE credit_ledger AS
+                   SELECT * FROM credit_ledger ORDER BY customer_id, credit_grant_id, effective_at, pending, entry_seq""")
+
+
+def grant_balances_as_of(con, as_of: datetime, customer_id: Optional[str] = None):
+    return con.execute("SELECT * FROM credit_grant_balances_as_of(?, customer := ?) ORDER BY customer_id, draw_order",
+                       [as_of, customer_id])
+
+
+def customer_balances_as_of(con, as_of: datetime, customer_id: Optional[str] = None):
+    return con.execute("SELECT * FROM customer_credit_balances_as_of(?, customer := ?) ORDER BY customer_id",
+                       [as_of, customer_id])
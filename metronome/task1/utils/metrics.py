@@ -0,0 +1,286 @@
+# Lightweight metrics for the invoicer pipeline
+# Counters, gauges and histograms keyed by name + labels, exported as JSON log lines and
+# Prometheus text format. A process-wide registry, METRICS, is shared by utils and invoicer.py.
+#
+# Configuration (environment / .env):
+#   INVOICER_METRICS_DIR  write metrics.prom and metrics.jsonl into this folder at the end of a run
+#   INVOICER_METRICS_URL  POST the Prometheus text to this url (e.g. a pushgateway job url)
+#   INVOICER_EXPLAIN      set to 1 to capture DuckDB EXPLAIN ANALYZE timings for report queries
+#   INVOICER_PROFILE      write a cProfile dump (.prof, readable by pstats/snakeviz/speedscope) to this path
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .checkpoint import atomic_write_text
+
+# Seconds; covers fast local calls through slow API pages
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_UUID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+_DUCKDB_TOTAL_RE = re.compile(r"Total Time:\s*([0-9.]+)s")
+
+
+# Collapse ids in an endpoint so e.g. customers/<uuid>/invoices becomes one label value
+def endpoint_label(endpoint: str) -> str:
+    return _UUID_RE.sub("{id}", endpoint)
+
+
+def _key(name: str, labels: Dict[str, Any]) -> LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class StageTimer:
+    # Handed out by Metrics.stage(); set .records inside the block
+    def __init__(self, name: str):
+        self.name = name
+        self.records = 0
+        self.seconds = 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[LabelKey, float] = {}
+        self.gauges: Dict[LabelKey, float] = {}
+        self.histograms: Dict[LabelKey, Histogram] = {}
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    # Structured log line; kept in memory and written out with the rest of the metrics
+    def log(self, event: str, **fields) -> None:
+        record = {"ts": time.time(), "event": event, **fields}
+        with self._lock:
+            self.events.append(record)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageTimer]:
+        timer = StageTimer(name)
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds = time.perf_counter() - start
+            self.observe("invoicer_stage_seconds", timer.seconds, stage=name)
+            self.inc("invoicer_stage_records_total", timer.records, stage=name)
+            if timer.seconds > 0:
+                self.set("invoicer_stage_records_per_second", timer.records / timer.seconds, stage=name)
+            self.log("stage", stage=name, seconds=round(timer.seconds, 6), records=timer.records)
+
+    # Count bytes written to a file sink (csv, json, db)
+    def record_write(self, sink: str, path: Path) -> None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self.inc("invoicer_bytes_written_total", size, sink=sink)
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                seen = set()
+                for (name, labels), value in sorted(series.items()):
+                    if name not in seen:
+                        lines.append(f"# TYPE {name} {kind}")
+                        seen.add(name)
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            seen = set()
+            for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                # Bucket counts are already cumulative (observe() fills every bucket >= value)
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', str(bound)))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self) -> str:
+        with self._lock:
+            records = list(self.events)
+            for (name, labels), value in self.counters.items():
+                records.append({"event": "metric", "type": "counter", "name": name, "labels": dict(labels), "value": value})
+            for (name, labels), value in self.gauges.items():
+                records.append({"event": "metric", "type": "gauge", "name": name, "labels": dict(labels), "value": value})
+            for (name, labels), hist in self.histograms.items():
+                records.append({"event": "metric", "type": "histogram", "name": name, "labels": dict(labels),
+                                "count": hist.count, "sum": hist.sum,
+                                "buckets": dict(zip(map(str, hist.buckets), hist.counts))})
+        return "\n".join(json.dumps(r) for r in records) + "\n"
+
+    def write(self, out_dir: Path) -> None:
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(out_dir / "metrics.prom", self.to_prometheus())
+        atomic_write_text(out_dir / "metrics.jsonl", self.to_json_lines())
+
+    def push(self, url: str) -> None:
+        import requests
+        try:
+            requests.post(url, data=self.to_prometheus(), headers={"Content-Type": "text/plain"}, timeout=10)
+        except requests.RequestException as e:
+            print("Could not push metrics:", e)
+
+    # Write and/or push according to INVOICER_METRICS_DIR / INVOICER_METRICS_URL.
+    # `subdir` keeps concurrent runs (e.g. shard workers) from overwriting each other's files.
+    def export(self, subdir: Optional[str] = None) -> None:
+        out_dir = os.getenv("INVOICER_METRICS_DIR")
+        url = os.getenv("INVOICER_METRICS_URL")
+        if out_dir:
+            self.write(Path(out_dir) / subdir if subdir else Path(out_dir))
+        if url:
+            self.push(url)
+
+
+METRICS = Metrics()
+
+
+# Run a DuckDB query under EXPLAIN ANALYZE and record its total time; returns the plan text
+def explain_analyze(con, sql: str, name: str, params: Any = None, metrics: Metrics = METRICS) -> str:
+    start = time.perf_counter()
+    rows = con.execute(f"EXPLAIN ANALYZE {sql}", params).fetchall()
+    wall = time.perf_counter() - start
+    plan = "\n".join(str(row[-1]) for row in rows)
+    match = _DUCKDB_TOTAL_RE.search(plan)
+    seconds = float(match.group(1)) if match else wall
+    metrics.observe("duckdb_query_seconds", seconds, query=name)
+    metrics.log("duckdb_explain_analyze", query=name, seconds=seconds, plan=plan)
+    return plan
+
+
+# Time a DuckDB statement, with `params` bound if given; with INVOICER_EXPLAIN=1 the plan timings
+# are captured as well
+def timed_query(con, sql: str, name: str, params: Any = None, metrics: Metrics = METRICS):
+    # Only read-only queries are explained; EXPLAIN ANALYZE executes the statement
+    if os.getenv("INVOICER_EXPLAIN") == "1" and sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        explain_analyze(con, sql, name, params, metrics)
+    start = time.perf_counter()
+    result = con.execute(sql, params)
+    metrics.observe("duckdb_statement_seconds", time.perf_counter() - start, query=name)
+    return result
+
+
+# cProfile only sees the thread that enabled it (before Python 3.12), so worker threads profile
+# themselves with profile_thread() and their stats are merged into the run's dump. From 3.12 one
+# profiler covers every thread and a second one cannot be enabled.
+_PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class RunProfile:
+    def __init__(self, path: str):
+        self.path = path
+        self.profiler = cProfile.Profile()
+        self._lock = threading.Lock()
+        self._threads: List[cProfile.Profile] = []
+
+    def add_thread(self, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            self._threads.append(profiler)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiler)
+        with self._lock:
+            for profiler in self._threads:
+                stats.add(profiler)
+        return stats
+
+
+_ACTIVE_PROFILE: Optional[RunProfile] = None
+
+
+# Opt-in cProfile hook; returns None unless a path is given (or INVOICER_PROFILE is set)
+def start_profile(path: Optional[str] = None) -> Optional[RunProfile]:
+    global _ACTIVE_PROFILE
+    path = path or os.getenv("INVOICER_PROFILE")
+    if not path:
+        return None
+    handle = RunProfile(path)
+    _ACTIVE_PROFILE = handle
+    handle.profiler.enable()
+    return handle
+
+
+def stop_profile(handle: Optional[RunProfile]) -> None:
+    global _ACTIVE_PROFILE
+    if handle is None:
+        return
+    handle.profiler.disable()
+    if _ACTIVE_PROFILE is handle:
+        _ACTIVE_PROFILE = None
+    handle.stats().dump_stats(handle.path)
+    print(f"Wrote profile to {handle.path}")
+
+
+# Profile the calling thread into the active run profile, if there is one; wrap a worker thread's body
+@contextmanager
+def profile_thread() -> Iterator[None]:
+    handle = _ACTIVE_PROFILE
+    if handle is None or not _PER_THREAD_PROFILES:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        handle.add_thread(profiler)
+
+
+@contextmanager
+def profiled(path: Optional[str] = None) -> Iterator[None]:
+    handle = start_profile(path)
+    try:
+        yield
+    finally:
+        stop_profile(handle)
@@ -0,0 +1,120 @@
+# Staged producer/consumer pipeline
+# Each Stage runs `workers` threads that read from a bounded queue, call `fn` on each item and
+# put whatever it returns (an iterable of outputs, or None) on the next stage's queue. Bounded
+# queues give backpressure: a slow stage blocks the stages feeding it instead of buffering
+# everything in memory, so total time approaches the slowest stage rather than the sum of all.
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional
+
+from .metrics import METRICS, profile_thread
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[Any], Optional[Iterable[Any]]]
+    workers: int = 1
+    queue_size: int = 64  # Max items waiting in front of this stage
+    # Called once per worker after its input is exhausted; may return final outputs (e.g. a last batch)
+    flush: Optional[Callable[[], Optional[Iterable[Any]]]] = None
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._error: Optional[BaseException] = None
+        self._failed = threading.Event()
+
+    def _put(self, index: int, item: Any) -> None:
+        # Block for backpressure, but give up if another stage has failed
+        q = self.queues[index]
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _emit(self, index: int, outputs: Optional[Iterable[Any]]) -> None:
+        # The last stage is a sink; anything it returns is dropped
+        if outputs is None or index + 1 >= len(self.stages):
+            return
+        for output in outputs:
+            self._put(index + 1, output)
+
+    def _fail(self, err: BaseException) -> None:
+        if self._error is None:
+            self._error = err
+        self._failed.set()
+
+    def _worker(self, index: int, remaining: List[int], lock: threading.Lock) -> None:
+        # With INVOICER_PROFILE set, each worker's calls go into the run's profile
+        with profile_thread():
+            self._work(index, remaining, lock)
+
+    def _work(self, index: int, remaining: List[int], lock: threading.Lock) -> None:
+        stage = self.stages[index]
+        q = self.queues[index]
+        try:
+            while not self._failed.is_set():
+                try:
+                    item = q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                outputs = stage.fn(item)
+                if outputs is not None:
+                    outputs = list(outputs)
+                METRICS.observe("invoicer_pipeline_item_seconds", time.perf_counter() - start, stage=stage.name)
+                METRICS.inc("invoicer_pipeline_items_total", stage=stage.name)
+                self._emit(index, outputs)
+            if stage.flush and not self._failed.is_set():
+                self._emit(index, stage.flush())
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            # The last worker of a stage to finish tells every worker of the next stage to stop
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    self._put(index + 1, _DONE)
+
+    # Feed `source` into the first stage and block until every stage has drained
+    def run(self, source: Iterable[Any]) -> None:
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self._worker, args=(i, remaining, lock), name=f"{stage.name}-{w}", daemon=True)
+            for i, stage in enumerate(self.stages)
+            for w in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in source:
+                if self._failed.is_set():
+                    break
+                self._put(0, item)
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._put(0, _DONE)
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise PipelineError(f"Pipeline failed: {self._error!r}") from self._error
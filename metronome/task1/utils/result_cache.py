@@ -0,0 +1,222 @@
+# Version-keyed query result cache
+# A result is keyed on the normalized SQL, its bound parameters and the current version of every
+# table it reads (warehouse._table_versions, bumped on each load). Loading new rows into any
+# input table changes the key, so stale results are never returned; entries for old versions are
+# dropped from memory as soon as a version change is seen and age out of the disk tier.
+#
+# Two tiers, both LRU with a byte limit:
+#   memory  pyarrow Tables in this process
+#   disk    Arrow IPC files under CACHE_DIR, shared by every process and snapshot
+#
+#   cache = QueryCache()
+#   table = cache.query(con, BALANCE_REPORT_QUERY, {"as_of": as_of})
+#
+# Input tables are found by name in the SQL (plus the tables behind the ledger macros); pass
+# `tables=` to add any the query reaches indirectly. Queries with no versioned inputs are not cached,
+# and neither are queries calling now(), current_timestamp and the like: their result depends on
+# when they run, which the key does not cover. Bind the time as a parameter instead.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .checkpoint import atomic_path
+from .ledger import MACRO_TABLES
+from .metrics import METRICS, timed_query
+from .warehouse import table_versions
+
+CACHE_DIR = Path(os.getenv("INVOICER_CACHE_DIR", "data/cache"))
+MEMORY_BYTES = int(float(os.getenv("INVOICER_CACHE_MEMORY_MB", 64)) * 1024 ** 2)
+DISK_BYTES = int(float(os.getenv("INVOICER_CACHE_DISK_MB", 512)) * 1024 ** 2)
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_WHITESPACE_RE = re.compile(r"\s+")
+_COMMENT_RE = re.compile(r"--[^\n]*")
+# Functions whose result changes between runs of the same SQL over the same table versions
+_VOLATILE_RE = re.compile(
+    r"\b(now|today|current_timestamp|current_date|current_time|get_current_timestamp|get_current_time|"
+    r"localtimestamp|localtime|transaction_timestamp|random|uuid|gen_random_uuid)\b", re.IGNORECASE)
+
+
+# Collapse whitespace and drop -- comments outside string literals
+def normalize_sql(sql: str) -> str:
+    parts = sql.split("'")
+    for i in range(0, len(parts), 2):
+        parts[i] = _WHITESPACE_RE.sub(" ", _COMMENT_RE.sub(" ", parts[i]))
+    return "'".join(parts).strip().rstrip(";").strip()
+
+
+# True if `sql` (normalized, so comments are gone) calls a time or random function outside a string literal
+def is_volatile(sql: str) -> bool:
+    return any(_VOLATILE_RE.search(part) for part in sql.split("'")[::2])
+
+
+def referenced_tables(sql: str, versioned: Iterable[str], aliases: Dict[str, List[str]]) -> List[str]:
+    words = {w.lower() for w in _WORD_RE.findall(sql)}
+    tables = {t for t in versioned if t.lower() in words}
+    for name, deps in aliases.items():
+        if name.lower() in words:
+            tables.update(deps)
+    return sorted(tables)
+
+
+def _cache_key(sql: str, params: Any, versions: Sequence[Tuple[str, str]]) -> str:
+    payload = json.dumps([sql, params, list(versions)], default=str, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class QueryCache:
+    def __init__(self, cache_dir: Optional[Path] = CACHE_DIR, memory_bytes: int = MEMORY_BYTES,
+                 disk_bytes: int = DISK_BYTES, aliases: Optional[Dict[str, List[str]]] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.aliases = MACRO_TABLES if aliases is None else aliases
+        self._lock = threading.Lock()
+        # key -> (table, nbytes, {table: version})
+        self._memory: "OrderedDict[str, Tuple[Any, int, Dict[str, str]]]" = OrderedDict()
+        self._memory_used = 0
+        self._seen_versions: Dict[str, str] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "uncached": 0}
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Run `sql` through the cache; returns a pyarrow Table. `name` labels the query in the metrics.
+    # `execute()`, if given, runs the query on a miss instead of con.execute(sql, params), e.g. as
+    # a prepared statement; `sql` and `params` still make up the key.
+    def query(self, con, sql: str, params: Any = None, tables: Optional[Iterable[str]] = None,
+              name: str = "query", execute: Optional[Callable[[], Any]] = None):
+        import duckdb
+
+        try:
+            versions = table_versions(con)
+        except duckdb.CatalogException:
+            # No _table_versions in this database: nothing to key on
+            versions = {}
+        normalized = normalize_sql(sql)
+        inputs = set(referenced_tables(normalized, versions, self.aliases)) | set(tables or [])
+        if not inputs or not inputs <= versions.keys() or is_volatile(normalized):
+            self._count("uncached", name)
+            return self._execute(con, sql, params, name, execute)
+        deps = {table: versions[table] for table in sorted(inputs)}
+        self._invalidate(versions)
+        key = _cache_key(normalized, params, sorted(deps.items()))
+
+        result = self._memory_get(key)
+        if result is not None:
+            self._count("memory_hits", name)
+            return result
+        result = self._disk_get(key)
+        if result is not None:
+            self._count("disk_hits", name)
+            self._memory_put(key, result, deps)
+            return result
+
+        self._count("misses", name)
+        result = self._execute(con, sql, params, name, execute)
+        self._memory_put(key, result, deps)
+        self._disk_put(key, result)
+        return result
+
+    def _count(self, outcome: str, name: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+        METRICS.inc("invoicer_query_cache_total", outcome=outcome, query=name)
+
+    def _execute(self, con, sql: str, params: Any, name: str, execute: Optional[Callable[[], Any]] = None):
+        if execute is not None:
+            start = time.perf_counter()
+            result = execute().fetch_arrow_table()
+            METRICS.observe("duckdb_statement_seconds", time.perf_counter() - start, query=name)
+            return result
+        return timed_query(con, sql, name, params).fetch_arrow_table()
+
+    # Drop memory entries built on a table version that has since been replaced
+    def _invalidate(self, versions: Dict[str, str]) -> None:
+        with self._lock:
+            changed = {t for t, v in versions.items() if self._seen_versions.get(t, v) != v}
+            self._seen_versions.update(versions)
+            if not changed:
+                return
+            for key in [k for k, (_, _, deps) in self._memory.items() if changed & deps.keys()]:
+                self._memory_used -= self._memory.pop(key)[1]
+
+    def _memory_get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            self._memory.move_to_end(key)
+            return entry[0]
+
+    def _memory_put(self, key: str, table, deps: Dict[str, str]) -> None:
+        size = table.nbytes
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= self._memory.pop(key)[1]
+            self._memory[key] = (table, size, deps)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                self._memory_used -= self._memory.popitem(last=False)[1][1]
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.arrow"
+
+    def _disk_get(self, key: str):
+        if not self.cache_dir:
+            return None
+        import pyarrow as pa
+
+        path = self._disk_path(key)
+        try:
+            with pa.memory_map(str(path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            # Touch on read so eviction is least-recently-used, not least-recently-written
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return table
+
+    def _disk_put(self, key: str, table) -> None:
+        if not self.cache_dir:
+            return
+        import pyarrow as pa
+
+        with atomic_path(self._disk_path(key)) as tmp:
+            with pa.OSFile(str(tmp), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob("*.arrow"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if used <= self.disk_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            used -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+        if self.cache_dir:
+            for path in self.cache_dir.glob("*.arrow"):
+                path.unlink(missing_ok=True)
@@ -0,0 +1,120 @@
+# Arrow result path for DuckDB queries
+# Query results are pulled as Arrow (a whole table, or a RecordBatchReader for large results)
+# instead of fetchdf(), so strings stay in Arrow buffers rather than becoming Python objects.
+# Exports write those batches straight to CSV/Parquet, and where pandas is needed the frame is
+# pyarrow-backed (pd.ArrowDtype) so the conversion shares the Arrow buffers instead of copying.
+#
+#   result = con.execute("SELECT * FROM invoices")
+#   write_csv(stream_batches(result), "data/processed/invoices.csv")
+#
+# pyarrow and pandas are imported inside the functions, like elsewhere in utils.
+import csv
+from pathlib import Path
+from typing import Iterator
+
+from .checkpoint import atomic_path
+
+DEFAULT_BATCH_ROWS = 100_000
+
+
+# Whole result as a pyarrow.Table; `result` is what con.execute() returned
+def fetch_arrow(result):
+    return result.fetch_arrow_table()
+
+
+# Stream the result as record batches without materializing it
+def stream_batches(result, batch_rows: int = DEFAULT_BATCH_ROWS):
+    return result.fetch_record_batch(batch_rows)
+
+
+def _batches(source) -> Iterator:
+    # Table or RecordBatchReader
+    if hasattr(source, "to_batches"):
+        yield from source.to_batches()
+    else:
+        yield from source
+
+
+# pandas DataFrame over the Arrow buffers (pyarrow dtypes, no object columns)
+def to_pandas(source):
+    import pandas as pd
+    import pyarrow as pa
+
+    table = source if isinstance(source, pa.Table) else source.read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+# Read a CSV into a pyarrow-backed DataFrame (the app's summary tab)
+def read_csv(path):
+    import pandas as pd
+
+    return pd.read_csv(path, engine="pyarrow", dtype_backend="pyarrow")
+
+
+# Quote a CSV field only if it holds a delimiter, quote or line break (csv.QUOTE_MINIMAL, what
+# pandas' to_csv writes); pyarrow's "needed" style quotes every string and the header
+def _csv_quote(column):
+    import pyarrow.compute as pc
+
+    quoted = pc.binary_join_element_wise('"', pc.replace_substring(column, '"', '""'), '"', "")
+    return pc.if_else(pc.match_substring_regex(column, '[",\r\n]'), quoted, column)
+
+
+# Field text for one column, null where the field is empty: strings as they are (quoted if
+# needed), doubles as Python's repr like pandas (always with a decimal point or exponent), nested
+# values as JSON, anything else as Arrow casts it
+def _csv_field(column):
+    import json
+    import math
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    kind = column.type
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        return _csv_quote(pc.cast(column, pa.string()))
+    if pa.types.is_float64(kind):
+        # pandas writes NaN as an empty field, like NULL
+        return pa.array([None if v is None or math.isnan(v) else repr(v) for v in column.to_pylist()], pa.string())
+    if pa.types.is_floating(kind):
+        text = pc.if_else(pc.is_nan(column), None, pc.cast(column, pa.string()))
+        whole = pc.invert(pc.match_substring_regex(text, "[.en]"))
+        return pc.if_else(whole, pc.binary_join_element_wise(text, ".0", ""), text)
+    if pa.types.is_nested(kind):
+        values = [None if v is None else json.dumps(v, default=str) for v in column.to_pylist()]
+        return _csv_quote(pa.array(values, pa.string()))
+    return pc.cast(column, pa.string())
+
+
+# Write a table or batch stream to CSV one batch at a time; returns rows written. Quoting (only
+# where needed) and float formatting match pandas' to_csv, so the report matches the pandas-written
+# submissions; nested columns are written as JSON.
+def write_csv(source, path) -> int:
+    import pyarrow.compute as pc
+
+    rows = 0
+    with atomic_path(Path(path)) as tmp:
+        with open(tmp, "w", newline="") as f:
+            csv.writer(f, lineterminator="\n").writerow(source.schema.names)
+            for batch in _batches(source):
+                if not batch.num_rows:
+                    continue
+                fields = [_csv_field(column) for column in batch.columns]
+                lines = pc.binary_join_element_wise(*fields, ",", null_handling="replace")
+                f.write("\n".join(lines.to_pylist()) + "\n")
+                rows += batch.num_rows
+    return rows
+
+
+def write_parquet(source, path) -> int:
+    import pyarrow.parquet as pq
+
+    rows = 0
+    with atomic_path(Path(path)) as tmp:
+        with pq.ParquetWriter(str(tmp), source.schema) as writer:
+            for batch in _batches(source):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
@@ -0,0 +1,68 @@
+# Hash-partitioned invoicer runs
+# Customers are assigned to shard `crc32(customer_id) % N`, which is stable across processes and
+# machines. Each shard run writes its tables as Parquet under SHARD_DIR/<table>/; the merge step
+# reads every shard back into one DuckDB database. Shards can run on separate machines as long
+# as their Parquet output lands in the same folder before merging.
+import os
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .checkpoint import atomic_path
+
+SHARD_DIR = Path(os.getenv("INVOICER_SHARD_DIR", "data/shards"))
+
+
+def shard_of(customer_id: str, num_shards: int) -> int:
+    return zlib.crc32(customer_id.encode()) % num_shards
+
+
+# Parse "i/N" into (i, N)
+def parse_shard_spec(spec: str) -> Tuple[int, int]:
+    try:
+        index, total = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard spec must look like i/N, got {spec!r}")
+    if total < 1 or not 0 <= index < total:
+        raise ValueError(f"Shard index must be in [0, {total}), got {spec!r}")
+    return index, total
+
+
+def shard_name(index: int, total: int) -> str:
+    return f"shard_{index}_of_{total}"
+
+
+def shard_parquet_path(table: str, index: int, total: int, shard_dir: Path = SHARD_DIR) -> Path:
+    return shard_dir / table / f"{shard_name(index, total)}.parquet"
+
+
+# Write each table of a shard's database to Parquet for the merge step
+def export_shard(con, tables: List[str], index: int, total: int, shard_dir: Path = SHARD_DIR) -> None:
+    for table in tables:
+        # Written atomically so the merge step never reads a partial shard
+        with atomic_path(shard_parquet_path(table, index, total, shard_dir)) as tmp:
+            con.execute(f"COPY {table} TO '{tmp}' (FORMAT PARQUET)")
+
+
+# Replace each table with the union of all N shard files; fails if a shard is missing
+def merge_shards(con, tables: List[str], total: int, shard_dir: Path = SHARD_DIR) -> None:
+    for table in tables:
+        paths = [shard_parquet_path(table, i, total, shard_dir) for i in range(total)]
+        missing = [str(p) for p in paths if not p.exists()]
+        if missing:
+            raise FileNotFoundError(f"Missing shard output for {table}: {', '.join(missing)}")
+        files = ", ".join(f"'{p}'" for p in paths)
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_parquet([{files}])")
+
+
+# Launch one local worker process per shard running `script` with `--shard i/N`, and wait for all.
+# Returns the shard indexes that failed.
+def run_local_shards(script: str, total: int, extra_args: Optional[List[str]] = None) -> List[int]:
+    procs = []
+    for index in range(total):
+        cmd = [sys.executable, script, "--shard", f"{index}/{total}"] + (extra_args or [])
+        print("Starting", " ".join(cmd))
+        procs.append(subprocess.Popen(cmd))
+    return [index for index, proc in enumerate(procs) if proc.wait() != 0]
@@ -0,0 +1,205 @@
+# Snapshot publishing and read-only connections for invoicer.db
+# DuckDB allows a single writer process, so readers never open the database invoicer.py is writing.
+# The writer builds a new database in a staging file and publishes it as an immutable, versioned
+# snapshot: the file is renamed into SNAPSHOT_DIR and the CURRENT pointer is swapped atomically to
+# name it. Readers get cursors from a per-process ConnectionBroker, which follows CURRENT and moves
+# new cursors to a new snapshot as soon as it is published; cursors already handed out keep reading
+# the snapshot they started on, which is closed once the last one is returned.
+#
+#   with get_broker().cursor() as cur:
+#       cur.execute("SELECT COUNT(*) FROM invoices").fetchone()
+import os
+import shutil
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .checkpoint import atomic_write_text
+
+SNAPSHOT_DIR = Path(os.getenv("INVOICER_SNAPSHOT_DIR", "data/snapshots"))
+KEEP_SNAPSHOTS = int(os.getenv("INVOICER_KEEP_SNAPSHOTS", 3))
+CURRENT_FILE = "CURRENT"
+STAGING_FILE = "staging.db"
+
+# A checked-out cursor and the snapshot it reads
+Session = namedtuple("Session", ["cursor", "path", "version"])
+
+
+def staging_path(snapshot_dir: Path = SNAPSHOT_DIR) -> Path:
+    return snapshot_dir / STAGING_FILE
+
+
+def current_snapshot(snapshot_dir: Path = SNAPSHOT_DIR) -> Optional[Path]:
+    try:
+        name = (snapshot_dir / CURRENT_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return snapshot_dir / name if name else None
+
+
+def list_snapshots(snapshot_dir: Path = SNAPSHOT_DIR) -> List[Path]:
+    return sorted(snapshot_dir.glob("invoicer-*.db"))
+
+
+# Path for the writer to build the next snapshot in. A fresh build starts empty; with `resume`
+# a leftover staging file from a failed run is kept, or else the current snapshot is copied in
+# so checkpointed work is not redone.
+def prepare_staging(resume: bool = False, snapshot_dir: Path = SNAPSHOT_DIR) -> Path:
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    staging = staging_path(snapshot_dir)
+    wal = staging.with_name(staging.name + ".wal")
+    if not resume:
+        for path in (staging, wal):
+            if path.exists():
+                path.unlink()
+    elif not staging.exists():
+        current = current_snapshot(snapshot_dir)
+        if current is not None and current.exists():
+            shutil.copyfile(current, staging)
+    return staging
+
+
+# Publish a closed staging database as the new current snapshot and prune old ones.
+# The writer must CHECKPOINT and close its connection first so the file is self-contained.
+def publish(staging: Path, snapshot_dir: Path = SNAPSHOT_DIR, keep: int = KEEP_SNAPSHOTS) -> Path:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    target = snapshot_dir / f"invoicer-{stamp}.db"
+    with open(staging, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(staging, target)
+    atomic_write_text(snapshot_dir / CURRENT_FILE, target.name + "\n")
+    prune(snapshot_dir, keep)
+    return target
+
+
+# Delete all but the newest `keep` snapshots. Readers still on a deleted snapshot keep their
+# open file; where the OS refuses to delete an open file it is left for the next prune.
+def prune(snapshot_dir: Path = SNAPSHOT_DIR, keep: int = KEEP_SNAPSHOTS) -> None:
+    current = current_snapshot(snapshot_dir)
+    for path in list_snapshots(snapshot_dir)[:-max(keep, 1)]:
+        if path == current:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+class _Snapshot:
+    def __init__(self, path: Path, version: Any, con):
+        self.path = path
+        self.version = version
+        self.con = con
+        self.idle: List[Any] = []
+        self.leased = 0
+        self.retired = False
+
+    def close(self) -> None:
+        for cur in self.idle:
+            cur.close()
+        self.idle.clear()
+        self.con.close()
+
+
+class ConnectionBroker:
+    # Hands out read-only cursors on the latest snapshot. `source` is a snapshot folder (follows
+    # CURRENT) or a single database file (reopened when its mtime or size changes).
+    # `on_connect(con)` runs on every new snapshot connection, e.g. to ATTACH another database;
+    # `on_cursor(cur)` on every new cursor before it is first handed out, e.g. to PREPARE statements
+    # that then stay prepared while the cursor is pooled.
+    def __init__(self, source=SNAPSHOT_DIR, on_connect: Optional[Callable[[Any], None]] = None,
+                 max_idle: int = 8, on_cursor: Optional[Callable[[Any], None]] = None):
+        self.source = Path(source)
+        self.on_connect = on_connect
+        self.on_cursor = on_cursor
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+
+    # Current snapshot file and its version, without opening it
+    def resolve(self) -> Tuple[Path, Any]:
+        if self.source.is_dir():
+            path = current_snapshot(self.source)
+            if path is None:
+                raise FileNotFoundError(f"No snapshot published in {self.source}; run invoicer.py first")
+            return path, path.name
+        stat = os.stat(self.source)
+        return self.source, (stat.st_mtime_ns, stat.st_size)
+
+    def _open(self, path: Path, version: Any) -> _Snapshot:
+        # Deferred so importing utils does not load duckdb
+        import duckdb
+
+        con = duckdb.connect(str(path), read_only=True)
+        if self.on_connect:
+            self.on_connect(con)
+        return _Snapshot(path, version, con)
+
+    # Switch to a newly published snapshot; the old one closes once its cursors are returned
+    def refresh(self) -> Any:
+        path, version = self.resolve()
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                previous = self._snapshot
+                self._snapshot = self._open(path, version)
+                if previous is not None:
+                    previous.retired = True
+                    if previous.leased == 0:
+                        previous.close()
+            return self._snapshot.version
+
+    @property
+    def version(self) -> Any:
+        return self.refresh()
+
+    @contextmanager
+    def session(self) -> Iterator[Session]:
+        self.refresh()
+        with self._lock:
+            snapshot = self._snapshot
+            snapshot.leased += 1
+            cur = snapshot.idle.pop() if snapshot.idle else None
+        try:
+            if cur is None:
+                cur = snapshot.con.cursor()
+                if self.on_cursor:
+                    self.on_cursor(cur)
+            yield Session(cur, snapshot.path, snapshot.version)
+        finally:
+            with self._lock:
+                snapshot.leased -= 1
+                if cur is not None and not snapshot.retired and len(snapshot.idle) < self.max_idle:
+                    snapshot.idle.append(cur)
+                elif cur is not None:
+                    cur.close()
+                if snapshot.retired and snapshot.leased == 0:
+                    snapshot.close()
+
+    @contextmanager
+    def cursor(self):
+        with self.session() as session:
+            yield session.cursor
+
+    def close(self) -> None:
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.retired = True
+                if self._snapshot.leased == 0:
+                    self._snapshot.close()
+                self._snapshot = None
+
+
+_BROKERS: Dict[str, ConnectionBroker] = {}
+_BROKERS_LOCK = threading.Lock()
+
+
+# One broker per source per process (Streamlit sessions and service threads share it)
+def get_broker(source=SNAPSHOT_DIR, **kwargs) -> ConnectionBroker:
+    key = str(Path(source).resolve())
+    with _BROKERS_LOCK:
+        if key not in _BROKERS:
+            _BROKERS[key] = ConnectionBroker(source, **kwargs)
+        return _BROKERS[key]
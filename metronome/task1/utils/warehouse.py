@@ -0,0 +1,73 @@
+# DuckDB tables for the invoicer warehouse
+# One table per API model. Column types come from the pydantic fields; nested objects and lists
+# are stored as their Python repr (the same text pandas' to_csv produced), so the report queries
+# can keep unpacking them with convert_kv_to_json.
+# _table_versions holds a data version per table, replaced with a new random token whenever rows
+# are loaded into it; utils/result_cache.py keys cached query results on these versions.
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Type
+
+from pydantic import BaseModel
+
+from . import Customer, Invoice, CreditGrant
+
+TABLE_MODELS: Dict[str, Type[BaseModel]] = {
+    "customers": Customer,
+    "invoices": Invoice,
+    "credit_balances": CreditGrant,
+}
+
+VERSION_TABLE = "_table_versions"
+
+_SQL_TYPES = {float: "DOUBLE", int: "BIGINT", str: "VARCHAR", bool: "BOOLEAN"}
+
+
+def table_columns(model: Type[BaseModel]) -> Dict[str, str]:
+    return {name: _SQL_TYPES.get(field.annotation, "VARCHAR") for name, field in model.model_fields.items()}
+
+
+def create_tables(con, replace: bool = True) -> None:
+    verb = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+    for table, model in TABLE_MODELS.items():
+        columns = ", ".join(f'"{name}" {sql_type}' for name, sql_type in table_columns(model).items())
+        con.execute(f"{verb} {table} ({columns})")
+
+
+# Flatten one model dict into a row: nested values become their repr, scalars pass through
+def to_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: str(v) if isinstance(v, (dict, list)) else v for k, v in record.items()}
+
+
+# Append rows to a table in one statement; columns are matched by name
+def append_rows(con, table: str, rows: List[Dict[str, Any]]) -> int:
+    if not rows:
+        return 0
+    import pandas as pd
+
+    columns = list(table_columns(TABLE_MODELS[table]))
+    batch = pd.DataFrame(rows, columns=columns)
+    con.register("_append_batch", batch)
+    try:
+        con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _append_batch")
+    finally:
+        con.unregister("_append_batch")
+    return len(rows)
+
+
+def create_version_table(con, replace: bool = True) -> None:
+    verb = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+    con.execute(f"{verb} {VERSION_TABLE} (table_name VARCHAR PRIMARY KEY, version VARCHAR, loaded_at TIMESTAMP)")
+
+
+# Mark tables as changed; call in the transaction that loaded them. Versions are random rather
+# than counters so a rebuilt database never reuses the version of an older snapshot.
+def bump_versions(con, tables: Iterable[str]) -> None:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [(table, uuid.uuid4().hex, now) for table in sorted(set(tables))]
+    if rows:
+        con.executemany(f"INSERT OR REPLACE INTO {VERSION_TABLE} VALUES (?, ?, ?)", rows)
+
+
+def table_versions(con) -> Dict[str, str]:
+    return dict(con.execute(f"SELECT table_name, version FROM {VERSION_TABLE}").fetchall())
@@ -1,6 +1,5 @@
 from pydantic import BaseModel, ValidationError
 import requests
-import pandas as pd
 from typing import List, Optional, Union, Dict, Any
 from dotenv import load_dotenv
 import os
@@ -153,6 +152,8 @@ def load_and_process_data(api_results,json_file_raw,json_file_flat, csv_file):
     with open(json_file_flat, "w") as f:
         json.dump(flat_data, f)
     # Convert JSON data to a Pandas DataFrame and write to CSV
+    # pandas is imported lazily so the API client can be used without it
+    import pandas as pd
     df = pd.DataFrame(flat_data)
     df.to_csv(csv_file, index=False)
     return df
@@ -187,6 +188,7 @@ if __name__ == "__main__":
     
     # Pandas joins and merges
     print("Converting to pandas dataframes")
+    import pandas as pd
     customers_df = pd.DataFrame(flat_customer_dicts)
     customers_df.to_csv("customers.csv", index=False)
     invoices_df = pd.DataFrame(flat_invoice_dicts)